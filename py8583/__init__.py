@@ -1,2 +1,11 @@
 from . import py8583
-from . import py8583spec
\ No newline at end of file
+from . import py8583spec
+from . import py8583codec
+from . import py8583columns
+from . import py8583net
+from . import py8583server
+from . import py8583stats
+from . import py8583specfile
+from . import py8583gen
+from . import py8583translate
+from . import py8583tlv
\ No newline at end of file
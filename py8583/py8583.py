@@ -1,7 +1,8 @@
 import binascii
-import struct
+from collections.abc import Mapping
 from enum import IntEnum
 import logging
+import time
 
 # Data Type enumeration
 class DT(IntEnum):
@@ -57,58 +58,104 @@ class MsgOrigin(IntEnum):
 log = logging.getLogger('py8583')
 
 
-def MemDump(Title, data, size = 16):
-    from string import printable as PrintableString
-    printable = bytes(PrintableString, 'ascii').replace(b'\r', b'').replace(b'\n', b'') \
-                                               .replace(b'\t', b'').replace(b'\x0b', b'') \
-                                               .replace(b'\x0c', b'')
+# printable column of the dump, 0x20-0x7e as is and everything else as '.'
+_DumpPrintable = bytes(c if 0x20 <= c < 0x7f else 0x2e for c in range(256))
+
+def _DumpLines(data, size):
+    # hex and text of the whole dump are converted at once, then cut in lines ("xx " per byte)
+    Hex = binascii.hexlify(data, b' ').decode('latin-1') + ' '
+    Text = data.translate(_DumpPrintable).decode('latin-1')
+    for i in range(0, len(data), size):
+        yield i, Hex[i*3:(i+size)*3], Text[i:i+size]
 
+def MemDumpString(data, size = 16):
+    return "\n" + ''.join("{0}{1} | {2}\n".format(HexPart, "   " * (size - len(Text)), Text)
+                           for i, HexPart, Text in _DumpLines(data, size))
+
+def MemDumpDict(Title, data, size = 16):
+    # Structured form of MemDump, for JSON logging
     if( isinstance(data, bytes) == False ):
         raise TypeError("Expected bytes for data")
 
-    log.info("{} [{}]:".format(Title, len(data)))
-    TheDump = "\n"
+    return {'title': Title,
+            'length': len(data),
+            'lines': [{'offset': i, 'hex': HexPart.rstrip(), 'ascii': Text}
+                      for i, HexPart, Text in _DumpLines(data, size)]}
 
-    for line in [data[i:i+size] for i in range(0, len(data), size)]:
-        
-        for c in line:
-            try: # python 3
-                TheDump += "{:02x} ".format(c) 
-            except: # python 2.x
-                TheDump += "{:02x} ".format(ord(c))
-            
-        TheDump += "   " * (size - len(line))
-            
-        TheDump += ' | '
-        for c in line:
-            if c in printable:
-                TheDump += "{:1c}".format(c)
-            else:
-                TheDump += '.'
-            
-        TheDump += "\n"
-       
-    log.info(TheDump)
+def MemDump(Title, data, size = 16):
+    if( isinstance(data, bytes) == False ):
+        raise TypeError("Expected bytes for data")
+
+    if(log.isEnabledFor(logging.INFO) == False):
+        return
+
+    log.info("{} [{}]:".format(Title, len(data)))
+    log.info(MemDumpString(data, size))
     
 
+# Numeric conversions. Amounts, STANs, dates and lengths are most of the fields of a
+# message, so these avoid the str round trips: BCD bytes go to int through the digit
+# tables (1-2 bytes) or int() of the hexlified bytes, and ints are zero padded by
+# bytes templates (b'%06d').
+
+# the value of every BCD byte, -1 for the bytes with a non decimal nibble
+_BcdValue = tuple(High * 10 + Low if High < 10 and Low < 10 else -1 for High in range(16) for Low in range(16))
+# the BCD byte of 0-99
+_BcdByte = tuple(bytes([(Value // 10) << 4 | Value % 10]) for Value in range(100))
+
 def Bcd2Str(bcd):
-    return binascii.hexlify(bcd).decode('latin')
+    return binascii.hexlify(bcd).decode('latin-1')
 
 def Str2Bcd(string):
     if(len(string) % 2 == 1):
-        string = string.zfill(len(string) + 1)
+        string = '0' + string
     return binascii.unhexlify(string)
 
 def Bcd2Int(bcd):
-    return int(Bcd2Str(bcd))
+    Size = len(bcd)
+    if(Size == 1):
+        Value = _BcdValue[bcd[0]]
+        if(Value >= 0):
+            return Value
+    elif(Size == 2):
+        High = _BcdValue[bcd[0]]
+        Low = _BcdValue[bcd[1]]
+        if(High >= 0 and Low >= 0):
+            return High * 100 + Low
+    # int() rejects the hex digits of invalid nibbles itself
+    return int(binascii.hexlify(bcd))
 
 def Int2Bcd(integer):
+    if(type(integer) is int and 0 <= integer < 100):
+        return _BcdByte[integer]
+
     string = str(integer)
     if(len(string) % 2 == 1):
-        string = string.zfill(len(string) + 1)
+        string = '0' + string
 
     return binascii.unhexlify(string)
 
+def BcdTemplate(Digits):
+    # bytes template formatting an int to the digits of a BCD field (padded to even)
+    return '%0{0}d'.format(Digits + Digits % 2).encode('latin-1')
+
+
+def CheckMTI(MTI, Strict = False):
+    try: # MTI should only contain numbers
+        int(MTI)
+    except:
+        raise ParseError("Invalid MTI: [{0}]".format(MTI))
+    
+    if(len(MTI) != 4):
+        raise ParseError("Invalid MTI: [{0}]".format(MTI))
+        
+    if(Strict == True):
+        if(MTI[1] == '0'):
+            raise ParseError("Invalid MTI: Invalid Message type [{0}]".format(MTI))
+              
+        if(int(MTI[3]) > 5):
+            raise ParseError("Invalid MTI: Invalid Message origin [{0}]".format(MTI))
+
 
 class ParseError(Exception):
         def __init__(self, value):
@@ -127,23 +174,225 @@ class BuildError(Exception):
                 return repr(self.str)
             
             
+_HexDigits = b'0123456789ABCDEFabcdef'
+
+
+class IsoBitmap(Mapping):
+    # Fields 1-128 are kept in a single integer, field n being bit (128 - n), so the
+    # integer's big endian bytes are the primary followed by the secondary bitmap
+    __slots__ = ('Value',)
+    
+    __Secondary = (1 << 64) - 1
+    
+    def __init__(self, Value = 0):
+        self.Value = Value
+    
+    def Set(self, field):
+        if(field < 1 or field > 128):
+            raise ValueError("Invalid field F{0}".format(field))
+        self.Value |= 1 << (128 - field)
+        
+    def Clear(self, field):
+        if(field < 1 or field > 128):
+            raise ValueError("Invalid field F{0}".format(field))
+        self.Value &= ~(1 << (128 - field))
+    
+    def Test(self, field):
+        return (self.Value >> (128 - field)) & 1 == 1
+    
+    def Secondary(self):
+        return self.Value & self.__Secondary != 0 or self.Test(1)
+    
+    def Count(self):
+        return bin(self.Value).count('1')
+    
+    def Fields(self):
+        # set data fields in ascending order, field 1 excluded
+        Value = self.Value & ~(1 << 127)
+        while(Value):
+            bit = Value.bit_length() - 1
+            yield 128 - bit
+            Value ^= 1 << bit
+    
+    def Pack(self, DataType = DT.BIN):
+        if(self.Secondary()):
+            data = (self.Value | (1 << 127)).to_bytes(16, 'big')
+        else:
+            data = (self.Value >> 64).to_bytes(8, 'big')
+        
+        if(DataType == DT.ASCII):
+            return binascii.hexlify(data).upper()
+        return data
+    
+    def Unpack(self, buf, p = 0, DataType = DT.BIN):
+        if(DataType == DT.ASCII):
+            Size = 16
+            def Read(p):
+                data = bytes(buf[p:p+16])
+                # int() would also take signs, underscores and whitespace
+                if(data.translate(None, _HexDigits) != b''):
+                    raise ParseError("Invalid bitmap: [{0}]".format(data.decode('latin-1')))
+                return int(data, 16)
+        else:
+            Size = 8
+            def Read(p):
+                return int.from_bytes(buf[p:p+8], 'big')
+
+        if(len(buf) < p + Size):
+            raise ParseError("Invalid bitmap: Message too short")
+        
+        self.Value = Read(p) << 64
+        p += Size
+        
+        if(self.Value >> 127):
+            if(len(buf) < p + Size):
+                raise ParseError("Invalid bitmap: Message too short")
+            self.Value |= Read(p)
+            p += Size
+            
+        return p
+
+    # Mapping of fields 1-64 (1-128 with a secondary bitmap) to 0 or 1, as the dict
+    # older versions used for the bitmap
+    def __Size(self):
+        return 128 if self.Secondary() else 64
+    
+    def __getitem__(self, field):
+        if(type(field) is not int or field < 1 or field > self.__Size()):
+            raise KeyError(field)
+        return (self.Value >> (128 - field)) & 1
+    
+    def __setitem__(self, field, Value):
+        if(Value):
+            self.Set(field)
+        else:
+            self.Clear(field)
+            
+    def __contains__(self, field):
+        return type(field) is int and 1 <= field <= self.__Size()
+    
+    def __iter__(self):
+        return iter(range(1, self.__Size() + 1))
+    
+    def __len__(self):
+        return self.__Size()
+    
+    def __int__(self):
+        return self.Value
+    
+    def __eq__(self, other):
+        if(isinstance(other, IsoBitmap)):
+            return self.Value == other.Value
+        return Mapping.__eq__(self, other)
+    
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    
+    def __repr__(self):
+        return "IsoBitmap({0})".format(([1] if self.Test(1) else []) + list(self.Fields()))
+
+
+def PeekMTI(buf, IsoSpec):
+    # The MTI of a message (bytes or memoryview), without parsing anything else
+    MTI = IsoSpec.Compile().ParseMTI(buf, 0)[0]
+    CheckMTI(MTI)
+    return MTI
+
+def PeekBitmap(buf, IsoSpec):
+    # The bitmap of a message (bytes or memoryview), e.g. to check for a field with
+    # PeekBitmap(buf, IsoSpec).Test(field), without parsing the fields
+    Codec = IsoSpec.Compile()
+    MTI, p = Codec.ParseMTI(buf, 0)
+    CheckMTI(MTI)
+    
+    Bitmap = IsoBitmap()
+    Bitmap.Unpack(buf, p, Codec.BitmapType)
+    return Bitmap
+
+
+def WantedFields(Fields):
+    Wanted = frozenset(Fields)
+    for field in Wanted:
+        if(field < 2 or field > 128):
+            raise ValueError("Invalid field F{0}".format(field))
+    return Wanted
+
+
+def ParseWanted(Codec, buf, p, Bitmap, Wanted, FieldData = None, Spans = None):
+    # Parses only the Wanted fields: decoded into FieldData or, if Spans is given,
+    # only located. Stops after the last wanted field and skips fixed length fields
+    # without looking at them. Returns the position after the last field parsed.
+    Fields = Codec.Fields
+    Last = max(Wanted) if Wanted else 0
+
+    for field in Bitmap.Fields():
+        if(field > Last):
+            break
+        Field = Fields[field]
+        if(field in Wanted):
+            start, p = Field.Span(buf, p)
+            if(Spans != None):
+                Spans[field] = (start, p)
+            else:
+                FieldData[field] = Field.Decode(buf, start, p)
+        elif(Field.Size != None):
+            p += Field.Size
+        else:
+            p = Field.Span(buf, p)[1]
+    return p
+
+
+# Spans of a message which isn't lazily parsed
+_NoSpans = ()
+
+# Stats() not called, the message uses the class' stats
+_ClassStats = object()
+
+
 class Iso8583:
     
+    # No per message __dict__: a host keeping thousands of messages in flight holds only
+    # the slots, the bitmap (an integer) and the data of the fields present.
+    __slots__ = ('strict', 'lazy', 'wanted', '__Sink', '__MTI', '__Bitmap', '__FieldData',
+                 '__Spans', '__view', '__iso', '__Layout', '__Dirty', '__Head', '__buf', '__out', '__IsoSpec')
+    
     ValidContentTypes = ('a', 'n', 's', 'an', 'as', 'ns', 'ans', 'b', 'z')
     
+    # Sink for parse/build timings (see py8583stats). Set it on the class to instrument
+    # every message or with Stats() on a single message. None disables instrumentation.
+    stats = None
+    
     
-    def __init__(self,IsoMsg = None, IsoSpec = None):
+    def __init__(self,IsoMsg = None, IsoSpec = None, Lazy = False, Fields = None):
         
         self.strict = False
+        self.lazy = Lazy
+        self.wanted = WantedFields(Fields) if Fields != None else None
+        self.__Sink = _ClassStats
     
-        self.__Bitmap = {}
+        self.__MTI = None
+        self.__Bitmap = IsoBitmap()
         self.__FieldData = {}
+        self.__Spans = _NoSpans
+        self.__view = None
         self.__iso = b''
+        # Fields changed since the message was parsed or built (bitmap value), the
+        # others are built by copying their bytes of __iso. -1 when there's nothing
+        # to copy from.
+        self.__Dirty = -1
+        # where the fields of __iso start, its bitmap and where they end (None if not known)
+        self.__Layout = None
+        # MTI and bitmap size of the last build
+        self.__Head = 0
+        # the build buffer is allocated by the first build
+        self.__buf = None
+        self.__out = None
         
         if(IsoSpec != None):
             self.__IsoSpec = IsoSpec
         else:
-            self.__IsoSpec = py8583spec.IsoSpec1987ASCII()
+            from .py8583spec import IsoSpec1987ASCII
+            self.__IsoSpec = IsoSpec1987ASCII()
         
         if(IsoMsg != None):
             if( isinstance(IsoMsg, bytes) == False ):
@@ -153,11 +402,53 @@ class Iso8583:
             self.ParseIso()
 
 
+    @staticmethod
+    def ParseMany(Messages, IsoSpec, Fields = None):
+        # Parses an iterable of messages sharing the same spec into read-only records
+        return IsoSpec.Parser(Fields).ParseMany(Messages)
+
+
     def Strict(self, Value):
         if(Value != True and Value != False):
             raise ValueError
         self.strict = Value
 
+    def Lazy(self, Value):
+        # In lazy mode, parsing only records where each field lies in the message
+        # and the field is decoded on first access (errors in field data are
+        # raised at that point).
+        if(Value != True and Value != False):
+            raise ValueError
+        self.lazy = Value
+
+    def Wanted(self, Fields):
+        # Only the given fields are parsed (None for all of them). Parsing stops after
+        # the last of them, the other fields are missing from FieldData.
+        self.wanted = WantedFields(Fields) if Fields != None else None
+
+    def Stats(self, Sink):
+        self.__Sink = Sink
+
+    def Sink(self):
+        # the sink timing this message, the one given to Stats() or else the class' stats
+        Sink = self.__Sink
+        return self.stats if Sink is _ClassStats else Sink
+
+    def Reset(self, IsoMsg = None):
+        # Clears the message for reuse (see IsoPool), keeping its spec, modes and build
+        # buffer, and parses IsoMsg if given. The dict returned by Fields() is cleared too.
+        self.__MTI = None
+        self.__Bitmap.Value = 0
+        self.__FieldData.clear()
+        self.__Spans = _NoSpans
+        self.__view = None
+        self.__iso = b''
+        self.__Layout = None
+        self.__Dirty = -1
+        
+        if(IsoMsg != None):
+            self.SetIsoContent(IsoMsg)
+
         
     def SetIsoContent(self, IsoMsg):
         if( isinstance(IsoMsg, bytes) == False ):
@@ -168,294 +459,370 @@ class Iso8583:
     
     
     def ParseMTI(self, p):
-        DataType = self.__IsoSpec.DataType('MTI')
-        
-        if(DataType == DT.BCD):
-            self.__MTI = Bcd2Str(self.__iso[p:p+2])
-            p+=2
-        elif(DataType == DT.ASCII):
-            self.__MTI = self.__iso[p:p+4].decode('latin')
-            p+=4
-        
-        try: # MTI should only contain numbers
-            int(self.__MTI)
-        except:
-            raise ParseError("Invalid MTI: [{0}]".format(self.__MTI))
-            
-        if(self.strict == True):
-            if(self.__MTI[1] == '0'):
-                raise ParseError("Invalid MTI: Invalid Message type [{0}]".format(self.__MTI))
-                  
-            if(int(self.__MTI[3]) > 5):
-                raise ParseError("Invalid MTI: Invalid Message origin [{0}]".format(self.__MTI))
-        
+        self.__MTI, p = self.__IsoSpec.Compile().ParseMTI(self.__iso, p)
+        CheckMTI(self.__MTI, self.strict)
         return p
     
     
     def ParseBitmap(self, p):
-        DataType = self.__IsoSpec.DataType(1)
-
-        if(DataType == DT.BIN):
-            Primary = self.__iso[p:p+8]
-            p += 8
-        elif(DataType == DT.ASCII):
-            Primary = binascii.unhexlify(self.__iso[p:p+16])
-            p += 16
-                
-        IntPrimary = struct.unpack_from("!Q", Primary)[0]
-        
-        for i in range(1, 65):
-            self.__Bitmap[i] = (IntPrimary >> (64 - i)) & 0x1
-
-        if(self.__Bitmap[1] == 1):
-            if(DataType == DT.BIN):
-                Secondary = self.__iso[p:p+8]
-                p += 8
-            elif(DataType == DT.ASCII):
-                Secondary = binascii.unhexlify(self.__iso[p:p+16])
-                p += 16
-                
-            IntSecondary = struct.unpack_from("!Q", Secondary)[0]
-            
-            for i in range(1, 65):
-                self.__Bitmap[i+64] = (IntSecondary >> (64 - i)) & 0x1
-
-        return p
+        return self.__Bitmap.Unpack(self.__iso, p, self.__IsoSpec.Compile().BitmapType)
 
 
     def ParseField(self, field, p):
+        Codec = self.__IsoSpec.Compile().Fields[field]
         
-        try:
-            DataType = self.__IsoSpec.DataType(field)
-            LenType = self.__IsoSpec.LengthType(field)
-            ContentType = self.__IsoSpec.ContentType(field)
-            MaxLength = self.__IsoSpec.MaxLength(field)
-        except:
-            raise SpecError("Cannot parse F{0}: Incomplete field specification".format(field))
-
-        try:
-            if(DataType == DT.ASCII and ContentType == 'b'):
-                MaxLength *= 2
-
-            if(LenType == LT.FIXED):
-                Len = MaxLength
-            elif(LenType == LT.LVAR):
-                pass
-            elif(LenType == LT.LLVAR):
-                LenDataType = self.__IsoSpec.LengthDataType(field)
-                if(LenDataType == DT.ASCII):
-                    Len = int(self.__iso[p:p+2])
-                    p+=2
-                elif(LenDataType == DT.BCD):
-                    Len = Bcd2Int(self.__iso[p:p+1])
-                    p+=1
-                else:
-                    raise ParseError('Unsupported length data type')
-            elif(LenType == LT.LLLVAR):
-                LenDataType = self.__IsoSpec.LengthDataType(field)
-                if(LenDataType == DT.ASCII):
-                    Len = int(self.__iso[p:p+3])
-                    p+=3
-                elif(LenDataType == DT.BCD):
-                    Len = Bcd2Int(self.__iso[p:p+2])
-                    p+=2
-                else:
-                    raise ParseError('Unsupported length data type')
-        except ValueError as ex:
-            raise ParseError("Cannot parse F{0} - Invalid length: {1}".format(field, ex))
-            
-        if(Len > MaxLength):
-            raise ParseError("F{0} is larger than maximum length ({1}>{2})".format(field, Len, MaxLength))
-        
-        # In case of zero length, don't try to parse the field itself, just continue
-        if(Len == 0):
-            if(ContentType == 'n'):
-                self.__FieldData[field] = None
-            else:
-                self.__FieldData[field] = ''
-            return p
-
-        try:
-            if(DataType == DT.ASCII):
-                if(ContentType == 'n'):
-                    self.__FieldData[field] = int(self.__iso[p:p+(Len)])
-                else:
-                    self.__FieldData[field] = self.__iso[p:p+(Len)].decode('latin')
-                p += Len
-            elif(DataType == DT.BCD):
-                if(Len % 2 == 1):
-                    Len += 1
-                if(ContentType == 'n'):
-                    self.__FieldData[field] = Bcd2Int(self.__iso[p:p+(Len//2)])
-                elif(ContentType == 'z'):
-                    self.__FieldData[field] = binascii.hexlify(self.__iso[p:p+(Len//2)]).decode('latin').upper()
-                p += Len//2
-            elif(DataType == DT.BIN):
-                self.__FieldData[field] = binascii.hexlify(self.__iso[p:p+(Len)]).decode('latin').upper()
-                p += Len
-        except Exception as ex:
-            raise ParseError("Cannot parse F{}: {}".format(field, str(ex))) from None
-        
-        if(ContentType == 'z'):
-            self.__FieldData[field] = self.__FieldData[field].replace("D", "=") # in track2, replace d with =  
-            self.__FieldData[field] = self.__FieldData[field].replace("F", "") # in track2, remove trailing f
- 
+        start, p = Codec.Span(self.__iso, p)
+        self.__FieldData[field] = Codec.Decode(self.__iso, start, p)
         return p
     
     
     def ParseIso(self):
+        self.__Dirty = -1
+        self.__Layout = None
+        Start, End = self.__Parse()
+        self.__Layout = (Start, self.__Bitmap.Value, End)
+        self.__Dirty = 0
+    
+    def __Parse(self):
+        # returns where the fields start and end, the end is None if they aren't all
+        # stepped over
+        # a new dict, unless the current one is empty, so that the Fields() of the
+        # previous content stay as they are
+        if(self.__FieldData):
+            self.__FieldData = {}
+        self.__Spans = {} if self.lazy == True else _NoSpans
+        
+        if(self.Sink() != None):
+            return self.__ParseIsoStats()
+        
         p = 0
         p = self.ParseMTI(p)
-        p = self.ParseBitmap(p)
+        p = Start = self.ParseBitmap(p)
 
+        Codec = self.__IsoSpec.Compile()
+        iso = self.__iso
 
-        for field in sorted(self.__Bitmap):
-            # field 1 is parsed by the bitmap function
-            if(field != 1 and self.Field(field) == 1):
-                p = self.ParseField(field, p)
+        if(self.wanted != None):
+            if(self.lazy == True):
+                self.__view = memoryview(iso)
+                ParseWanted(Codec, iso, p, self.__Bitmap, self.wanted, Spans = self.__Spans)
+            else:
+                ParseWanted(Codec, iso, p, self.__Bitmap, self.wanted, self.__FieldData)
+            return Start, None
+
+        if(self.lazy == True):
+            self.__view = memoryview(iso)
+            Fields = Codec.Fields
+            Spans = self.__Spans
+            for field in self.__Bitmap.Fields():
+                start, p = Fields[field].Span(iso, p)
+                Spans[field] = (start, p)
+            return Start, p
+        
+        return Start, Codec.ParseFields(iso, p, self.__Bitmap, self.__FieldData)
     
     
+    def __ParseIsoStats(self):
+        # ParseIso with every phase timed
+        Sink = self.Sink()
+        Spec = self.__IsoSpec.Name()
+        iso = self.__iso
+        clock = time.perf_counter
+        self.__MTI = None
+        Phase, field = 'mti', None
+        
+        try:
+            Begin = t = clock()
+            p = self.ParseMTI(0)
+            Now = clock()
+            Sink.Record(Spec, self.__MTI, Phase, None, Now - t, p)
+            
+            Phase, t, start = 'bitmap', Now, p
+            p = Start = self.ParseBitmap(p)
+            Now = clock()
+            Sink.Record(Spec, self.__MTI, Phase, None, Now - t, p - start)
+            
+            Phase = 'field'
+            Fields = self.__IsoSpec.Compile().Fields
+            Wanted = self.wanted
+            Last = 128 if Wanted == None else max(Wanted) if Wanted else 0
+            if(self.lazy == True):
+                self.__view = memoryview(iso)
+            
+            for field in self.__Bitmap.Fields():
+                if(field > Last):
+                    break
+                t = Now
+                Codec = Fields[field]
+                start, end = Codec.Span(iso, p)
+                if(Wanted != None and field not in Wanted):
+                    pass
+                elif(self.lazy == True):
+                    self.__Spans[field] = (start, end)
+                else:
+                    self.__FieldData[field] = Codec.Decode(iso, start, end)
+                Now = clock()
+                Sink.Record(Spec, self.__MTI, Phase, field, Now - t, end - p)
+                p = end
+        except Exception:
+            # an MTI which failed to parse isn't used as a label
+            MTI = self.__MTI if Phase != 'mti' else None
+            Sink.Error(Spec, MTI, Phase, field)
+            Sink.Error(Spec, MTI, 'parse', None)
+            raise
+        
+        Sink.Record(Spec, self.__MTI, 'parse', None, Now - Begin, p)
+        return Start, p if Wanted == None else None
+    
     
+    def __DecodeField(self, field):
+        start, end = self.__Spans[field]
+        Value = self.__IsoSpec.Compile().Fields[field].Decode(self.__view, start, end)
+        self.__FieldData[field] = Value
+        return Value
+    
+    def __DecodeAll(self):
+        for field in self.__Spans:
+            if(field not in self.__FieldData):
+                self.__DecodeField(field)
 
 
 
+    def __Output(self):
+        if(self.__out == None):
+            self.__buf = self.__out = bytearray()
+        return self.__out
+    
+    
     def BuildMTI(self):
-        if(self.__IsoSpec.DataType('MTI') == DT.BCD):
-            self.__iso += Str2Bcd(self.__MTI)
-        elif(self.__IsoSpec.DataType('MTI') == DT.ASCII):
-            self.__iso += self.__MTI.encode('latin')
+        out = self.__Output()
+        out += self.__IsoSpec.Compile().BuildMTI(self.__MTI)
     
     
     def BuildBitmap(self):
-        DataType = self.__IsoSpec.DataType(1)
-        
         # check if we need a secondary bitmap
-        for i in self.__Bitmap.keys():
-            if(i > 64):
-                self.__Bitmap[1] = 1
-                break
-        
-        IntPrimary = 0
-        for i in range(1, 65):
-            if i in self.__Bitmap.keys():
-                IntPrimary |= (self.__Bitmap[i] & 0x1) << (64 - i)
-
-        Primary = struct.pack("!Q", IntPrimary)
-
-        if(DataType == DT.BIN):
-            self.__iso += Primary
-        elif(DataType == DT.ASCII):
-            self.__iso += binascii.hexlify(Primary).upper()
-            
-        # Add secondary bitmap if applicable
-        if 1 in self.__Bitmap.keys() and self.__Bitmap[1] == 1:
+        if(self.__Bitmap.Secondary()):
+            self.__Bitmap.Set(1)
         
-            IntSecondary = 0
-            for i in range(65, 129):
-                if i in self.__Bitmap.keys():
-                    IntSecondary |= (self.__Bitmap[i] & 0x1) << (128 - i)
-                
-            Secondary = struct.pack("!Q", IntSecondary)
-
-            if(DataType == DT.BIN):
-                self.__iso += Secondary
-            elif(DataType == DT.ASCII):
-                self.__iso += binascii.hexlify(Secondary)
+        out = self.__Output()
+        out += self.__Bitmap.Pack(self.__IsoSpec.Compile().BitmapType)
             
             
     def BuildField(self, field):
+        out = self.__Output()
+        out += self.__IsoSpec.Compile().Fields[field].Encode(self.__FieldData[field])
+
+
+    def BuildIsoInto(self, buf, offset = 0):
+        # Builds the message into a bytearray starting at offset and returns the end
+        # offset. Anything before offset (e.g. a length header) is left untouched.
+        if( isinstance(buf, bytearray) == False ):
+            raise TypeError("Expected bytearray for buffer")
+        
+        if(self.Sink() != None):
+            return self.__BuildIsoStats(buf, offset)
+        
+        if(len(buf) < offset):
+            buf.extend(bytes(offset - len(buf)))
+        del buf[offset:]
+        
+        self.__out = buf
+        self.BuildMTI()
+        self.BuildBitmap()
+        self.__Head = len(buf) - offset
+        
+        if(self.__Dirty != -1):
+            # only the changed fields are encoded, lazy ones don't need decoding
+            self.__Splice(buf, self.__Bitmap.Value, ~self.__Dirty, self.__EncodeField)
+        else:
+            self.__DecodeAll()
+            self.__IsoSpec.Compile().BuildFields(buf, self.__Bitmap, self.__FieldData)
+        
+        return len(buf)
+    
+    
+    def __EncodeField(self, field):
         try:
-            DataType = self.__IsoSpec.DataType(field)
-            LenType = self.__IsoSpec.LengthType(field)
-            ContentType = self.__IsoSpec.ContentType(field)
-            MaxLength = self.__IsoSpec.MaxLength(field)
-        except:
-            raise SpecError("Cannot parse F{0}: Incomplete field specification".format(field))
- 
-
-        data = ""
-        if(LenType == LT.FIXED):
-            Len = MaxLength
-            
-            if(ContentType == 'n'):
-                formatter = "{{0:0{0}d}}".format(Len)
-            elif('a' in ContentType or 'n' in ContentType or 's' in ContentType):
-                formatter = "{{0: >{0}}}".format(Len)
-            else:
-                formatter = "{0}"
-                
-            data = formatter.format(self.__FieldData[field])
-                
+            return self.__IsoSpec.Compile().Fields[field].Encode(self.__FieldData[field])
+        except Exception as ex:
+            raise type(ex)('Error building F{}: '.format(field) + repr(ex)) from None
+    
+    
+    def __Splice(self, buf, Fields, Copied, Encode):
+        # Appends the fields of the Fields bitmap value to buf. Those in Copied (a bitmap
+        # value) and in __iso are copied from it byte for byte, in runs of adjacent
+        # fields, and the others are Encode(field). The fields of __iso are stepped over
+        # with their fixed sizes or spans up to the last change, what follows it is
+        # copied at once (or, if the end of __iso's fields isn't known, up to the last
+        # copied field).
+        iso = self.__iso
+        p, Parsed, End = self.__Layout
+        Parsed = IsoBitmap(Parsed)
+        Spans = self.__IsoSpec.Compile().Fields
+        
+        Fields &= ~(1 << 127)
+        Copied &= Fields & Parsed.Value
+        Encoded = list(IsoBitmap(Fields & ~Copied).Fields())
+        
+        # the highest field number is the lowest bit
+        if(End != None):
+            Changed = (Parsed.Value & ~(1 << 127) & ~Copied) | (Fields & ~Copied)
+            Stop = 129 - (Changed & -Changed).bit_length() if Changed else 0
         else:
-            LenDataType = self.__IsoSpec.LengthDataType(field)
+            Stop = 129 - (Copied & -Copied).bit_length() if Copied else 0
+        
+        Start = None
+        Next = 0
+        NextEncoded = Encoded[0] if Encoded else 129
+        for field in Parsed.Fields():
+            if(field > Stop):
+                break
             
-            data = "{0}".format(self.__FieldData[field])
-
-            if(ContentType == 'z' and DataType == DT.BIN):
-                if(len(data) % 2 == 1):
-                    data = data + 'F'
-
-                data = data.replace("=", "D")
-                    
-
-
-
-            Len = len(data)
-            if(DataType == DT.BIN):
-                Len //=2
-                
-            if(Len > MaxLength):
-                raise BuildError("Cannot Build F{0}: Field Length larger than specification".format(field))
+            while(NextEncoded < field):
+                if(Start != None):
+                    buf += iso[Start:p]
+                    Start = None
+                buf += Encode(NextEncoded)
+                Next += 1
+                NextEncoded = Encoded[Next] if Next < len(Encoded) else 129
             
-            if(LenType == LT.LVAR):
-                LenData = "{0:01d}".format(Len)
-                
-            elif(LenType == LT.LLVAR):
-                LenData = "{0:02d}".format(Len)
-                
-            elif(LenType == LT.LLLVAR):
-                LenData = "{0:03d}".format(Len)
-                
-            if(LenDataType == DT.ASCII):
-                self.__iso += LenData.encode('latin')
-            elif(LenDataType == DT.BCD):
-                self.__iso += Str2Bcd(LenData)
-            elif(LenDataType == DT.BIN):
-                self.__iso += binascii.unhexlify(LenData)
+            Size = Spans[field].Size
+            if((Copied >> (128 - field)) & 1):
+                if(Start == None):
+                    Start = p
+            elif(Start != None):
+                buf += iso[Start:p]
+                Start = None
+            p = p + Size if Size != None else Spans[field].Span(iso, p)[1]
+        
+        if(Start != None):
+            buf += iso[Start:p]
+        for field in Encoded[Next:]:
+            buf += Encode(field)
+        if(End != None):
+            buf += iso[p:End]
+    
+    
+    def __BuildIsoStats(self, buf, offset):
+        # BuildIsoInto with every phase timed
+        Sink = self.Sink()
+        Spec = self.__IsoSpec.Name()
+        MTI = self.__MTI
+        clock = time.perf_counter
+        Phase, field = 'mti', None
+        
+        if(len(buf) < offset):
+            buf.extend(bytes(offset - len(buf)))
+        del buf[offset:]
+        self.__out = buf
+        
+        try:
+            Begin = t = clock()
+            self.BuildMTI()
+            Now = clock()
+            Sink.Record(Spec, MTI, Phase, None, Now - t, len(buf) - offset)
+            
+            Phase, t, start = 'bitmap', Now, len(buf)
+            self.BuildBitmap()
+            self.__Head = len(buf) - offset
+            Now = clock()
+            Sink.Record(Spec, MTI, Phase, None, Now - t, len(buf) - start)
             
+            Phase = 'field'
+            if(self.__Dirty != -1):
+                # the same fields as without stats are encoded (and timed), the others copied
+                def Encode(Field):
+                    nonlocal field, Now
+                    field, t = Field, clock()
+                    data = self.__EncodeField(Field)
+                    Now = clock()
+                    Sink.Record(Spec, MTI, Phase, Field, Now - t, len(data))
+                    return data
+                self.__Splice(buf, self.__Bitmap.Value, ~self.__Dirty, Encode)
+                field, Now = None, clock()
+            else:
+                self.__DecodeAll()
+                for field in self.__Bitmap.Fields():
+                    t, start = Now, len(buf)
+                    buf += self.__EncodeField(field)
+                    Now = clock()
+                    Sink.Record(Spec, MTI, Phase, field, Now - t, len(buf) - start)
+        except Exception:
+            Sink.Error(Spec, MTI, Phase, field)
+            Sink.Error(Spec, MTI, 'build', None)
+            raise
         
-        if(DataType == DT.ASCII):
-            self.__iso += data.encode('latin')
-        elif(DataType == DT.BCD):
-            self.__iso += Str2Bcd(data)
-        elif(DataType == DT.BIN):
-            self.__iso += binascii.unhexlify(self.__FieldData[field])
+        Sink.Record(Spec, MTI, 'build', None, Now - Begin, len(buf) - offset)
+        return len(buf)
 
 
     def BuildIso(self):
-        self.__iso = b''
-        self.BuildMTI()
-        self.BuildBitmap()
+        buf = self.__buf
+        if(buf == None):
+            buf = self.__buf = bytearray()
+        self.BuildIsoInto(buf)
+        self.__out = buf
         
-        for field in sorted(self.__Bitmap):
-            if(field != 1 and self.Field(field) == 1):
-                try:
-                    self.BuildField(field)
-                except Exception as ex:
-                    raise type(ex)('Error building F{}: '.format(field) + repr(ex)) from None
-
-                
+        self.__iso = bytes(buf)
+        self.__Layout = (self.__Head, self.__Bitmap.Value, len(buf))
+        self.__Dirty = 0
         return self.__iso
     
+    
+    def MakeResponse(self, Set = None, Drop = (), MTI = None):
+        # Builds the response to this request without encoding it again: the fields of
+        # the request as it was parsed (or last built) are echoed byte for byte, except
+        # the Drop ones, and only the Set ones ({field: value}) are encoded. MTI defaults
+        # to the response of the request's (0200 -> 0210). Changes made to this object
+        # since are not part of the response. Returns the response message.
+        if(self.__Layout == None):
+            raise BuildError("No parsed message")
+        
+        Set = Set or {}
+        Codec = self.__IsoSpec.Compile()
+        
+        RequestMTI = Codec.ParseMTI(self.__iso, 0)[0]
+        if(MTI == None):
+            if(int(RequestMTI[2]) % 2 == 1):
+                raise ValueError("Invalid MTI [{0}]: Not a request".format(RequestMTI))
+            MTI = RequestMTI[0:2] + str(int(RequestMTI[2]) + 1) + RequestMTI[3]
+        
+        Bitmap = IsoBitmap(self.__Layout[1])
+        for field in WantedFields(Drop):
+            Bitmap.Clear(field)
+        for field in WantedFields(Set):
+            Bitmap.Set(field)
+        # the secondary bitmap is only there if it's needed
+        Bitmap.Clear(1)
+        
+        buf = bytearray(Codec.BuildMTI(MTI))
+        buf += Bitmap.Pack(Codec.BitmapType)
         
+        def Encode(field):
+            Value = Set[field]
+            try:
+                self.__CheckLength(field, Value)
+                return Codec.Fields[field].Encode(Value)
+            except Exception as ex:
+                raise type(ex)('Error building F{}: '.format(field) + repr(ex)) from None
+        
+        Echoed = IsoBitmap(Bitmap.Value)
+        for field in Set:
+            Echoed.Clear(field)
+        self.__Splice(buf, Bitmap.Value, Echoed.Value, Encode)
+        
+        return bytes(buf)
+    
+    
     def Field(self, field, Value = None):
         if(Value == None):
-            try:
-                return self.__Bitmap[field]
-            except KeyError:
+            if(field < 1 or field > 128):
                 return None
-        elif(Value == 1 or Value == 0):
-            self.__Bitmap[field] = Value
+            return 1 if self.__Bitmap.Test(field) else 0
+        elif(Value == 1):
+            self.__Bitmap.Set(field)
+        elif(Value == 0):
+            self.__Bitmap.Clear(field)
         else:
             raise ValueError 
             
@@ -465,14 +832,50 @@ class Iso8583:
             try:
                 return self.__FieldData[field]
             except KeyError:
+                if(field in self.__Spans):
+                    return self.__DecodeField(field)
                 return None
         else:
-            if(len(str(Value)) > self.__IsoSpec.MaxLength(field)):
-                raise ValueError('Value length larger than field maximum ({0})'.format(self.__IsoSpec.MaxLength(field)))
-            
+            self.__CheckLength(field, Value)
             self.__FieldData[field] = Value
+            self.__Dirty |= 1 << (128 - field)
+
+    def TLV(self, field, Value = None, Format = None):
+        # The data of field as an IsoTLV in Format (BER if None, see py8583tlv), None if
+        # the field is missing. BER data of text fields is carried in hex. A lazily parsed
+        # field isn't decoded, the IsoTLV reads the message itself. Given an IsoTLV, sets
+        # the field to its TLVs.
+        from .py8583tlv import IsoTLV, BER
+        Binary = (self.__IsoSpec.ContentType(field) == 'b')
+
+        if(Value != None):
+            Hex = Binary or Value.Format() is BER
+            self.FieldData(field, Value.Hex() if Hex else Value.Pack().decode('latin-1'))
+            return
+
+        Hex = Binary or Format == None or Format is BER
+        if(field not in self.__FieldData and field in self.__Spans):
+            if(Binary == Hex and (Binary == False or self.__IsoSpec.DataType(field) == DT.BIN)):
+                start, end = self.__Spans[field]
+                return IsoTLV(self.__view[start:end], Format)
+
+        data = self.FieldData(field)
+        if(data == None):
+            return None
+        return IsoTLV(data if Hex else str(data).encode('latin-1'), Format)
+
+    def __CheckLength(self, field, Value):
+        MaxLength = self.__IsoSpec.MaxLength(field)
+        if(self.__IsoSpec.ContentType(field) == 'b'):
+            MaxLength *= 2 # binary data is given in hex
+        
+        if(len(str(Value)) > MaxLength):
+            raise ValueError('Value length larger than field maximum ({0})'.format(MaxLength))
 
     def Fields(self):
+        self.__DecodeAll()
+        # the dict can be changed by the caller, the next build encodes everything
+        self.__Dirty = -1
         return self.__FieldData
             
     def Bitmap(self):
@@ -534,29 +937,63 @@ class Iso8583:
         self.DebugMessage(level)
 
     def DebugMessage(self, level = logging.DEBUG):
+        if(log.isEnabledFor(level) == False):
+            return
+        
+        self.__DecodeAll()
         log.log(level, "MTI:    [{0}]".format(self.__MTI))
         
         bitmapLine = "Fields: [ "
-        for i in sorted(self.__Bitmap.keys()):
-            if(i == 1): 
-                continue
-            if(self.__Bitmap[i] == 1):
-                bitmapLine += str(i) + " "
+        for i in self.__Bitmap.Fields():
+            bitmapLine += str(i) + " "
         bitmapLine += "]"
         log.log(level, bitmapLine)
         
 
-        for i in sorted(self.__Bitmap.keys()):
-            if(i == 1): 
-                continue
-            if(self.__Bitmap[i] == 1):
-                
-                try:
-                    FieldData = self.__FieldData[i]
-                except KeyError:
-                    FieldData = ''
+        for i in self.__Bitmap.Fields():
+            try:
+                FieldData = self.__FieldData[i]
+            except KeyError:
+                FieldData = ''
+            
+            if(self.ContentType(i) == 'n' and self.__IsoSpec.LengthType(i) == LT.FIXED):
+                FieldData = str(FieldData).zfill(self.__IsoSpec.MaxLength(i))
                 
-                if(self.ContentType(i) == 'n' and self.__IsoSpec.LengthType(i) == LT.FIXED):
-                    FieldData = str(FieldData).zfill(self.__IsoSpec.MaxLength(i))
-                    
-                log.log(level, "\t{0:>3d} - {1: <41} : [{2}]".format(i, self.__IsoSpec.Description(i), FieldData))
+            log.log(level, "\t{0:>3d} - {1: <41} : [{2}]".format(i, self.__IsoSpec.Description(i), FieldData))
+
+
+
+class IsoPool(object):
+    # Recycles the Iso8583 objects (and their build buffers) of a spec, for hosts which
+    # would otherwise allocate a message per transaction:
+    #
+    #   IsoPacket = Pool.Get(IsoMsg)
+    #   ...
+    #   Pool.Put(IsoPacket)     # IsoPacket (and its Fields()) must not be used after this
+    #
+    # At most Size free messages are kept. Get and Put are safe to call from threads.
+    
+    def __init__(self, IsoSpec, Size = 1024, Lazy = False, Fields = None):
+        self.IsoSpec = IsoSpec
+        self.Size = Size
+        self.lazy = Lazy
+        self.Fields = Fields
+        self.__Free = []
+    
+    def __len__(self):
+        return len(self.__Free)
+    
+    def Get(self, IsoMsg = None):
+        try:
+            IsoPacket = self.__Free.pop()
+        except IndexError:
+            return Iso8583(IsoMsg, self.IsoSpec, self.lazy, self.Fields)
+        
+        if(IsoMsg != None):
+            IsoPacket.SetIsoContent(IsoMsg)
+        return IsoPacket
+    
+    def Put(self, IsoPacket):
+        if(len(self.__Free) < self.Size):
+            IsoPacket.Reset()
+            self.__Free.append(IsoPacket)
@@ -0,0 +1,357 @@
+import binascii
+import codecs
+from collections import namedtuple
+
+from types import MappingProxyType
+
+from .py8583 import DT, LT, ParseError, SpecError, BuildError, Bcd2Str, Str2Bcd, Bcd2Int, BcdTemplate, _BcdByte
+from .py8583 import IsoBitmap, CheckMTI, WantedFields, ParseWanted
+
+
+# A compiled field is a set of closures specialised for the field's encoding:
+#   Span(buf, p)            -> (start, end) of the field data, end is the next position
+#   Decode(buf, start, end) -> python value of the field data, buf may be bytes or a memoryview
+#   Encode(value)           -> encoded field, including the length prefix
+# Size is the encoded size of fixed length fields (None for variable length ones).
+FieldCodec = namedtuple('FieldCodec', ('Field', 'Span', 'Decode', 'Encode', 'MaxLength', 'Size'))
+
+# ParseFields(buf, p, Bitmap, FieldData) -> p   decodes the fields of the bitmap into FieldData
+# BuildFields(buf, Bitmap, FieldData)           appends the fields of the bitmap to a bytearray
+CompiledSpec = namedtuple('CompiledSpec', ('ParseMTI', 'BuildMTI', 'BitmapType', 'Fields', 'ParseFields', 'BuildFields'))
+
+
+def _Incomplete(field):
+    def Raise(*args):
+        raise SpecError("Cannot parse F{0}: Incomplete field specification".format(field))
+    return FieldCodec(field, Raise, Raise, Raise, None, None)
+
+
+def _LengthDigits(LenType):
+    if(LenType == LT.LVAR):
+        return 1
+    elif(LenType == LT.LLVAR):
+        return 2
+    elif(LenType == LT.LLLVAR):
+        return 3
+    return 0
+
+
+def _CompileSpan(field, DataType, LenType, LenDataType, MaxLength):
+
+    if(DataType == DT.BCD):
+        def ByteLength(Len):
+            return (Len + 1) // 2
+    else:
+        def ByteLength(Len):
+            return Len
+
+    if(LenType == LT.FIXED):
+        Size = ByteLength(MaxLength)
+        def Span(buf, p):
+            return p, p + Size
+        return Span
+
+    Digits = _LengthDigits(LenType)
+
+    if(LenDataType == DT.ASCII):
+        LenSize = Digits
+        def ReadLength(buf, p):
+            return int(buf[p:p+LenSize])
+    elif(LenDataType == DT.BCD):
+        LenSize = (Digits + 1) // 2
+        def ReadLength(buf, p):
+            return Bcd2Int(buf[p:p+LenSize])
+    else:
+        def Span(buf, p):
+            raise ParseError('Unsupported length data type')
+        return Span
+
+    def Span(buf, p):
+        try:
+            Len = ReadLength(buf, p)
+        except ValueError as ex:
+            raise ParseError("Cannot parse F{0} - Invalid length: {1}".format(field, ex))
+
+        if(Len > MaxLength):
+            raise ParseError("F{0} is larger than maximum length ({1}>{2})".format(field, Len, MaxLength))
+
+        p += LenSize
+        return p, p + ByteLength(Len)
+
+    return Span
+
+
+def _CompileDecode(field, DataType, ContentType):
+
+    if(DataType == DT.ASCII):
+        if(ContentType == 'n'):
+            def Convert(data):
+                return int(bytes(data))
+        else:
+            def Convert(data):
+                return codecs.latin_1_decode(data)[0]
+    elif(DataType == DT.BCD and ContentType == 'n'):
+        Convert = Bcd2Int
+    else:
+        def Convert(data):
+            return binascii.hexlify(data).decode('latin-1').upper()
+
+    if(ContentType == 'z'):
+        Raw = Convert
+        def Convert(data):
+            # in track2, replace d with = and remove trailing f
+            return Raw(data).replace("D", "=").replace("F", "")
+
+    Empty = None if ContentType == 'n' else ''
+
+    def Decode(buf, start, end):
+        # In case of zero length, don't try to parse the field itself
+        if(start == end):
+            return Empty
+        try:
+            return Convert(buf[start:end])
+        except Exception as ex:
+            raise ParseError("Cannot parse F{}: {}".format(field, str(ex))) from None
+
+    return Decode
+
+
+def _CompileEncode(field, DataType, LenType, LenDataType, ContentType, MaxLength):
+
+    if(DataType == DT.ASCII):
+        def Data(value, data):
+            return data.encode('latin-1')
+    elif(DataType == DT.BCD):
+        def Data(value, data):
+            return Str2Bcd(data)
+    elif(ContentType == 'z'):
+        def Data(value, data):
+            return binascii.unhexlify(data)
+    else:
+        def Data(value, data):
+            return binascii.unhexlify(value)
+
+    if(LenType == LT.FIXED):
+        if(ContentType == 'n'):
+            formatter = "{{0:0{0}d}}".format(MaxLength)
+        elif('a' in ContentType or 'n' in ContentType or 's' in ContentType):
+            formatter = "{{0: >{0}}}".format(MaxLength)
+        else:
+            formatter = "{0}"
+
+        # ints of numeric fields go through a bytes template, anything else (and
+        # values too large for the field) the formatter as before
+        if(ContentType == 'n' and DataType == DT.ASCII):
+            Template = "%0{0}d".format(MaxLength).encode('latin-1')
+            def Encode(value):
+                if(type(value) is int):
+                    return Template % value
+                return Data(value, formatter.format(value))
+        elif(ContentType == 'n' and DataType == DT.BCD):
+            Template = BcdTemplate(MaxLength)
+            def Encode(value):
+                if(type(value) is int):
+                    data = Template % value
+                    if(len(data) % 2 == 0):
+                        return binascii.unhexlify(data)
+                return Data(value, formatter.format(value))
+        else:
+            def Encode(value):
+                return Data(value, formatter.format(value))
+        return Encode
+
+    LenFormatter = "{{0:0{0}d}}".format(_LengthDigits(LenType))
+    LenTemplate = "%0{0}d".format(_LengthDigits(LenType)).encode('latin-1')
+
+    if(LenDataType == DT.ASCII):
+        def Length(Len):
+            return LenTemplate % Len
+    elif(LenDataType == DT.BCD and _LengthDigits(LenType) < 3):
+        def Length(Len):
+            return _BcdByte[Len] if Len < 100 else Str2Bcd(LenFormatter.format(Len))
+    elif(LenDataType == DT.BCD):
+        def Length(Len):
+            return _BcdByte[Len // 100] + _BcdByte[Len % 100] if Len < 10000 else Str2Bcd(LenFormatter.format(Len))
+    else:
+        def Length(Len):
+            return binascii.unhexlify(LenFormatter.format(Len))
+
+    Track2 = (ContentType == 'z' and DataType != DT.ASCII)
+    Halve = (DataType == DT.BIN)
+
+    def Encode(value):
+        data = "{0}".format(value)
+
+        if(Track2):
+            data = data.replace("=", "D")
+            Len = len(data)
+            if(Len % 2 == 1):
+                data = data + 'F'
+            if(Halve):
+                Len = len(data) // 2
+        else:
+            Len = len(data)
+            if(Halve):
+                Len //= 2
+
+        if(Len > MaxLength):
+            raise BuildError("Cannot Build F{0}: Field Length larger than specification".format(field))
+
+        return Length(Len) + Data(value, data)
+
+    return Encode
+
+
+def FieldEncoding(IsoSpec, field):
+    # (DataType, LenType, LenDataType, ContentType, MaxLength) of a field, None if its
+    # specification is incomplete. MaxLength is in encoded units (hex digits for ASCII
+    # binary fields).
+    try:
+        DataType = IsoSpec.DataType(field)
+        LenType = IsoSpec.LengthType(field)
+        ContentType = IsoSpec.ContentType(field)
+        MaxLength = IsoSpec.MaxLength(field)
+        LenDataType = IsoSpec.LengthDataType(field) if LenType != LT.FIXED else None
+    except:
+        return None
+
+    if(DataType == DT.ASCII and ContentType == 'b'):
+        MaxLength *= 2
+    return DataType, LenType, LenDataType, ContentType, MaxLength
+
+
+def CompileField(IsoSpec, field):
+    Encoding = FieldEncoding(IsoSpec, field)
+    if(Encoding == None):
+        return _Incomplete(field)
+    DataType, LenType, LenDataType, ContentType, ParseLength = Encoding
+
+    Size = None
+    if(LenType == LT.FIXED):
+        Size = (ParseLength + 1) // 2 if DataType == DT.BCD else ParseLength
+
+    return FieldCodec(field,
+                      _CompileSpan(field, DataType, LenType, LenDataType, ParseLength),
+                      _CompileDecode(field, DataType, ContentType),
+                      _CompileEncode(field, DataType, LenType, LenDataType, ContentType, ParseLength),
+                      IsoSpec.MaxLength(field),
+                      Size)
+
+
+def _CompileMTI(IsoSpec):
+    try:
+        DataType = IsoSpec.DataType('MTI')
+    except:
+        DataType = None
+
+    if(DataType == DT.BCD):
+        def ParseMTI(buf, p):
+            return Bcd2Str(buf[p:p+2]), p + 2
+        def BuildMTI(MTI):
+            return Str2Bcd(MTI)
+    elif(DataType == DT.ASCII):
+        def ParseMTI(buf, p):
+            return codecs.latin_1_decode(buf[p:p+4])[0], p + 4
+        def BuildMTI(MTI):
+            return MTI.encode('latin-1')
+    else:
+        def ParseMTI(buf, p):
+            raise SpecError("Cannot parse MTI: Incomplete specification")
+        def BuildMTI(MTI):
+            raise SpecError("Cannot build MTI: Incomplete specification")
+
+    return ParseMTI, BuildMTI
+
+
+def CompileSpec(IsoSpec):
+    ParseMTI, BuildMTI = _CompileMTI(IsoSpec)
+
+    try:
+        BitmapType = IsoSpec.DataType(1)
+    except:
+        BitmapType = None
+
+    Fields = tuple([None, None] + [CompileField(IsoSpec, field) for field in range(2, 129)])
+
+    def ParseFields(buf, p, Bitmap, FieldData):
+        # field 1 is parsed by the bitmap function
+        for field in Bitmap.Fields():
+            Codec = Fields[field]
+            start, p = Codec.Span(buf, p)
+            FieldData[field] = Codec.Decode(buf, start, p)
+        return p
+
+    def BuildFields(buf, Bitmap, FieldData):
+        for field in Bitmap.Fields():
+            try:
+                buf += Fields[field].Encode(FieldData[field])
+            except Exception as ex:
+                raise type(ex)('Error building F{}: '.format(field) + repr(ex)) from None
+
+    return CompiledSpec(ParseMTI, BuildMTI, BitmapType, Fields, ParseFields, BuildFields)
+
+
+
+class IsoRecord(object):
+    # Read-only result of IsoParser
+    __slots__ = ('__MTI', '__Bitmap', '__FieldData')
+    
+    def __init__(self, MTI, Bitmap, FieldData):
+        self.__MTI = MTI
+        self.__Bitmap = Bitmap
+        self.__FieldData = FieldData
+        
+    def MTI(self):
+        return self.__MTI
+    
+    def Field(self, field):
+        if(field < 1 or field > 128):
+            return None
+        return 1 if self.__Bitmap.Test(field) else 0
+    
+    def FieldData(self, field):
+        return self.__FieldData.get(field)
+    
+    def Fields(self):
+        return MappingProxyType(self.__FieldData)
+    
+    def Bitmap(self):
+        return IsoBitmap(self.__Bitmap.Value)
+    
+    def __repr__(self):
+        return "IsoRecord({0}, {1})".format(self.__MTI, self.__FieldData)
+        
+
+class IsoParser(object):
+    # Parses messages of a single spec, compiled once when the parser is created.
+    # If Fields is given, only these fields are parsed (see ParseWanted).
+    
+    def __init__(self, IsoSpec, Fields = None, Strict = False):
+        self.__Codec = IsoSpec.Compile()
+        self.__Wanted = WantedFields(Fields) if Fields != None else None
+        self.strict = Strict
+        
+    def Parse(self, IsoMsg):
+        Codec = self.__Codec
+        
+        MTI, p = Codec.ParseMTI(IsoMsg, 0)
+        CheckMTI(MTI, self.strict)
+        
+        Bitmap = IsoBitmap()
+        p = Bitmap.Unpack(IsoMsg, p, Codec.BitmapType)
+        
+        FieldData = {}
+        
+        if(self.__Wanted == None):
+            Codec.ParseFields(IsoMsg, p, Bitmap, FieldData)
+        else:
+            ParseWanted(Codec, IsoMsg, p, Bitmap, self.__Wanted, FieldData)
+        
+        return IsoRecord(MTI, Bitmap, FieldData)
+    
+    __call__ = Parse
+    
+    def ParseMany(self, Messages):
+        Parse = self.Parse
+        for IsoMsg in Messages:
+            yield Parse(IsoMsg)
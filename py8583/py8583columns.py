@@ -0,0 +1,165 @@
+from collections import namedtuple
+
+from .py8583 import DT, LT, ParseError, IsoBitmap, CheckMTI
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# MTI:     unicode array with the MTI of each message
+# Mask:    boolean array of shape (messages, 129), Mask[:, n] is the presence of Fn
+# Columns: dictionary of field number to array
+IsoColumns = namedtuple('IsoColumns', ('MTI', 'Mask', 'Columns'))
+
+
+class IntColumn(object):
+    # Fixed numeric fields, converted to int64 in one go. Absent fields are 0.
+    def __init__(self, field, Width, Digits, DataType):
+        self.field = field
+        self.Width = Width
+        self.Digits = Digits
+        self.DataType = DataType
+        self.data = bytearray()
+        self.Filler = (b'0' if DataType == DT.ASCII else b'\x00') * Width
+
+    def Add(self, buf, start, end):
+        if(end - start != self.Width or end > len(buf)):
+            raise ParseError("Cannot parse F{0}: Message too short".format(self.field))
+        self.data += buf[start:end]
+
+    def Missing(self):
+        self.data += self.Filler
+
+    def Array(self, Count):
+        raw = numpy.frombuffer(bytes(self.data), dtype = numpy.uint8).reshape(Count, self.Width)
+
+        if(self.DataType == DT.ASCII):
+            digits = raw.astype(numpy.int64) - 0x30
+        else:
+            digits = numpy.empty((Count, self.Width * 2), dtype = numpy.int64)
+            digits[:, 0::2] = raw >> 4
+            digits[:, 1::2] = raw & 0x0F
+            digits = digits[:, -self.Digits:]
+
+        invalid = ((digits < 0) | (digits > 9)).any(axis = 1)
+        if(invalid.any()):
+            raise ParseError("Cannot parse F{0}: Invalid numeric data in message {1}".format(self.field, int(numpy.argmax(invalid))))
+
+        weights = 10 ** numpy.arange(self.Digits - 1, -1, -1, dtype = numpy.int64)
+        return digits.dot(weights)
+
+
+class BytesColumn(object):
+    # ASCII fields, kept as the raw bytes in a fixed width 'S' array. Absent fields are b''.
+    def __init__(self, field, Width):
+        self.field = field
+        self.Width = Width
+        self.data = bytearray()
+        self.Filler = bytes(Width)
+
+    def Add(self, buf, start, end):
+        if(end > len(buf)):
+            raise ParseError("Cannot parse F{0}: Message too short".format(self.field))
+        self.data += buf[start:end]
+        self.data += self.Filler[end - start:]
+
+    def Missing(self):
+        self.data += self.Filler
+
+    def Array(self, Count):
+        return numpy.frombuffer(self.data, dtype = 'S{0}'.format(self.Width), count = Count)
+
+
+class ValueColumn(object):
+    # Everything else is decoded like FieldData and kept as strings. Absent fields are ''.
+    def __init__(self, field, Decode):
+        self.field = field
+        self.Decode = Decode
+        self.data = []
+
+    def Add(self, buf, start, end):
+        Value = self.Decode(buf, start, end)
+        self.data.append('' if Value == None else str(Value))
+
+    def Missing(self):
+        self.data.append('')
+
+    def Array(self, Count):
+        return numpy.array(self.data, dtype = str)
+
+
+def MakeColumn(IsoSpec, field):
+    Codec = IsoSpec.Compile().Fields[field]
+    DataType = IsoSpec.DataType(field)
+    ContentType = IsoSpec.ContentType(field)
+    LenType = IsoSpec.LengthType(field)
+    MaxLength = IsoSpec.MaxLength(field)
+
+    if(ContentType == 'n' and LenType == LT.FIXED and MaxLength <= 18 and DataType != DT.BIN):
+        if(DataType == DT.BCD):
+            Width = (MaxLength + 1) // 2
+        else:
+            Width = MaxLength
+        return IntColumn(field, Width, MaxLength, DataType)
+
+    if(DataType == DT.ASCII and ContentType not in ('n', 'z')):
+        if(ContentType == 'b'):
+            MaxLength *= 2
+        return BytesColumn(field, MaxLength)
+
+    return ValueColumn(field, Codec.Decode)
+
+
+def ParseColumns(Messages, IsoSpec, Fields):
+    if(numpy == None):
+        raise ImportError("numpy is required for columnar parsing")
+
+    Wanted = sorted(set(Fields))
+    for field in Wanted:
+        if(field < 2 or field > 128):
+            raise ValueError("Invalid field F{0}".format(field))
+
+    Codec = IsoSpec.Compile()
+    Columns = dict((field, MakeColumn(IsoSpec, field)) for field in Wanted)
+    ColumnList = [(field, Columns[field]) for field in Wanted]
+    Last = Wanted[-1] if Wanted else 0
+
+    ParseMTI = Codec.ParseMTI
+    BitmapType = Codec.BitmapType
+    Spans = Codec.Fields
+    Bitmap = IsoBitmap()
+
+    MTI = []
+    Masks = bytearray()
+
+    for IsoMsg in Messages:
+        Code, p = ParseMTI(IsoMsg, 0)
+        CheckMTI(Code)
+        MTI.append(Code)
+
+        p = Bitmap.Unpack(IsoMsg, p, BitmapType)
+        Masks += Bitmap.Value.to_bytes(16, 'big')
+
+        # walk the message only up to the last requested field
+        for field in Bitmap.Fields():
+            if(field > Last):
+                break
+            start, p = Spans[field].Span(IsoMsg, p)
+            Column = Columns.get(field)
+            if(Column != None):
+                Column.Add(IsoMsg, start, p)
+
+        for field, Column in ColumnList:
+            if(Bitmap.Test(field) == False):
+                Column.Missing()
+
+    Count = len(MTI)
+
+    Mask = numpy.zeros((Count, 129), dtype = bool)
+    Mask[:, 1:] = numpy.unpackbits(numpy.frombuffer(bytes(Masks), dtype = numpy.uint8).reshape(Count, 16), axis = 1)
+
+    return IsoColumns(numpy.array(MTI, dtype = 'U4'),
+                      Mask,
+                      dict((field, Column.Array(Count)) for field, Column in ColumnList))
@@ -0,0 +1,259 @@
+import hashlib
+import importlib.util
+import os
+
+from .py8583 import DT, LT, BcdTemplate
+from . import py8583codec
+
+
+# Generates the field parsing and building of a spec as straight-line python, with the
+# encoding of every field inlined (e.g. int(buf[p:p+6]) for an ASCII F3), instead of the
+# generic loop over the compiled field codecs. The generated ParseFields/BuildFields
+# replace the generic ones of the compiled spec and behave the same.
+#
+#   Install(IsoSpec)                    use generated code for the spec (and equal specs, see Install)
+#   Install(IsoSpec, CacheDir = path)   same, with the module kept in path for the next process
+#   WriteModule(IsoSpec, path)          write an importable module (ParseFields, BuildFields)
+#
+# Generated parsing expects the message as bytes (or bytearray), not a memoryview.
+
+# bumped whenever the generated code changes
+_Version = b'py8583gen 2\n'
+
+_Header = '''# Generated by py8583gen for {0!r}, do not edit
+from binascii import hexlify, unhexlify
+from codecs import latin_1_decode
+
+from py8583.py8583 import ParseError, SpecError, BuildError, Bcd2Int, Str2Bcd, _BcdByte
+
+
+def Incomplete(field):
+    raise SpecError('Cannot parse F{{0}}: Incomplete field specification'.format(field))
+
+'''
+
+
+def _Convert(DataType, ContentType, data):
+    # expression decoding data, as the Decode of py8583codec
+    if(DataType == DT.ASCII):
+        if(ContentType == 'n'):
+            Expression = "int({0})".format(data)
+        else:
+            Expression = "latin_1_decode({0})[0]".format(data)
+    elif(DataType == DT.BCD and ContentType == 'n'):
+        Expression = "Bcd2Int({0})".format(data)
+    else:
+        Expression = "hexlify({0}).decode('latin-1').upper()".format(data)
+
+    if(ContentType == 'z'):
+        Expression = "{0}.replace('D', '=').replace('F', '')".format(Expression)
+    return Expression
+
+
+def _ParseField(field, Definition, Indent):
+    if(Definition == None):
+        return [Indent + "Incomplete({0})".format(field)]
+
+    DataType, LenType, LenDataType, ContentType, MaxLength = Definition
+    Empty = None if ContentType == 'n' else ''
+    Code = []
+
+    if(LenType == LT.FIXED):
+        Size = (MaxLength + 1) // 2 if DataType == DT.BCD else MaxLength
+        Code += ["try:",
+                 "    FieldData[{0}] = {1}".format(field, _Convert(DataType, ContentType, "buf[p:p+{0}]".format(Size))),
+                 "except Exception as ex:",
+                 "    raise ParseError('Cannot parse F{0}: {{}}'.format(str(ex))) from None".format(field),
+                 "p += {0}".format(Size)]
+    else:
+        Digits = {LT.LVAR: 1, LT.LLVAR: 2, LT.LLLVAR: 3}[LenType]
+        if(LenDataType == DT.ASCII):
+            LenSize = Digits
+            ReadLength = "int(buf[p:p+{0}])".format(LenSize)
+        elif(LenDataType == DT.BCD):
+            LenSize = (Digits + 1) // 2
+            ReadLength = "Bcd2Int(buf[p:p+{0}])".format(LenSize)
+        else:
+            return [Indent + "raise ParseError('Unsupported length data type')"]
+        ByteLength = "(Len + 1) // 2" if DataType == DT.BCD else "Len"
+
+        Code += ["try:",
+                 "    Len = {0}".format(ReadLength),
+                 "except ValueError as ex:",
+                 "    raise ParseError('Cannot parse F{0} - Invalid length: {{0}}'.format(ex))".format(field),
+                 "if(Len > {0}):".format(MaxLength),
+                 "    raise ParseError('F{0} is larger than maximum length ({{0}}>{1})'.format(Len))".format(field, MaxLength),
+                 "p += {0}".format(LenSize),
+                 "end = p + {0}".format(ByteLength),
+                 "if(p == end):",
+                 "    FieldData[{0}] = {1!r}".format(field, Empty),
+                 "else:",
+                 "    try:",
+                 "        FieldData[{0}] = {1}".format(field, _Convert(DataType, ContentType, "buf[p:end]")),
+                 "    except Exception as ex:",
+                 "        raise ParseError('Cannot parse F{0}: {{}}'.format(str(ex))) from None".format(field),
+                 "p = end"]
+
+    return [Indent + line for line in Code]
+
+
+def _Data(DataType, ContentType, value, data):
+    # expression encoding the formatted data, as the Encode of py8583codec
+    if(DataType == DT.ASCII):
+        return "{0}.encode('latin-1')".format(data)
+    elif(DataType == DT.BCD):
+        return "Str2Bcd({0})".format(data)
+    elif(ContentType == 'z'):
+        return "unhexlify({0})".format(data)
+    return "unhexlify({0})".format(value)
+
+
+def _BuildField(field, Definition, Indent):
+    if(Definition == None):
+        Code = ["Incomplete({0})".format(field)]
+    else:
+        Code = _Encode(field, *Definition)
+
+    Code = (["try:"] + ["    " + line for line in Code] +
+            ["except Exception as ex:",
+             "    raise type(ex)('Error building F{0}: ' + repr(ex)) from None".format(field)])
+    return [Indent + line for line in Code]
+
+
+def _Encode(field, DataType, LenType, LenDataType, ContentType, MaxLength):
+    Code = ["value = FieldData[{0}]".format(field)]
+
+    if(LenType == LT.FIXED):
+        if(ContentType == 'n'):
+            Format = "'{{0:0{0}d}}'.format(value)".format(MaxLength)
+            if(DataType == DT.ASCII):
+                # ints by a bytes template, as the Encode of py8583codec
+                Code += ["buf += b'%0{0}d' % value if type(value) is int else {1}".format(
+                         MaxLength, _Data(DataType, ContentType, "value", Format))]
+                return Code
+            elif(DataType == DT.BCD):
+                Template = BcdTemplate(MaxLength)
+                Code += ["data = {0!r} % value if type(value) is int else None".format(Template),
+                         "if(data != None and len(data) == {0}):".format(len(Template % 0)),
+                         "    buf += unhexlify(data)",
+                         "else:",
+                         "    buf += {0}".format(_Data(DataType, ContentType, "value", Format))]
+                return Code
+        elif('a' in ContentType or 'n' in ContentType or 's' in ContentType):
+            Format = "'{{0: >{0}}}'.format(value)".format(MaxLength)
+        else:
+            Format = "'{0}'.format(value)"
+        Code += ["buf += {0}".format(_Data(DataType, ContentType, "value", Format))]
+    else:
+        Digits = {LT.LVAR: 1, LT.LLVAR: 2, LT.LLLVAR: 3}[LenType]
+        LenFormat = "'{{0:0{0}d}}'.format(Len)".format(Digits)
+        if(LenDataType == DT.ASCII):
+            Length = "b'%0{0}d' % Len".format(Digits)
+        elif(LenDataType == DT.BCD and Digits < 3 and MaxLength < 100):
+            Length = "_BcdByte[Len]"
+        elif(LenDataType == DT.BCD and MaxLength < 10000):
+            Length = "(_BcdByte[Len // 100] + _BcdByte[Len % 100])"
+        elif(LenDataType == DT.BCD):
+            Length = "Str2Bcd({0})".format(LenFormat)
+        else:
+            Length = "unhexlify({0})".format(LenFormat)
+
+        Code += ["data = '{0}'.format(value)"]
+        if(ContentType == 'z' and DataType != DT.ASCII):
+            Code += ["data = data.replace('=', 'D')",
+                     "Len = len(data)",
+                     "if(Len % 2 == 1):",
+                     "    data = data + 'F'"]
+            if(DataType == DT.BIN):
+                Code += ["Len = len(data) // 2"]
+        else:
+            Code += ["Len = len(data) // 2" if DataType == DT.BIN else "Len = len(data)"]
+
+        Code += ["if(Len > {0}):".format(MaxLength),
+                 "    raise BuildError('Cannot Build F{0}: Field Length larger than specification')".format(field),
+                 "buf += {0} + {1}".format(Length, _Data(DataType, ContentType, "value", "data"))]
+    return Code
+
+
+def _Grouped(Definitions, Generator):
+    # The fields are tested 8 at a time, one byte of the bitmap, and one by one in
+    # the bytes which have any of them
+    Code = ["Bytes = Bitmap.Value.to_bytes(16, 'big')"]
+    for Byte in range(16):
+        Fields = [field for field in range(Byte * 8 + 1, Byte * 8 + 9) if field > 1]
+        Code += ["", "if(Bytes[{0}]):".format(Byte),
+                 "    B = Bytes[{0}]".format(Byte)]
+        for field in Fields:
+            Code += ["    if(B & 0x{0:02x}):".format(0x80 >> ((field - 1) % 8))]
+            Code += Generator(field, Definitions[field], "        ")
+    return ["    " + line if line else line for line in Code]
+
+
+def GenerateSource(IsoSpec):
+    # Python source of a module with the ParseFields and BuildFields of the spec
+    Definitions = [None, None] + [py8583codec.FieldEncoding(IsoSpec, field) for field in range(2, 129)]
+
+    Source = [_Header.format(IsoSpec.Name()),
+              "def ParseFields(buf, p, Bitmap, FieldData):"]
+    Source += _Grouped(Definitions, _ParseField)
+    Source += ["", "    return p", "", "",
+               "def BuildFields(buf, Bitmap, FieldData):"]
+    Source += _Grouped(Definitions, _BuildField)
+    Source += [""]
+
+    return "\n".join(Source)
+
+
+def _Digest(IsoSpec):
+    return hashlib.sha256(_Version + repr(IsoSpec.Key()).encode('utf-8')).hexdigest()[:32]
+
+
+def WriteModule(IsoSpec, path):
+    Temp = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(Temp, 'w') as f:
+        f.write(GenerateSource(IsoSpec))
+    os.replace(Temp, path)
+
+
+def LoadModule(path):
+    Name = os.path.splitext(os.path.basename(path))[0]
+    Spec = importlib.util.spec_from_file_location(Name, path)
+    Module = importlib.util.module_from_spec(Spec)
+    Spec.loader.exec_module(Module)
+    return Module
+
+
+def Generate(IsoSpec, CacheDir = None):
+    # Returns the compiled spec with generated ParseFields and BuildFields. With a
+    # CacheDir the module is written there (by the hash of the field definitions) and
+    # imported from there, so other processes get it (and its bytecode) ready.
+    if(CacheDir != None):
+        path = os.path.join(CacheDir, "py8583gen_{0}.py".format(_Digest(IsoSpec)))
+        if(os.path.exists(path) == False):
+            os.makedirs(CacheDir, exist_ok = True)
+            WriteModule(IsoSpec, path)
+        Module = LoadModule(path)
+        Functions = (Module.ParseFields, Module.BuildFields)
+    else:
+        Namespace = {}
+        exec(compile(GenerateSource(IsoSpec), "<py8583gen {0!r}>".format(IsoSpec.Name()), 'exec'), Namespace)
+        Functions = (Namespace['ParseFields'], Namespace['BuildFields'])
+
+    return py8583codec.CompileSpec(IsoSpec)._replace(ParseFields = Functions[0], BuildFields = Functions[1])
+
+
+def Install(IsoSpec, CacheDir = None):
+    # Makes the spec use generated code, as well as the shared specs of GetSpec() and
+    # the specs compiled from now on which have the same field definitions. Other specs
+    # which were already compiled keep their codec until they're modified.
+    from . import py8583spec
+
+    Codec = Generate(IsoSpec, CacheDir)
+    Key = IsoSpec.Key()
+    py8583spec._Compiled[Key] = Codec
+    IsoSpec._Compiled = Codec
+    with py8583spec._RegistryLock:
+        for Spec in py8583spec._Registry.values():
+            if(Spec.Key() == Key):
+                Spec._Compiled = Codec
+    return Codec
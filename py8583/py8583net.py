@@ -0,0 +1,427 @@
+import asyncio
+import math
+import time
+from enum import IntEnum
+
+from .py8583 import Iso8583, IsoBitmap, ParseError, CheckMTI, log
+
+
+# Length Header enumeration
+class LH(IntEnum):
+    BIN2    = 2     # 2 byte binary length, network byte order
+    ASCII4  = 4     # 4 byte ascii decimal length
+
+
+class IsoFramer(object):
+    # Splits a byte stream into length prefixed frames. The length covers the
+    # optional TPDU and the iso message, not the length header itself.
+
+    def __init__(self, IsoSpec = None, Header = LH.BIN2, TPDU = 0, Lazy = False, Pool = None):
+        if(Header not in LH):
+            raise ValueError("Invalid length header type [{0}]".format(Header))
+
+        self.IsoSpec = IsoSpec
+        self.Header = Header
+        self.TPDU = TPDU
+        self.lazy = Lazy
+        # an IsoPool the messages of Feed are taken from
+        self.Pool = Pool
+        self.MaxLength = 0xFFFF if Header == LH.BIN2 else 9999
+
+        self.__buf = bytearray()
+        self.__start = 0
+
+
+    def __ReadLength(self, p):
+        if(self.Header == LH.BIN2):
+            return int.from_bytes(self.__buf[p:p+2], 'big')
+
+        try:
+            return int(self.__buf[p:p+4])
+        except ValueError:
+            raise ParseError("Invalid frame length: [{0}]".format(bytes(self.__buf[p:p+4])))
+
+
+    def Pending(self):
+        return len(self.__buf) - self.__start
+
+
+    def __Next(self):
+        # Returns the next complete (TPDU, message) frame, or None
+        buf = self.__buf
+        p = self.__start
+        HeaderLen = int(self.Header)
+
+        if(len(buf) - p < HeaderLen):
+            return None
+
+        Len = self.__ReadLength(p)
+        if(Len < self.TPDU or Len > self.MaxLength):
+            raise ParseError("Invalid frame length: {0}".format(Len))
+
+        end = p + HeaderLen + Len
+        if(end > len(buf)):
+            return None
+
+        p += HeaderLen
+        Frame = (bytes(buf[p:p+self.TPDU]), bytes(buf[p+self.TPDU:end]))
+        self.__start = end
+        return Frame
+
+
+    def __Compact(self):
+        # consumed bytes are only dropped once they are at least half of the buffer,
+        # so a long stream of small frames doesn't move the remaining data every time
+        buf = self.__buf
+        if(self.__start == len(buf)):
+            del buf[:]
+            self.__start = 0
+        elif(self.__start > len(buf) // 2):
+            del buf[:self.__start]
+            self.__start = 0
+
+
+    def Frames(self, data = b''):
+        # Returns a list of (TPDU, message) tuples for every complete frame received so far
+        self.__buf += data
+
+        Frames = []
+        Frame = self.__Next()
+        while(Frame != None):
+            Frames.append(Frame)
+            Frame = self.__Next()
+
+        self.__Compact()
+        return Frames
+
+
+    def Feed(self, data = b''):
+        # Returns the complete messages as Iso8583 objects. If one fails to parse, the
+        # frames after it stay queued and are returned by the next call.
+        self.__buf += data
+
+        Messages = []
+        try:
+            Frame = self.__Next()
+            while(Frame != None):
+                if(self.Pool != None):
+                    Messages.append(self.Pool.Get(Frame[1]))
+                else:
+                    Messages.append(Iso8583(Frame[1], self.IsoSpec, self.lazy))
+                Frame = self.__Next()
+        finally:
+            self.__Compact()
+
+        return Messages
+
+
+    def __Frame(self, buf, TPDU, IsoMsg):
+        Len = len(TPDU) + len(IsoMsg)
+        if(Len > self.MaxLength):
+            raise ValueError("Frame too long: {0}".format(Len))
+
+        if(self.Header == LH.BIN2):
+            buf += Len.to_bytes(2, 'big')
+        else:
+            buf += "{0:04d}".format(Len).encode('latin-1')
+        buf += TPDU
+        buf += IsoMsg
+        return buf
+
+
+    def Frame(self, IsoMsg, TPDU = b''):
+        # Frames raw message bytes
+        if(len(TPDU) != self.TPDU):
+            raise ValueError("Expected {0} bytes of TPDU".format(self.TPDU))
+        return bytes(self.__Frame(bytearray(), TPDU, IsoMsg))
+
+
+    def FrameIso(self, IsoPacket, TPDU = b''):
+        # Builds an Iso8583 directly after a reserved header, without copying the message
+        if(len(TPDU) != self.TPDU):
+            raise ValueError("Expected {0} bytes of TPDU".format(self.TPDU))
+
+        HeaderLen = int(self.Header)
+        buf = bytearray(HeaderLen)
+        buf += TPDU
+        Len = IsoPacket.BuildIsoInto(buf, HeaderLen + self.TPDU) - HeaderLen
+
+        if(Len > self.MaxLength):
+            raise ValueError("Frame too long: {0}".format(Len))
+
+        if(self.Header == LH.BIN2):
+            buf[0:2] = Len.to_bytes(2, 'big')
+        else:
+            buf[0:4] = "{0:04d}".format(Len).encode('latin-1')
+        return bytes(buf)
+
+
+def ResponseTPDU(TPDU):
+    # A standard 5 byte TPDU is id, destination, source. Responses swap the addresses.
+    if(len(TPDU) == 5):
+        return TPDU[0:1] + TPDU[3:5] + TPDU[1:3]
+    return TPDU
+
+
+class IsoKey(object):
+    # Extracts a correlation key from a raw message without parsing it: the MTI
+    # version, class and request/response pair (0200/0210 -> '020') followed by the
+    # encoded bytes of the key fields (None for absent ones). Only the fields up
+    # to the last key field are stepped over.
+
+    def __init__(self, IsoSpec, Fields = (11, 41)):
+        self.Fields = tuple(sorted(Fields))
+        self.__Codec = IsoSpec.Compile()
+        self.__Last = self.Fields[-1]
+
+    def __call__(self, IsoMsg):
+        Codec = self.__Codec
+        MTI, p = Codec.ParseMTI(IsoMsg, 0)
+        CheckMTI(MTI)
+
+        Bitmap = IsoBitmap()
+        p = Bitmap.Unpack(IsoMsg, p, Codec.BitmapType)
+
+        Values = {}
+        Last = self.__Last
+        for field in Bitmap.Fields():
+            if(field > Last):
+                break
+            start, p = Codec.Fields[field].Span(IsoMsg, p)
+            Values[field] = IsoMsg[start:p]
+
+        return (MTI[0:2] + str(int(MTI[2]) // 2),) + tuple(Values.get(field) for field in self.Fields)
+
+
+class IsoCorrelator(object):
+    # In-flight request table. Add() registers a request key with a future, Match()
+    # resolves it with the response, in O(1). Expiry uses a timer wheel with one slot
+    # per Resolution seconds, so Expire() only looks at the slots that came due.
+
+    def __init__(self, Timeout = 30.0, MaxTimeout = None, Resolution = 0.1, Clock = time.monotonic):
+        self.Timeout = Timeout
+        self.Resolution = Resolution
+        self.Clock = Clock
+
+        MaxTimeout = MaxTimeout if MaxTimeout != None else Timeout
+        self.__Slots = int(math.ceil(MaxTimeout / Resolution)) + 2
+        self.__Wheel = [set() for i in range(self.__Slots)]
+        self.__Tick = int(Clock() / Resolution)
+        self.__Pending = {}
+
+    def __len__(self):
+        return len(self.__Pending)
+
+    def __contains__(self, Key):
+        return Key in self.__Pending
+
+    def Add(self, Key, Future, Timeout = None):
+        if(Key in self.__Pending):
+            raise ValueError("A request with key {0} is already outstanding".format(Key))
+
+        Timeout = self.Timeout if Timeout == None else Timeout
+        Now = self.Clock()
+        # catch up with an Expire() that runs late, so that the slots are counted from
+        # now and a slot which is still to be expired isn't reused
+        if(int(Now / self.Resolution) > self.__Tick):
+            self.Expire()
+        Due = int(math.ceil((Now + Timeout) / self.Resolution))
+        if(Due - self.__Tick >= self.__Slots):
+            raise ValueError("Timeout {0} is larger than the correlator maximum".format(Timeout))
+
+        Due = max(Due, self.__Tick + 1)
+        self.__Pending[Key] = (Future, Due)
+        self.__Wheel[Due % self.__Slots].add(Key)
+        return Future
+
+    def Remove(self, Key, Future = None):
+        # With a Future the key is only removed while it's still that request's, not a
+        # later one's which reused the key after it expired
+        Entry = self.__Pending.get(Key)
+        if(Entry == None or (Future != None and Entry[0] is not Future)):
+            return None
+        del self.__Pending[Key]
+        self.__Wheel[Entry[1] % self.__Slots].discard(Key)
+        return Entry[0]
+
+    def Match(self, Key, Response):
+        # Returns False if no request is waiting for this key
+        Future = self.Remove(Key)
+        if(Future == None):
+            return False
+        if(Future.done() == False):
+            Future.set_result(Response)
+        return True
+
+    def Expire(self):
+        # Fails all requests that are due with asyncio.TimeoutError and returns their keys
+        Now = int(self.Clock() / self.Resolution)
+        Expired = []
+
+        while(self.__Tick < Now):
+            self.__Tick += 1
+            Slot = self.__Wheel[self.__Tick % self.__Slots]
+            for Key in Slot:
+                Future = self.__Pending.pop(Key)[0]
+                if(Future.done() == False):
+                    Future.set_exception(asyncio.TimeoutError())
+                Expired.append(Key)
+            Slot.clear()
+
+        return Expired
+
+    def Fail(self, error):
+        for Future, Due in self.__Pending.values():
+            if(Future.done() == False):
+                Future.set_exception(error)
+        self.__Pending.clear()
+        for Slot in self.__Wheel:
+            Slot.clear()
+
+
+class IsoServerProtocol(asyncio.Protocol):
+    # Parses every frame of a connection and passes it to an async Handler, which
+    # returns the response Iso8583 (or None for no response). Requests are handled
+    # concurrently, so responses may be written out of order.
+
+    def __init__(self, Handler, IsoSpec, Header = LH.BIN2, TPDU = 0):
+        self.Handler = Handler
+        self.Framer = IsoFramer(IsoSpec, Header, TPDU)
+        self.IsoSpec = IsoSpec
+        self.transport = None
+        self.Tasks = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        for Task in self.Tasks:
+            Task.cancel()
+        self.transport = None
+
+    def data_received(self, data):
+        try:
+            Frames = self.Framer.Frames(data)
+        except ParseError as ex:
+            log.error("Closing connection: {0}".format(ex))
+            self.transport.close()
+            return
+
+        for TPDU, IsoMsg in Frames:
+            try:
+                IsoPacket = Iso8583(IsoMsg, self.IsoSpec)
+            except Exception as ex:
+                log.error("Dropping message: {0}".format(ex))
+                continue
+
+            Task = asyncio.ensure_future(self.Handle(IsoPacket, TPDU))
+            self.Tasks.add(Task)
+            Task.add_done_callback(self.Tasks.discard)
+
+    async def Handle(self, IsoPacket, TPDU):
+        Sink = IsoPacket.Sink()
+        try:
+            if(Sink != None):
+                Begin = time.perf_counter()
+                try:
+                    Response = await self.Handler(IsoPacket)
+                except Exception:
+                    Sink.Error(self.IsoSpec.Name(), IsoPacket.MTI(), 'handler', None)
+                    raise
+                Sink.Record(self.IsoSpec.Name(), IsoPacket.MTI(), 'handler', None,
+                            time.perf_counter() - Begin, 0)
+            else:
+                Response = await self.Handler(IsoPacket)
+            if(Response != None and self.transport != None):
+                self.transport.write(self.Framer.FrameIso(Response, ResponseTPDU(TPDU)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            log.error("Handler failed: {0}".format(ex))
+
+
+async def StartServer(Handler, IsoSpec, host = None, port = None, Header = LH.BIN2, TPDU = 0, **kwargs):
+    # Returns an asyncio Server, extra arguments are passed to loop.create_server
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(lambda: IsoServerProtocol(Handler, IsoSpec, Header, TPDU),
+                                    host, port, **kwargs)
+
+
+class IsoClient(object):
+    # Sends requests over one persistent connection, any number of them may be
+    # outstanding. Responses are matched to requests by the MTI and the key Fields,
+    # and only matched responses are parsed.
+
+    def __init__(self, IsoSpec, Header = LH.BIN2, TPDU = b'', Fields = (11, 41), Timeout = 30.0):
+        self.IsoSpec = IsoSpec
+        self.Framer = IsoFramer(IsoSpec, Header, len(TPDU))
+        self.TPDU = TPDU
+        self.Key = IsoKey(IsoSpec, Fields)
+        self.Correlator = IsoCorrelator(Timeout)
+
+        self.__Offset = int(Header) + len(TPDU)
+        self.__reader = None
+        self.__writer = None
+        self.__task = None
+        self.__timer = None
+
+    async def Connect(self, host, port, **kwargs):
+        self.__reader, self.__writer = await asyncio.open_connection(host, port, **kwargs)
+        self.__task = asyncio.ensure_future(self.__Receive())
+        self.__Expire()
+
+    async def Close(self):
+        if(self.__writer != None):
+            self.__writer.close()
+            await self.__writer.wait_closed()
+        if(self.__task != None):
+            await self.__task
+
+    def __Expire(self):
+        self.Correlator.Expire()
+        self.__timer = asyncio.get_running_loop().call_later(self.Correlator.Resolution, self.__Expire)
+
+    async def __Receive(self):
+        error = ConnectionError("Connection closed")
+        try:
+            while True:
+                data = await self.__reader.read(65536)
+                if(len(data) == 0):
+                    break
+                for TPDU, IsoMsg in self.Framer.Frames(data):
+                    self.__Dispatch(IsoMsg)
+        except Exception as ex:
+            error = ex
+        finally:
+            self.__timer.cancel()
+            self.Correlator.Fail(error)
+
+    def __Dispatch(self, IsoMsg):
+        try:
+            Key = self.Key(IsoMsg)
+            if(Key not in self.Correlator):
+                log.warning("Dropping unexpected response {0}".format(Key))
+                return
+            Response = Iso8583(IsoMsg, self.IsoSpec)
+        except Exception as ex:
+            log.error("Dropping response: {0}".format(ex))
+            return
+
+        self.Correlator.Match(Key, Response)
+
+    def Pending(self):
+        return len(self.Correlator)
+
+    async def Request(self, IsoPacket, Timeout = None):
+        if(self.__writer == None or self.__task.done()):
+            raise ConnectionError("Not connected")
+
+        data = self.Framer.FrameIso(IsoPacket, self.TPDU)
+        Key = self.Key(data[self.__Offset:])
+
+        Future = self.Correlator.Add(Key, asyncio.get_running_loop().create_future(), Timeout)
+        try:
+            self.__writer.write(data)
+            return await Future
+        finally:
+            self.Correlator.Remove(Key, Future)
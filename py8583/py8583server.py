@@ -0,0 +1,166 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import weakref
+
+from .py8583 import log
+from .py8583net import IsoServerProtocol, LH
+
+
+def Listener(host, port, ReusePort, Listen = True, Backlog = 1024):
+    sock = socket.socket(socket.AF_INET6 if ':' in (host or '') else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if(ReusePort == True):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host or '', port))
+    if(Listen == True):
+        sock.listen(Backlog)
+    sock.setblocking(False)
+    return sock
+
+
+class IsoWorkerPool(object):
+    # Runs the asyncio server of py8583net in Workers forked processes, so parsing and
+    # building scale with the number of cores. With SO_REUSEPORT every worker has its
+    # own listening socket and the kernel balances connections between them. Without
+    # it, the workers accept on one listening socket inherited from the master.
+    #
+    # SIGTERM/SIGINT stop the pool, SIGHUP replaces the workers. Either way old workers
+    # stop accepting and get DrainTimeout seconds to answer their in-flight requests.
+
+    def __init__(self, Handler, IsoSpec, host = '', port = 5000, Workers = None, Header = LH.BIN2, TPDU = 0,
+                 ReusePort = None, DrainTimeout = 30.0):
+        self.Handler = Handler
+        self.IsoSpec = IsoSpec
+        self.host = host
+        self.port = port
+        self.Workers = Workers or os.cpu_count() or 1
+        self.Header = Header
+        self.TPDU = TPDU
+        self.ReusePort = hasattr(socket, 'SO_REUSEPORT') if ReusePort == None else ReusePort
+        self.DrainTimeout = DrainTimeout
+
+        self.__context = multiprocessing.get_context('fork')
+        self.__sock = None
+        self.__processes = []
+        self.__running = False
+        self.__restart = False
+
+
+    def Start(self):
+        # With SO_REUSEPORT the master only keeps a bound socket to hold the port
+        # (it doesn't listen, so it gets no connections)
+        self.__sock = Listener(self.host, self.port, self.ReusePort, Listen = not self.ReusePort)
+        self.port = self.__sock.getsockname()[1]
+
+        self.__running = True
+        self.__processes = [self.__Spawn() for i in range(self.Workers)]
+
+
+    def __Spawn(self):
+        Process = self.__context.Process(target = self.__Worker, daemon = True)
+        Process.start()
+        return Process
+
+
+    def __Worker(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        # compile the spec before the first connection
+        self.IsoSpec.Compile()
+
+        if(self.ReusePort == True):
+            self.__sock.close()
+            sock = Listener(self.host, self.port, True)
+        else:
+            sock = self.__sock
+
+        asyncio.run(self.__Serve(sock))
+
+
+    async def __Serve(self, sock):
+        loop = asyncio.get_running_loop()
+        Stopping = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, Stopping.set)
+
+        Protocols = weakref.WeakSet()
+        def Factory():
+            Protocol = IsoServerProtocol(self.Handler, self.IsoSpec, self.Header, self.TPDU)
+            Protocols.add(Protocol)
+            return Protocol
+
+        Server = await loop.create_server(Factory, sock = sock)
+        await Stopping.wait()
+
+        # stop accepting, then let the requests in flight finish
+        Server.close()
+        Deadline = loop.time() + self.DrainTimeout
+        while(any(Protocol.Tasks for Protocol in Protocols) and loop.time() < Deadline):
+            await asyncio.sleep(0.05)
+
+        for Protocol in list(Protocols):
+            if(Protocol.transport != None):
+                Protocol.transport.close()
+        await Server.wait_closed()
+
+
+    def __Terminate(self, Processes):
+        for Process in Processes:
+            if(Process.is_alive()):
+                Process.terminate()
+        for Process in Processes:
+            Process.join(self.DrainTimeout + 5)
+            if(Process.is_alive()):
+                Process.kill()
+                Process.join()
+
+
+    def Restart(self):
+        # New workers start accepting before the old ones are drained
+        Old = self.__processes
+        self.__processes = [self.__Spawn() for i in range(self.Workers)]
+        self.__Terminate(Old)
+
+
+    def Stop(self):
+        self.__running = False
+        self.__Terminate(self.__processes)
+        self.__processes = []
+        if(self.__sock != None):
+            self.__sock.close()
+            self.__sock = None
+
+
+    def Supervise(self):
+        # Replaces workers that died unexpectedly
+        for i, Process in enumerate(self.__processes):
+            if(Process.is_alive() == False):
+                log.error("Worker {0} exited with code {1}, restarting".format(Process.pid, Process.exitcode))
+                self.__processes[i] = self.__Spawn()
+
+
+    def Run(self):
+        # Blocks until the master gets SIGTERM or SIGINT
+        def StopHandler(signum, frame):
+            self.__running = False
+        def RestartHandler(signum, frame):
+            self.__restart = True
+
+        signal.signal(signal.SIGTERM, StopHandler)
+        signal.signal(signal.SIGINT, StopHandler)
+        signal.signal(signal.SIGHUP, RestartHandler)
+
+        self.Start()
+        try:
+            while(self.__running):
+                if(self.__restart):
+                    self.__restart = False
+                    self.Restart()
+                self.Supervise()
+                time.sleep(0.2)
+        finally:
+            self.Stop()
@@ -1,18 +1,74 @@
+import threading
+from types import MappingProxyType
+
 from .py8583 import DT, LT, SpecError
+from . import py8583codec
     
 
+# Tables of every spec class, built once per class: (Descriptions, ContentTypes, DataTypes, Key)
+_Tables = {}
+
+# Compiled codecs, shared by all specs with the same field definitions
+_Compiled = {}
+
+
+def _Freeze(Table):
+    # Read-only copy of a spec table. Equal field definitions share the same object.
+    Unique = {}
+    Frozen = {}
+    for field, Entry in Table.items():
+        if(isinstance(Entry, dict) or isinstance(Entry, MappingProxyType)):
+            Items = tuple(sorted(Entry.items()))
+            if(Items not in Unique):
+                Unique[Items] = MappingProxyType(dict(Entry))
+            Entry = Unique[Items]
+        Frozen[field] = Entry
+    return MappingProxyType(Frozen)
+
             
 class IsoSpec(object):
+    # Specs share their (read-only) tables until they're modified. The first
+    # modification gives the instance its own copy of them, so modified instances never
+    # affect other instances or the module level tables. Freeze() makes an instance
+    # read-only. Only frozen specs are hashable, the others change with their fields.
+    #
+    # A class which sets _SharedTables = True in its own body (it isn't inherited) has
+    # its tables built once and shared by all its instances. Only do so if its Set*
+    # methods depend on nothing but the class (no constructor arguments or instance state).
+    
     __ValidContentTypes = ('a', 'n', 's', 'an', 'as', 'ns', 'ans', 'b', 'z')
     
-    Descriptions = {}
-    ContentTypes = {}
-    DataTypes = {}
+    Descriptions = MappingProxyType({})
+    ContentTypes = MappingProxyType({})
+    DataTypes = MappingProxyType({})
+    
+    _Compiled = None
+    _Key = None
+    _Shared = False
+    _Frozen = False
+    _Name = None
+    _SharedTables = True
     
     def __init__(self):
-        self.SetDescriptions()
-        self.SetContentTypes()
-        self.SetDataTypes()
+        cls = type(self)
+        Shared = cls.__dict__.get('_SharedTables', False)
+        Tables = _Tables.get(cls) if Shared else None
+        if(Tables == None):
+            self.Descriptions = {}
+            self.ContentTypes = {}
+            self.DataTypes = {}
+            
+            self.SetDescriptions()
+            self.SetContentTypes()
+            self.SetDataTypes()
+            
+            Tables = (_Freeze(self.Descriptions), _Freeze(self.ContentTypes), _Freeze(self.DataTypes))
+            Tables = Tables + (self.__MakeKey(*Tables),)
+            if(Shared):
+                Tables = _Tables.setdefault(cls, Tables)
+        
+        self.Descriptions, self.ContentTypes, self.DataTypes, self._Key = Tables
+        self._Shared = True
     
     def SetDescriptions(self):
         pass
@@ -21,11 +77,92 @@ class IsoSpec(object):
     def SetDataTypes(self):
         pass
 
+    @staticmethod
+    def __MakeKey(Descriptions, ContentTypes, DataTypes):
+        # Everything the compiled codec depends on
+        Key = []
+        for field in ['MTI'] + list(range(1, 129)):
+            Key.append((tuple(sorted(ContentTypes[field].items())) if field in ContentTypes else None,
+                        tuple(sorted(DataTypes[field].items())) if field in DataTypes else None))
+        return tuple(Key)
+
+    def Key(self):
+        if(self._Key == None):
+            self._Key = self.__MakeKey(self.Descriptions, self.ContentTypes, self.DataTypes)
+        return self._Key
+
+    def __Modify(self):
+        # copy on write of the shared tables
+        if(self._Frozen == True):
+            raise SpecError("Cannot modify a frozen spec")
+        if(self._Shared == True):
+            self.Descriptions = dict(self.Descriptions)
+            self.ContentTypes = dict((field, dict(Entry)) for field, Entry in self.ContentTypes.items())
+            self.DataTypes = dict((field, dict(Entry)) for field, Entry in self.DataTypes.items())
+            self._Shared = False
+        self._Compiled = None
+        self._Key = None
+
+    def Freeze(self):
+        if(self._Frozen == False):
+            if(self._Shared == False):
+                self.Descriptions = _Freeze(self.Descriptions)
+                self.ContentTypes = _Freeze(self.ContentTypes)
+                self.DataTypes = _Freeze(self.DataTypes)
+                self._Shared = True
+            self._Frozen = True
+        return self
+
+    def Frozen(self):
+        return self._Frozen
+
+    def Name(self):
+        return self._Name or type(self).__name__
+
+    def Copy(self):
+        # A modifiable copy, e.g. of a frozen spec
+        Copy = object.__new__(type(self))
+        Copy.__dict__.update(self.__dict__)
+        Copy._Frozen = False
+        if(self._Shared == False):
+            Copy.Descriptions = dict(self.Descriptions)
+            Copy.ContentTypes = dict((field, dict(Entry)) for field, Entry in self.ContentTypes.items())
+            Copy.DataTypes = dict((field, dict(Entry)) for field, Entry in self.DataTypes.items())
+        return Copy
+
+    def __eq__(self, other):
+        return (type(self) == type(other) and self.Key() == other.Key()
+                and self.Descriptions == other.Descriptions)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        # Specs which can still be modified hash by identity, as they always did (their
+        # hash can't follow their fields). Frozen specs hash as their field definitions.
+        if(self._Frozen == False):
+            return object.__hash__(self)
+        return hash((type(self), self.Key()))
+
+    def Compile(self):
+        # The compiled codec is built once per field definition and reused until the spec is modified
+        if(self._Compiled == None):
+            Key = self.Key()
+            Compiled = _Compiled.get(Key)
+            if(Compiled == None):
+                Compiled = _Compiled.setdefault(Key, py8583codec.CompileSpec(self))
+            self._Compiled = Compiled
+        return self._Compiled
+
+    def Parser(self, Fields = None, Strict = False):
+        return py8583codec.IsoParser(self, Fields, Strict)
+
          
     def Description(self, field, Description = None):
         if(Description == None):
             return self.Descriptions[field]
         else:
+            self.__Modify()
             self.Descriptions[field] = Description
 
     def DataType(self, field, DataType = None):
@@ -34,6 +171,7 @@ class IsoSpec(object):
         else:
             if(DataType not in DT):
                 raise SpecError("Cannot set data type '{0}' for F{1}: Invalid data type".format(DataType, field))
+            self.__Modify()
             if(field not in self.DataTypes.keys()):
                 self.DataTypes[field] = {}
             self.DataTypes[field]['Data'] = DataType
@@ -44,12 +182,14 @@ class IsoSpec(object):
         else:
             if(ContentType not in self.__ValidContentTypes):
                 raise SpecError("Cannot set Content type '{0}' for F{1}: Invalid content type".format(ContentType, field))
+            self.__Modify()
             self.ContentTypes[field]['ContentType'] = ContentType
             
     def MaxLength(self, field, MaxLength = None):
         if(MaxLength == None):
             return self.ContentTypes[field]['MaxLen']
         else:
+            self.__Modify()
             self.ContentTypes[field]['MaxLen'] = MaxLength
     
     def LengthType(self, field, LengthType = None):
@@ -58,6 +198,7 @@ class IsoSpec(object):
         else:
             if(LengthType not in LT):
                 raise SpecError("Cannot set Length type '{0}' for F{1}: Invalid length type".format(LengthType, field))
+            self.__Modify()
             self.ContentTypes[field]['LenType'] = LengthType
     
     def LengthDataType(self, field, LengthDataType = None):
@@ -66,19 +207,45 @@ class IsoSpec(object):
         else:
             if(LengthDataType not in DT):
                 raise SpecError("Cannot set data type '{0}' for F{1}: Invalid data type".format(LengthDataType, field))
+            self.__Modify()
             if(field not in self.DataTypes.keys()):
                 self.DataTypes[field] = {}
             self.DataTypes[field]['Length'] = LengthDataType
+
+    def Define(self, field, ContentType, MaxLength, LengthType, DataType, LengthDataType = None, Description = None):
+        # Adds (or replaces) the complete definition of a field
+        self.__Modify()
+        Previous = (self.ContentTypes.get(field), self.DataTypes.get(field), self.Descriptions.get(field))
+        self.ContentTypes[field] = {}
+        self.DataTypes[field] = {}
+        try:
+            self.ContentType(field, ContentType)
+            self.MaxLength(field, MaxLength)
+            self.LengthType(field, LengthType)
+            self.DataType(field, DataType)
+            if(LengthDataType != None):
+                self.LengthDataType(field, LengthDataType)
+            if(Description != None):
+                self.Description(field, Description)
+        except SpecError:
+            for Table, Entry in zip((self.ContentTypes, self.DataTypes, self.Descriptions), Previous):
+                if(Entry == None):
+                    Table.pop(field, None)
+                else:
+                    Table[field] = Entry
+            raise
     
 
     
 class IsoSpec1987(IsoSpec):
+    _SharedTables = True
     def SetDescriptions(self):
-        self.Descriptions = Descriptions['1987']
+        self.Descriptions = dict(Descriptions['1987'])
     def SetContentTypes(self):
-        self.ContentTypes = ContentTypes['1987']
+        self.ContentTypes = dict((field, dict(Entry)) for field, Entry in ContentTypes['1987'].items())
         
 class IsoSpec1987ASCII(IsoSpec1987):
+    _SharedTables = True
     def SetDataTypes(self):
         self.DataType('MTI', DT.ASCII)
         self.DataType(1, DT.ASCII) # bitmap
@@ -90,14 +257,16 @@ class IsoSpec1987ASCII(IsoSpec1987):
                 
 
 class BICISO(IsoSpec1987ASCII):
+    _SharedTables = True
     def SetContentTypes(self):
         super(BICISO, self).SetContentTypes()
         
         # Variations between official ISO and BIC ISO
-        self.ContentTypes[41]['MaxLen'] = 16
-        self.ContentTypes[44]['MaxLen'] = 27
+        self.MaxLength(41, 16)
+        self.MaxLength(44, 27)
                 
 class IsoSpec1987BCD(IsoSpec1987):
+    _SharedTables = True
     def SetContentTypes(self):
         super().SetContentTypes()
         # Most popular BCD implementations use the reserved/private fields
@@ -125,13 +294,15 @@ class IsoSpec1987BCD(IsoSpec1987):
                 self.LengthDataType(field, DT.BCD)
 
 class IsoSpec1993(IsoSpec):
+    _SharedTables = True
     def SetDescriptions(self):
-        self.Descriptions = Descriptions['1993']
+        self.Descriptions = dict(Descriptions['1993'])
     def SetContentTypes(self):
-        self.ContentTypes = ContentTypes['1993']
+        self.ContentTypes = dict((field, dict(Entry)) for field, Entry in ContentTypes['1993'].items())
 
 
 class IsoSpec1993ASCII(IsoSpec1993):
+    _SharedTables = True
     def SetDataTypes(self):
         self.DataType('MTI', DT.ASCII)
         self.DataType(1, DT.ASCII) # bitmap
@@ -142,6 +313,57 @@ class IsoSpec1993ASCII(IsoSpec1993):
                 self.LengthDataType(field, DT.ASCII)
 
 
+# Shared read-only specs, by (spec class, overrides)
+_Registry = {}
+_RegistryLock = threading.Lock()
+
+# Override keys and the setter each one goes through
+_Overrides = {
+    'Description': IsoSpec.Description,
+    'ContentType': IsoSpec.ContentType,
+    'MaxLen':      IsoSpec.MaxLength,
+    'LenType':     IsoSpec.LengthType,
+    'Data':        IsoSpec.DataType,
+    'Length':      IsoSpec.LengthDataType,
+}
+
+def _OverrideKey(Overrides):
+    Key = []
+    for field, Entry in Overrides.items():
+        for Name, Value in Entry.items():
+            if(Name not in _Overrides):
+                raise SpecError("Cannot override '{0}' for F{1}: Unknown attribute".format(Name, field))
+            Key.append((str(field), field, Name, Value))
+    return tuple(sorted(Key))
+
+def GetSpec(SpecClass, Overrides = None):
+    # Returns the shared, frozen instance of a spec class (or the name of one in this
+    # module), built on first use. Overrides modify fields of the spec, e.g.
+    #   GetSpec(IsoSpec1987ASCII, {41: {'MaxLen': 16}, 44: {'MaxLen': 27}})
+    # Use SpecClass() for a private, modifiable spec.
+    if(isinstance(SpecClass, str)):
+        Name = SpecClass
+        SpecClass = globals().get(Name)
+        if(isinstance(SpecClass, type) == False or issubclass(SpecClass, IsoSpec) == False):
+            raise SpecError("Unknown spec '{0}'".format(Name))
+    
+    Key = (SpecClass, _OverrideKey(Overrides) if Overrides else ())
+    Spec = _Registry.get(Key)
+    if(Spec != None):
+        return Spec
+    
+    with _RegistryLock:
+        Spec = _Registry.get(Key)
+        if(Spec == None):
+            Spec = SpecClass()
+            for Name, field, Attribute, Value in Key[1]:
+                _Overrides[Attribute](Spec, field, Value)
+            Spec.Freeze()
+            Spec.Compile()
+            _Registry[Key] = Spec
+    return Spec
+
+
 Descriptions = {}
 ContentTypes = {}
 
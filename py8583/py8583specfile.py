@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+
+from .py8583 import DT, LT, SpecError
+from . import py8583spec
+
+
+# A spec definition file (JSON, or TOML with python 3.11+ or tomli) looks like:
+#
+#   {
+#     "Name":   "MyNetwork",
+#     "Base":   "IsoSpec1987BCD",
+#     "MTI":    "BCD",
+#     "Bitmap": "BIN",
+#     "Fields": {
+#       "41":  {"MaxLen": 16},
+#       "62":  {"ContentType": "ans", "MaxLen": 999, "LenType": "LLLVAR", "Data": "ASCII", "Length": "BCD",
+#               "Description": "Private data"}
+#     }
+#   }
+#
+# Base (optional) is a spec class of py8583spec the fields start from. Fields not in the
+# base need ContentType, MaxLen, LenType and Data, plus Length for variable length fields.
+# Enumerations are given by name (LT and DT).
+
+_Keys = ('Name', 'Base', 'MTI', 'Bitmap', 'Fields')
+_FieldKeys = ('Description', 'ContentType', 'MaxLen', 'LenType', 'Data', 'Length')
+
+_LengthLimit = {LT.LVAR: 9, LT.LLVAR: 99, LT.LLLVAR: 999}
+
+_LTValues = dict((int(Value), Value) for Value in LT)
+_DTValues = dict((int(Value), Value) for Value in DT)
+
+# bumped whenever the cached form changes
+_CacheVersion = b'py8583 spec cache 2\n'
+
+
+def _Enum(Enum, Value, Of, Name):
+    if(isinstance(Value, str) and Value in Enum.__members__):
+        return Enum[Value]
+    raise SpecError("Invalid {0} '{1}' for {2}".format(Name, Value, Of))
+
+
+def _Field(field):
+    try:
+        Number = int(field)
+    except ValueError:
+        raise SpecError("Invalid field '{0}'".format(field))
+    if(Number < 2 or Number > 128):
+        raise SpecError("Invalid field '{0}'".format(field))
+    return Number
+
+
+def BuildSpec(Definition):
+    # Validates a definition (as read from a spec file) and returns a frozen spec
+    if(isinstance(Definition, dict) == False):
+        raise SpecError("Spec definition must be an object")
+    for Key in Definition:
+        if(Key not in _Keys):
+            raise SpecError("Unknown spec attribute '{0}'".format(Key))
+
+    IsoSpec = py8583spec.GetSpec(Definition.get('Base', 'IsoSpec')).Copy()
+    IsoSpec._Name = Definition.get('Name')
+
+    if('MTI' in Definition):
+        IsoSpec.DataType('MTI', _Enum(DT, Definition['MTI'], 'the MTI', 'data type'))
+    if('Bitmap' in Definition):
+        IsoSpec.DataType(1, _Enum(DT, Definition['Bitmap'], 'the bitmap', 'data type'))
+
+    Fields = Definition.get('Fields', {})
+    if(isinstance(Fields, dict) == False):
+        raise SpecError("Spec Fields must be an object")
+
+    for field, Entry in Fields.items():
+        field = _Field(field)
+        if(isinstance(Entry, dict) == False):
+            raise SpecError("Definition of F{0} must be an object".format(field))
+        for Key in Entry:
+            if(Key not in _FieldKeys):
+                raise SpecError("Unknown attribute '{0}' for F{1}".format(Key, field))
+
+        Entry = dict(Entry)
+        for Key, Enum, Name in (('LenType', LT, 'length type'), ('Data', DT, 'data type'), ('Length', DT, 'data type')):
+            if(Key in Entry):
+                Entry[Key] = _Enum(Enum, Entry[Key], 'F{0}'.format(field), Name)
+        if('MaxLen' in Entry and (isinstance(Entry['MaxLen'], int) == False or Entry['MaxLen'] < 1)):
+            raise SpecError("Invalid maximum length '{0}' for F{1}".format(Entry['MaxLen'], field))
+
+        if(field not in IsoSpec.ContentTypes):
+            for Key in ('ContentType', 'MaxLen', 'LenType', 'Data'):
+                if(Key not in Entry):
+                    raise SpecError("Incomplete definition of F{0}: Missing {1}".format(field, Key))
+            IsoSpec.Define(field, Entry['ContentType'], Entry['MaxLen'], Entry['LenType'], Entry['Data'],
+                           Entry.get('Length'), Entry.get('Description'))
+        else:
+            for Key, Value in Entry.items():
+                py8583spec._Overrides[Key](IsoSpec, field, Value)
+
+    # everything the codec needs must be there
+    for field in ('MTI', 1):
+        if('Data' not in IsoSpec.DataTypes.get(field, {})):
+            raise SpecError("Incomplete definition: Missing data type of {0}".format('MTI' if field == 'MTI' else 'the bitmap'))
+
+    for field in IsoSpec.ContentTypes:
+        if(field == 1):
+            continue
+        DataTypes = IsoSpec.DataTypes.get(field, {})
+        LenType = IsoSpec.LengthType(field)
+        if('Data' not in DataTypes):
+            raise SpecError("Incomplete definition of F{0}: Missing Data".format(field))
+        if(LenType != LT.FIXED):
+            if('Length' not in DataTypes):
+                raise SpecError("Incomplete definition of F{0}: Missing Length".format(field))
+            if(IsoSpec.MaxLength(field) > _LengthLimit[LenType]):
+                raise SpecError("F{0} maximum length {1} doesn't fit in {2}".format(field, IsoSpec.MaxLength(field), LenType.name))
+
+    IsoSpec.Freeze()
+    IsoSpec.Compile()
+    return IsoSpec
+
+
+def _BaseKey(Base):
+    # the field definitions of the base spec the tables were built on, which change
+    # with py8583 while the spec file doesn't
+    return hashlib.sha256(repr(py8583spec.GetSpec(Base).Key()).encode('utf-8')).hexdigest()
+
+
+def _Dump(IsoSpec):
+    # the validated tables, in JSON
+    def Entries(Table):
+        return dict((str(field), dict((Key, int(Value) if isinstance(Value, int) else Value) for Key, Value in Entry.items()))
+                    for field, Entry in Table.items())
+    return json.dumps({'Name': IsoSpec._Name,
+                       'Base': type(IsoSpec).__name__,
+                       'BaseKey': _BaseKey(type(IsoSpec).__name__),
+                       'Descriptions': dict((str(field), Value) for field, Value in IsoSpec.Descriptions.items()),
+                       'ContentTypes': Entries(IsoSpec.ContentTypes),
+                       'DataTypes': Entries(IsoSpec.DataTypes)})
+
+
+def _Load(Cached):
+    def Key(field):
+        return field if field == 'MTI' else int(field)
+    def Entries(Table, Enums):
+        # enumerations are stored by value
+        Entries = {}
+        for field, Entry in Table.items():
+            for Name, Enum in Enums:
+                if(Name in Entry):
+                    Entry[Name] = Enum[Entry[Name]]
+            Entries[Key(field)] = Entry
+        return Entries
+
+    Cached = json.loads(Cached)
+    if(Cached['BaseKey'] != _BaseKey(Cached['Base'])):
+        raise ValueError("Cached spec of another {0}".format(Cached['Base']))
+    IsoSpec = py8583spec.GetSpec(Cached['Base']).Copy()
+    IsoSpec._Name = Cached['Name']
+    IsoSpec.Descriptions = dict((Key(field), Value) for field, Value in Cached['Descriptions'].items())
+    IsoSpec.ContentTypes = Entries(Cached['ContentTypes'], (('LenType', _LTValues),))
+    IsoSpec.DataTypes = Entries(Cached['DataTypes'], (('Data', _DTValues), ('Length', _DTValues)))
+    IsoSpec._Shared = False
+    IsoSpec._Key = None
+    IsoSpec._Compiled = None
+    IsoSpec.Freeze()
+    IsoSpec.Compile()
+    return IsoSpec
+
+
+def ReadDefinition(data, Format = 'json'):
+    if(Format == 'toml'):
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ImportError("tomllib (python 3.11+) or tomli is required for TOML spec files")
+        return tomllib.loads(data.decode('utf-8'))
+    elif(Format == 'json'):
+        return json.loads(data.decode('utf-8'))
+    raise ValueError("Unknown spec file format '{0}'".format(Format))
+
+
+def LoadSpec(path, CacheDir = None):
+    # Loads a frozen spec from a .json or .toml definition file. With a CacheDir, the
+    # validated spec is stored there by the hash of the file and later loads of the
+    # same file skip validation, as long as the base spec's fields are the same.
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    CachePath = None
+    if(CacheDir != None):
+        Digest = hashlib.sha256(_CacheVersion + data).hexdigest()
+        CachePath = os.path.join(CacheDir, Digest + '.json')
+        try:
+            with open(CachePath, 'rb') as f:
+                return _Load(f.read().decode('utf-8'))
+        except (OSError, ValueError, KeyError, TypeError, SpecError):
+            pass # not cached (or a broken cache file), build it again
+
+    Format = 'toml' if path.endswith('.toml') else 'json'
+    try:
+        Definition = ReadDefinition(data, Format)
+    except ValueError as ex:
+        raise SpecError("Cannot load spec {0}: {1}".format(path, ex))
+    IsoSpec = BuildSpec(Definition)
+
+    if(CachePath != None):
+        os.makedirs(CacheDir, exist_ok = True)
+        Temp = "{0}.{1}.tmp".format(CachePath, os.getpid())
+        with open(Temp, 'w') as f:
+            f.write(_Dump(IsoSpec))
+        os.replace(Temp, CachePath)
+
+    return IsoSpec
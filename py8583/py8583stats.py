@@ -0,0 +1,106 @@
+import bisect
+import threading
+
+
+# Sinks receive the timings of an instrumented Iso8583 (see Iso8583.Stats):
+#   Record(Spec, MTI, Phase, Field, Seconds, Bytes)
+#   Error(Spec, MTI, Phase, Field)
+# Phase is one of 'parse', 'build', 'mti', 'bitmap', 'field' or 'handler'. Field is the
+# field number for the 'field' phase and None otherwise. MTI is None if it's not known yet.
+
+
+class CallbackSink(object):
+    # Passes every event to a callback as Callback(Event, Spec, MTI, Phase, Field, Seconds, Bytes),
+    # where Event is 'record' or 'error'
+
+    def __init__(self, Callback):
+        self.Callback = Callback
+
+    def Record(self, Spec, MTI, Phase, Field, Seconds, Bytes):
+        self.Callback('record', Spec, MTI, Phase, Field, Seconds, Bytes)
+
+    def Error(self, Spec, MTI, Phase, Field):
+        self.Callback('error', Spec, MTI, Phase, Field, None, None)
+
+
+class Histogram(object):
+    __slots__ = ('Buckets', 'Count', 'Sum', 'Bytes', 'Errors')
+
+    def __init__(self, Bounds):
+        self.Buckets = [0] * (len(Bounds) + 1)
+        self.Count = 0
+        self.Sum = 0.0
+        self.Bytes = 0
+        self.Errors = 0
+
+
+class HistogramRegistry(object):
+    # Aggregates timings per (spec, MTI, phase, field) into histograms
+
+    Bounds = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 1e-2, 1e-1, 1.0)
+
+    def __init__(self, Bounds = None):
+        if(Bounds != None):
+            self.Bounds = tuple(Bounds)
+        self.__Histograms = {}
+        self.__lock = threading.Lock()
+
+    def __Get(self, Key):
+        Entry = self.__Histograms.get(Key)
+        if(Entry == None):
+            Entry = self.__Histograms[Key] = Histogram(self.Bounds)
+        return Entry
+
+    def Record(self, Spec, MTI, Phase, Field, Seconds, Bytes):
+        with self.__lock:
+            Entry = self.__Get((Spec, MTI, Phase, Field))
+            Entry.Buckets[bisect.bisect_left(self.Bounds, Seconds)] += 1
+            Entry.Count += 1
+            Entry.Sum += Seconds
+            Entry.Bytes += Bytes
+
+    def Error(self, Spec, MTI, Phase, Field):
+        with self.__lock:
+            self.__Get((Spec, MTI, Phase, Field)).Errors += 1
+
+    def Snapshot(self):
+        # {(Spec, MTI, Phase, Field): {'buckets': [...], 'count': n, 'sum': s, 'bytes': b, 'errors': e}}
+        with self.__lock:
+            return dict((Key, {'buckets': list(Entry.Buckets), 'count': Entry.Count, 'sum': Entry.Sum,
+                               'bytes': Entry.Bytes, 'errors': Entry.Errors})
+                        for Key, Entry in self.__Histograms.items())
+
+    def Reset(self):
+        with self.__lock:
+            self.__Histograms = {}
+
+
+def _LabelValue(Value):
+    # label values escape backslash, double quote and line feed
+    return str(Value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def PrometheusText(Registry, Prefix = 'py8583'):
+    # Renders a HistogramRegistry in the Prometheus text exposition format
+    Seconds = ["# TYPE {0}_phase_seconds histogram".format(Prefix)]
+    Bytes = ["# TYPE {0}_phase_bytes_total counter".format(Prefix)]
+    Errors = ["# TYPE {0}_errors_total counter".format(Prefix)]
+
+    for (Spec, MTI, Phase, Field), Entry in sorted(Registry.Snapshot().items(), key = lambda Item: str(Item[0])):
+        Labels = 'spec="{0}",mti="{1}",phase="{2}"'.format(_LabelValue(Spec), _LabelValue(MTI or ''), _LabelValue(Phase))
+        if(Field != None):
+            Labels += ',field="{0}"'.format(_LabelValue(Field))
+
+        Cumulative = 0
+        for Bound, Count in zip(Registry.Bounds + (float('inf'),), Entry['buckets']):
+            Cumulative += Count
+            Le = "+Inf" if Bound == float('inf') else repr(Bound)
+            Seconds.append('{0}_phase_seconds_bucket{{{1},le="{2}"}} {3}'.format(Prefix, Labels, Le, Cumulative))
+        Seconds.append('{0}_phase_seconds_sum{{{1}}} {2!r}'.format(Prefix, Labels, Entry['sum']))
+        Seconds.append('{0}_phase_seconds_count{{{1}}} {2}'.format(Prefix, Labels, Entry['count']))
+
+        Bytes.append('{0}_phase_bytes_total{{{1}}} {2}'.format(Prefix, Labels, Entry['bytes']))
+        if(Entry['errors']):
+            Errors.append('{0}_errors_total{{{1}}} {2}'.format(Prefix, Labels, Entry['errors']))
+
+    return "\n".join(Seconds + Bytes + Errors) + "\n"
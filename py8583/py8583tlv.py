@@ -0,0 +1,292 @@
+import binascii
+from collections import namedtuple
+
+from .py8583 import ParseError, BuildError
+
+
+# TLV data of a field, like the EMV (BER-TLV) ICC data of F55 or the subelements of
+# private fields such as F48 and F62:
+#
+#   Tlv = IsoPacket.TLV(55)
+#   Amount = Tlv.Number('9F02')
+#   Tlv['9F10'] = IssuerData
+#   IsoPacket.TLV(55, Tlv)
+#
+# The data isn't copied or decoded when an IsoTLV is created. The tags are indexed
+# by the first access and their values are sliced out of the data when asked for
+# (over a memoryview, the values of a lazily parsed message are never copied).
+# Building copies the TLVs which weren't changed as they are.
+#
+# Tags are uppercase hex strings for BER-TLV ('9F02', accepted in either case) and the
+# tag text for TextFormat ones. Values are bytes, constructed values can be read with TLV(tag).
+
+
+# Read(buf, p, end) -> (tag, start, end) of the TLV at p, start and end are its value's
+#                      (tag is None for padding between TLVs)
+# Write(tag, value) -> encoded TLV
+TLVFormat = namedtuple('TLVFormat', ('Read', 'Write'))
+
+
+def _BerRead(buf, p, end):
+    First = buf[p]
+    # padding before, between and after EMV data objects
+    if(First == 0x00 or First == 0xFF):
+        return None, p + 1, p + 1
+
+    q = p + 1
+    if(First & 0x1F == 0x1F):
+        # subsequent tag bytes have bit 8 set, but the last one
+        while(True):
+            if(q >= end):
+                raise ParseError("Truncated TLV tag at {0}".format(p))
+            q += 1
+            if(buf[q - 1] & 0x80 == 0):
+                break
+    Tag = binascii.hexlify(buf[p:q]).decode('latin-1').upper()
+
+    if(q >= end):
+        raise ParseError("Missing length of TLV {0}".format(Tag))
+    Len = buf[q]
+    q += 1
+    if(Len & 0x80):
+        Size = Len & 0x7F
+        if(Size == 0 or Size > 4 or q + Size > end):
+            raise ParseError("Invalid length of TLV {0}".format(Tag))
+        Len = int.from_bytes(buf[q:q+Size], 'big')
+        q += Size
+
+    if(q + Len > end):
+        raise ParseError("TLV {0} is larger than its data ({1}>{2})".format(Tag, Len, end - q))
+    return Tag, q, q + Len
+
+
+def _BerWrite(tag, value):
+    try:
+        Tag = binascii.unhexlify(tag)
+    except (binascii.Error, TypeError):
+        raise BuildError("Invalid TLV tag [{0}]".format(tag)) from None
+    if(Tag == b''):
+        raise BuildError("Invalid TLV tag [{0}]".format(tag))
+
+    Len = len(value)
+    if(Len < 0x80):
+        return Tag + bytes((Len,)) + value
+    Length = Len.to_bytes((Len.bit_length() + 7) // 8, 'big')
+    return Tag + bytes((0x80 | len(Length),)) + Length + value
+
+
+BER = TLVFormat(_BerRead, _BerWrite)
+
+
+def TextFormat(TagSize = 2, LenSize = 2):
+    # TLVs with a tag of TagSize characters and a length of LenSize ASCII digits, as in
+    # the subelements of many private fields
+    Template = "%0{0}d".format(LenSize).encode('latin-1')
+    MaxLength = 10 ** LenSize - 1
+
+    def Read(buf, p, end):
+        start = p + TagSize + LenSize
+        if(start > end):
+            raise ParseError("Truncated TLV at {0}".format(p))
+        Tag = bytes(buf[p:p+TagSize]).decode('latin-1')
+        try:
+            Len = int(bytes(buf[p+TagSize:start]))
+        except ValueError:
+            raise ParseError("Invalid length of TLV {0}".format(Tag)) from None
+        if(start + Len > end):
+            raise ParseError("TLV {0} is larger than its data ({1}>{2})".format(Tag, Len, end - start))
+        return Tag, start, start + Len
+
+    def Write(tag, value):
+        Tag = tag.encode('latin-1')
+        if(len(Tag) != TagSize):
+            raise BuildError("Invalid TLV tag [{0}]".format(tag))
+        if(len(value) > MaxLength):
+            raise BuildError("TLV {0} is larger than its length allows ({1}>{2})".format(tag, len(value), MaxLength))
+        return Tag + Template % len(value) + value
+
+    return TLVFormat(Read, Write)
+
+
+class IsoTLV(object):
+    # A sequence of TLVs in data (bytes, bytearray, memoryview or a hex string) in the
+    # given format (BER if None)
+    __slots__ = ('__data', '__Format', '__Index', '__Order', '__Changes')
+
+    def __init__(self, data = b'', Format = None):
+        if(isinstance(data, str)):
+            try:
+                data = binascii.unhexlify(data)
+            except (binascii.Error, ValueError) as ex:
+                raise ParseError("Invalid TLV data: {0}".format(ex)) from None
+        elif(isinstance(data, (bytes, bytearray, memoryview)) == False):
+            raise TypeError("Expected bytes or a hex string for TLV data")
+
+        self.__data = data
+        self.__Format = Format if Format != None else BER
+        # tag -> (header, start, end) of its TLV, the first one if the tag repeats
+        self.__Index = None
+        # (tag, header, start, end) of every TLV, in the order of the data
+        self.__Order = None
+        # tag -> new value, None for removed tags
+        self.__Changes = {}
+
+    def __Build(self):
+        Read = self.__Format.Read
+        data = self.__data
+        end = len(data)
+        Index = {}
+        Order = []
+        p = 0
+        while(p < end):
+            Tag, start, q = Read(data, p, end)
+            if(Tag != None):
+                Order.append((Tag, p, start, q))
+                if(Tag not in Index):
+                    Index[Tag] = (p, start, q)
+            p = q
+        self.__Order = Order
+        self.__Index = Index
+        return Index
+
+    def __Tag(self, tag):
+        # BER tags are hex, '9f02' is the tag 9F02
+        if(self.__Format is BER and isinstance(tag, str)):
+            return tag.upper()
+        return tag
+
+    def __Find(self, tag):
+        Index = self.__Index
+        if(Index == None):
+            Index = self.__Build()
+        return Index.get(tag)
+
+    def Span(self, tag):
+        # (start, end) of the value of tag in the data, None if it's not there
+        Found = self.__Find(self.__Tag(tag))
+        return Found[1:] if Found != None else None
+
+    def Value(self, tag, Default = None):
+        tag = self.__Tag(tag)
+        if(tag in self.__Changes):
+            Value = self.__Changes[tag]
+            return Value if Value != None else Default
+        Found = self.__Find(tag)
+        if(Found == None):
+            return Default
+        return bytes(self.__data[Found[1]:Found[2]])
+
+    def Text(self, tag, Default = None):
+        Value = self.Value(tag)
+        return Value.decode('latin-1') if Value != None else Default
+
+    def Hex(self, tag = None):
+        # the value of tag in hex, or all of the TLVs if tag is None (for binary fields)
+        Value = self.Value(tag) if tag != None else self.Pack()
+        return binascii.hexlify(Value).decode('latin-1').upper() if Value != None else None
+
+    def Number(self, tag, Default = None):
+        # value of a BCD numeric (n) tag, like the amounts of EMV data
+        Value = self.Value(tag)
+        if(Value == None):
+            return Default
+        try:
+            return int(binascii.hexlify(Value)) if Value != b'' else 0
+        except ValueError:
+            raise ParseError("TLV {0} is not numeric".format(tag)) from None
+
+    def TLV(self, tag):
+        # the TLVs of a constructed tag (like 70 or BF0C), None if it's not there
+        tag = self.__Tag(tag)
+        if(tag in self.__Changes):
+            Value = self.__Changes[tag]
+            return IsoTLV(Value, self.__Format) if Value != None else None
+        Found = self.__Find(tag)
+        if(Found == None):
+            return None
+        data = self.__data
+        if(isinstance(data, memoryview) == False):
+            data = memoryview(data)
+        return IsoTLV(data[Found[1]:Found[2]], self.__Format)
+
+    def Tags(self):
+        if(self.__Index == None):
+            self.__Build()
+        Changes = self.__Changes
+        Tags = [Tag for Tag in self.__Index if Changes.get(Tag, True) != None]
+        Tags += [Tag for Tag, Value in Changes.items() if Value != None and Tag not in self.__Index]
+        return Tags
+
+    def Set(self, tag, Value):
+        tag = self.__Tag(tag)
+        if(isinstance(Value, IsoTLV)):
+            Value = Value.Pack()
+        elif(isinstance(Value, (bytes, bytearray, memoryview))):
+            Value = bytes(Value)
+        else:
+            raise TypeError("Expected bytes or an IsoTLV for TLV {0}".format(tag))
+        # the format raises for tags it can't write
+        self.__Format.Write(tag, b'')
+        self.__Changes[tag] = Value
+
+    def Delete(self, tag):
+        tag = self.__Tag(tag)
+        self.__Changes[tag] = None
+
+    def Format(self):
+        return self.__Format
+
+    def Changed(self):
+        return len(self.__Changes) > 0
+
+    def Pack(self):
+        # Encodes the TLVs: the ones in the data in their order (padding is dropped, if
+        # anything changed) and new ones at the end
+        Changes = self.__Changes
+        if(Changes == {}):
+            return bytes(self.__data)
+
+        if(self.__Index == None):
+            self.__Build()
+        Write = self.__Format.Write
+        data = self.__data
+        Parts = []
+        for Tag, p, start, end in self.__Order:
+            if(Tag not in Changes):
+                Parts.append(data[p:end])
+            elif(Changes[Tag] != None and self.__Index[Tag][0] == p):
+                # a repeated tag which is changed is written once
+                Parts.append(Write(Tag, Changes[Tag]))
+        for Tag, Value in Changes.items():
+            if(Value != None and Tag not in self.__Index):
+                Parts.append(Write(Tag, Value))
+        return b''.join(Parts)
+
+    def __contains__(self, tag):
+        tag = self.__Tag(tag)
+        if(tag in self.__Changes):
+            return self.__Changes[tag] != None
+        return self.__Find(tag) != None
+
+    def __getitem__(self, tag):
+        Value = self.Value(tag)
+        if(Value == None):
+            raise KeyError(tag)
+        return Value
+
+    def __setitem__(self, tag, Value):
+        self.Set(tag, Value)
+
+    def __delitem__(self, tag):
+        if(tag not in self):
+            raise KeyError(tag)
+        self.Delete(tag)
+
+    def __iter__(self):
+        return iter(self.Tags())
+
+    def __len__(self):
+        return len(self.Tags())
+
+    def __repr__(self):
+        return "IsoTLV({0})".format(", ".join("{0}={1}".format(Tag, self.Hex(Tag)) for Tag in self.Tags()))
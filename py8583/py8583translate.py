@@ -0,0 +1,240 @@
+import binascii
+
+from .py8583 import DT, LT, BuildError, IsoBitmap, CheckMTI, Bcd2Int, _BcdByte
+from . import py8583codec
+
+
+# Translates raw messages from one spec to another (e.g. a BCD terminal network to an
+# ASCII host) without going through Iso8583 objects:
+#
+#   Translator = IsoTranslator(IsoSpec1987BCD(), IsoSpec1987ASCII(), Rules = {41: Rewrite})
+#   HostMsg = Translator.Translate(TerminalMsg)
+#
+# Every field is converted at byte level when its content stays the same:
+#   - copied, if both specs encode it the same way
+#   - with its data copied and a new length prefix, if only the prefix differs
+#   - numeric and track2 fields between BCD and ASCII digits
+#   - binary fields to (and from) ASCII hex
+# and otherwise decoded with the source spec and encoded with the target one.
+#
+# Rules map fields to Rule(value) -> value, or None to drop the field. Fields with a
+# rule are decoded, passed to it and encoded. A rule for 'MTI' rewrites the MTI.
+#
+# Digits are carried over as they are: a variable length numeric field keeps its
+# leading zeros, which parsing and building again (through an int) would drop.
+
+
+def _Prefix(LenType, LenDataType):
+    # (size, read, write) of a length prefix, None for unsupported prefixes
+    Digits = {LT.LVAR: 1, LT.LLVAR: 2, LT.LLLVAR: 3}[LenType]
+
+    if(LenDataType == DT.ASCII):
+        Template = "%0{0}d".format(Digits).encode('latin-1')
+        def Read(buf, p):
+            return int(buf[p:p+Digits])
+        def Write(Len):
+            return Template % Len
+        return Digits, Read, Write
+    elif(LenDataType == DT.BCD):
+        Size = (Digits + 1) // 2
+        def Read(buf, p):
+            return Bcd2Int(buf[p:p+Size])
+        if(Size == 1):
+            def Write(Len):
+                return _BcdByte[Len]
+        else:
+            def Write(Len):
+                return _BcdByte[Len // 100] + _BcdByte[Len % 100]
+        return Size, Read, Write
+    return None
+
+
+def _Text(DataType, ContentType):
+    # fields holding text as it is in the message
+    return DataType == DT.ASCII and ContentType not in ('n', 'z')
+
+
+def _Hex(DataType, ContentType):
+    # binary fields, given and returned as hex
+    return DataType == DT.BIN and ContentType == 'b'
+
+
+def _Fallback(field, Source, Target, TargetMax, Rule):
+    # decodes the field with the source spec and encodes it with the target one
+    Check = TargetMax != None
+
+    def Convert(iso, p):
+        start, end = Source.Span(iso, p)
+        Value = Source.Decode(iso, start, end)
+        if(Rule != None):
+            Value = Rule(Value)
+            if(Value == None):
+                return None, end
+        if(Check and len(str(Value)) > TargetMax):
+            raise BuildError("Cannot Build F{0}: Field Length larger than specification".format(field))
+        return Target.Encode(Value), end
+
+    return Convert
+
+
+def _Converter(field, SourceSpec, TargetSpec, Rule):
+    Source = SourceSpec.Compile().Fields[field]
+    Target = TargetSpec.Compile().Fields[field]
+    From = py8583codec.FieldEncoding(SourceSpec, field)
+    To = py8583codec.FieldEncoding(TargetSpec, field)
+
+    # values too long for a fixed length target field would make it longer
+    TargetMax = None
+    if(To != None and To[1] == LT.FIXED):
+        TargetMax = TargetSpec.MaxLength(field)
+        if(To[3] == 'b'):
+            TargetMax *= 2 # binary data is given in hex
+    Fallback = _Fallback(field, Source, Target, TargetMax, Rule)
+
+    if(Rule != None or From == None or To == None):
+        return Fallback
+
+    DataType, LenType, LenDataType, ContentType, MaxLength = From
+    ToDataType, ToLenType, ToLenDataType, ToContentType, ToMaxLength = To
+    Fixed = (LenType == LT.FIXED)
+    Size = Source.Size
+
+    if((LenType == LT.FIXED) != (ToLenType == LT.FIXED)):
+        return Fallback
+
+    # content of the field, converted by Data (None if its bytes stay the same)
+    Same = (DataType == ToDataType and (ContentType == ToContentType or
+                                        (_Text(DataType, ContentType) and _Text(ToDataType, ToContentType))))
+    if(Same):
+        if(Fixed and MaxLength != ToMaxLength):
+            return Fallback
+        if(Fixed or (LenDataType == ToLenDataType and LenType == ToLenType and MaxLength <= ToMaxLength)):
+            def Convert(iso, p):
+                end = p + Size if Size != None else Source.Span(iso, p)[1]
+                return iso[p:end], end
+            return Convert
+        # only the length prefix changes
+        Data = None
+    elif(ContentType == 'n' and ToContentType == 'n' and {DataType, ToDataType} == {DT.BCD, DT.ASCII}):
+        if(Fixed and MaxLength != ToMaxLength):
+            return Fallback
+        if(DataType == DT.BCD):
+            def Data(data, Len):
+                Digits = binascii.hexlify(data)
+                Digits = Digits[len(Digits) - Len:]
+                return Digits if Digits.isdigit() else None
+        else:
+            def Data(data, Len):
+                if(data.isdigit() == False):
+                    return None
+                return binascii.unhexlify(b'0' + data if Len % 2 == 1 else data)
+    elif(ContentType == 'z' and ToContentType == 'z' and {DataType, ToDataType} == {DT.BCD, DT.ASCII} and Fixed == False):
+        # track2, with D for = and padded with F in BCD
+        if(DataType == DT.BCD):
+            def Data(data, Len):
+                Track = binascii.hexlify(data)[:Len].upper().replace(b'D', b'=')
+                return Track if Track.replace(b'=', b'').isdigit() else None
+        else:
+            def Data(data, Len):
+                if(data.replace(b'=', b'').isdigit() == False):
+                    return None
+                data = data.replace(b'=', b'D')
+                return binascii.unhexlify(data + b'F' if Len % 2 == 1 else data)
+    elif(_Hex(DataType, ContentType) and _Text(ToDataType, ToContentType)):
+        if(Fixed and (ToContentType != 'b' or MaxLength * 2 != ToMaxLength)):
+            return Fallback
+        def Data(data, Len):
+            return binascii.hexlify(data).upper()
+    elif(_Text(DataType, ContentType) and _Hex(ToDataType, ToContentType)):
+        if(Fixed and (ContentType != 'b' or MaxLength != ToMaxLength * 2)):
+            return Fallback
+        def Data(data, Len):
+            if(Len % 2 == 1):
+                return None
+            try:
+                return binascii.unhexlify(data)
+            except binascii.Error:
+                return None
+    else:
+        return Fallback
+
+    if(Fixed):
+        def Convert(iso, p):
+            end = p + Size
+            Converted = Data(iso[p:end], MaxLength) if end <= len(iso) else None
+            if(Converted == None):
+                return Fallback(iso, p)
+            return Converted, end
+        return Convert
+
+    Prefix = _Prefix(LenType, LenDataType)
+    ToPrefix = _Prefix(ToLenType, ToLenDataType)
+    if(Prefix == None or ToPrefix == None):
+        return Fallback
+    ReadLength = Prefix[1]
+    WriteLength = ToPrefix[2]
+    # the target length counts hex digits of binary data given as text and bytes of binary data
+    Scale = 2 if _Hex(DataType, ContentType) and _Text(ToDataType, ToContentType) else 1
+    Halve = _Text(DataType, ContentType) and _Hex(ToDataType, ToContentType)
+
+    def Convert(iso, p):
+        start, end = Source.Span(iso, p)
+        Len = ReadLength(iso, p) if DataType == DT.BCD else end - start
+        data = iso[start:end]
+        if(Data != None and Len > 0):
+            data = Data(data, Len)
+            if(data == None):
+                return Fallback(iso, p)
+        Len = Len // 2 if Halve else Len * Scale
+        if(Len > ToMaxLength):
+            raise BuildError("Cannot Build F{0}: Field Length larger than specification".format(field))
+        return WriteLength(Len) + data, end
+
+    return Convert
+
+
+class IsoTranslator(object):
+
+    def __init__(self, Source, Target, Rules = None):
+        self.Source = Source
+        self.Target = Target
+        self.Rules = dict(Rules or {})
+
+        SourceCodec = Source.Compile()
+        TargetCodec = Target.Compile()
+        self.__ParseMTI = SourceCodec.ParseMTI
+        self.__BuildMTI = TargetCodec.BuildMTI
+        self.__SourceBitmap = SourceCodec.BitmapType
+        self.__TargetBitmap = TargetCodec.BitmapType
+        self.__MTIRule = self.Rules.get('MTI')
+        self.__Converters = [None, None] + [_Converter(field, Source, Target, self.Rules.get(field))
+                                            for field in range(2, 129)]
+
+    def Translate(self, IsoMsg):
+        # Returns the message of the source spec IsoMsg in the target spec
+        if( isinstance(IsoMsg, bytes) == False ):
+            raise TypeError("Expected bytes for iso message")
+
+        MTI, p = self.__ParseMTI(IsoMsg, 0)
+        CheckMTI(MTI)
+        if(self.__MTIRule != None):
+            MTI = self.__MTIRule(MTI)
+
+        Bitmap = IsoBitmap()
+        p = Bitmap.Unpack(IsoMsg, p, self.__SourceBitmap)
+
+        Converters = self.__Converters
+        Fields = []
+        for field in Bitmap.Fields():
+            try:
+                data, p = Converters[field](IsoMsg, p)
+            except Exception as ex:
+                raise type(ex)('Error translating F{}: '.format(field) + repr(ex)) from None
+            if(data == None):
+                Bitmap.Clear(field)
+            else:
+                Fields.append(data)
+
+        # the secondary bitmap is only there if it's needed
+        Bitmap.Clear(1)
+        return self.__BuildMTI(MTI) + Bitmap.Pack(self.__TargetBitmap) + b''.join(Fields)
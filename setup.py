@@ -32,4 +32,5 @@ setup(name='py8583',
       license='LGPLv2',
       packages=['py8583'],
       install_requires=['enum34'] if sys.version_info < (3,4) else [],
+      extras_require={'numpy': ['numpy']},
       zip_safe=True)
\ No newline at end of file
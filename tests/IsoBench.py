@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+# Parse/build throughput of the shipped specs over a few typical messages.
+#
+#   python tests/IsoBench.py            run and compare against the stored baseline
+#   python tests/IsoBench.py --save     store the results as the new baseline
+#   python tests/IsoBench.py --check    exit with an error if anything regressed
+#
+# msg/s of the spec/* benchmarks is spec instances per second, they have no us/field.
+# parsemany/* parse a batch of Batch messages, their results are per message.
+#
+# The baseline (IsoBench.json) is machine specific, save one on the machine you compare on.
+
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from py8583 import py8583, py8583spec, py8583gen
+from py8583.py8583 import DT, LT
+
+
+Specs = {
+    'IsoSpec1987ASCII': py8583spec.IsoSpec1987ASCII,
+    'IsoSpec1987BCD':   py8583spec.IsoSpec1987BCD,
+    'BICISO':           py8583spec.BICISO,
+    'IsoSpec1993ASCII': py8583spec.IsoSpec1993ASCII,
+}
+
+# message type, fields and the size used for variable length fields
+Corpora = {
+    'network0800': ("0800", (7, 11, 12, 13, 41), 8),
+    'auth0200':    ("0200", (2, 3, 4, 11, 12, 13, 14, 22, 25, 35, 37, 41, 42, 49, 52, 55), 40),
+    'private0200': ("0200", (3, 4, 11, 41, 48, 60, 61, 62, 63), 400),
+    'secondary':   ("0800", (3, 4, 7, 11, 41, 70, 90, 95, 100, 102, 103, 128), 8),
+}
+
+Track2 = "4761739001010010=22122011143804400000"
+
+# messages per ParseMany batch and the fields decoded by parsemany/subset
+Batch = 100
+Subset = {3, 4, 11, 41}
+
+
+def FieldValue(IsoSpec, field, Size):
+    ContentType = IsoSpec.ContentType(field)
+    MaxLength = IsoSpec.MaxLength(field)
+
+    if(IsoSpec.LengthType(field) != LT.FIXED):
+        MaxLength = min(MaxLength, Size)
+
+    if(ContentType == 'n'):
+        return int(("1234567890" * 100)[:MaxLength])
+    elif(ContentType == 'z'):
+        return Track2[:MaxLength]
+    elif(ContentType == 'b'):
+        if(IsoSpec.DataType(field) == DT.ASCII and IsoSpec.LengthType(field) != LT.FIXED):
+            MaxLength //= 2
+        return ("0123456789ABCDEF" * 200)[:MaxLength * 2]
+    else:
+        return ("ABCDEFGHIJ KLMNOPQRS" * 100)[:MaxLength]
+
+
+def Message(IsoSpec, Corpus):
+    MTI, Fields, Size = Corpora[Corpus]
+
+    IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+    IsoPacket.MTI(MTI)
+    for field in Fields:
+        IsoPacket.Field(field, 1)
+        IsoPacket.FieldData(field, FieldValue(IsoSpec, field, Size))
+
+    return IsoPacket
+
+
+def Rate(func, Duration = 0.1, Repeat = 5):
+    Timer = timeit.Timer(func)
+    Number, Elapsed = Timer.autorange()
+    Number = max(1, int(Number * Duration / max(Elapsed, 1e-9)))
+    return Number / min(Timer.repeat(Repeat, Number))
+
+
+def Allocation(func, Count = 200, Messages = 1):
+    # peak memory of a single call and memory kept per result, per message of the call
+    tracemalloc.start()
+    func()
+    Peak = tracemalloc.get_traced_memory()[1] // Messages
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    Kept = [func() for i in range(Count)]
+    Retained = tracemalloc.get_traced_memory()[0] // (Count * Messages)
+    tracemalloc.stop()
+    del Kept
+
+    return Peak, Retained
+
+
+def Run(Duration, Generated = False):
+    Results = {}
+    for SpecName, SpecClass in Specs.items():
+        if(Generated):
+            py8583gen.Install(SpecClass())
+
+        # spec construction, per field definition
+        def Cold(SpecClass = SpecClass):
+            # as in the first instance of the class
+            py8583spec._Tables.pop(SpecClass, None)
+            return SpecClass()
+        
+        Ops = {
+            'cold': Cold,
+            'construct': SpecClass,
+            'registry': lambda: py8583spec.GetSpec(SpecClass),
+        }
+        for Op, func in Ops.items():
+            Rps = Rate(func, Duration)
+            Peak, Retained = Allocation(func)
+            Results["{0}/spec/{1}".format(SpecName, Op)] = {
+                'bytes': 0,
+                'msgs_per_sec': round(Rps),
+                'us_per_field': None,
+                'peak_bytes': Peak,
+                'retained_bytes': Retained,
+            }
+        
+        IsoSpec = SpecClass()
+        for Corpus in Corpora:
+            IsoPacket = Message(IsoSpec, Corpus)
+            IsoMsg = IsoPacket.BuildIso()
+            Messages = [IsoMsg] * Batch
+            Fields = len(Corpora[Corpus][1])
+
+            def Build(IsoPacket = IsoPacket):
+                # every field encoded (after Fields() nothing is copied from the last build)
+                IsoPacket.Fields()
+                return IsoPacket.BuildIso()
+            def Rebuild(IsoPacket = IsoPacket):
+                # F11 changed since the last build, the other fields are copied
+                IsoPacket.FieldData(11, 1)
+                return IsoPacket.BuildIso()
+            
+            # the ParseMany cases compare the batch API with Iso8583(msg, spec)
+            Ops = {
+                'parse': (lambda: py8583.Iso8583(IsoMsg, IsoSpec), 1),
+                'parsemany': (lambda: list(py8583.Iso8583.ParseMany(Messages, IsoSpec)), Batch),
+                'parsemany/subset': (lambda: list(py8583.Iso8583.ParseMany(Messages, IsoSpec, Fields = Subset)), Batch),
+                'build': (Build, 1),
+                'rebuild': (Rebuild, 1),
+            }
+            for Op, (func, Count) in Ops.items():
+                Rps = Rate(func, Duration) * Count
+                Peak, Retained = Allocation(func, Messages = Count)
+                Results["{0}/{1}/{2}".format(SpecName, Corpus, Op)] = {
+                    'bytes': len(IsoMsg),
+                    'msgs_per_sec': round(Rps),
+                    'us_per_field': round(1e6 / Rps / Fields, 3),
+                    'peak_bytes': Peak,
+                    'retained_bytes': Retained,
+                }
+    return Results
+
+
+def Report(Results, Baseline, Tolerance):
+    Regressions = []
+    print("{0:<48} {1:>6} {2:>10} {3:>9} {4:>9} {5:>9} {6:>8}".format(
+          "benchmark", "bytes", "msg/s", "us/field", "peak B", "kept B", "vs base"))
+
+    for Name, Result in Results.items():
+        Change = ''
+        if(Name in Baseline):
+            Ratio = Result['msgs_per_sec'] / Baseline[Name]['msgs_per_sec']
+            Change = "{0:+.0%}".format(Ratio - 1)
+            if(Ratio < 1 - Tolerance):
+                Change += " !"
+                Regressions.append(Name)
+
+        PerField = Result['us_per_field']
+        print("{0:<48} {1:>6} {2:>10} {3:>9} {4:>9} {5:>9} {6:>8}".format(
+              Name, Result['bytes'], Result['msgs_per_sec'], "{0:.3f}".format(PerField) if PerField != None else '-',
+              Result['peak_bytes'], Result['retained_bytes'], Change))
+
+    return Regressions
+
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description = "py8583 parse/build benchmarks")
+    Parser.add_argument('--baseline', default = os.path.join(os.path.dirname(__file__), 'IsoBench.json'))
+    Parser.add_argument('--save', action = 'store_true', help = "store the results as the baseline")
+    Parser.add_argument('--check', action = 'store_true', help = "exit with 1 on regressions")
+    Parser.add_argument('--tolerance', type = float, default = 0.25, help = "allowed slowdown (default 0.25)")
+    Parser.add_argument('--duration', type = float, default = 0.1, help = "seconds per measurement")
+    Parser.add_argument('--generated', action = 'store_true', help = "use generated parse/build code (py8583gen)")
+    args = Parser.parse_args()
+
+    Baseline = {}
+    if(os.path.exists(args.baseline)):
+        with open(args.baseline) as f:
+            Baseline = json.load(f)
+
+    Results = Run(args.duration, args.generated)
+    Regressions = Report(Results, Baseline, args.tolerance)
+
+    if(args.save):
+        with open(args.baseline, 'w') as f:
+            json.dump(Results, f, indent = 1, sort_keys = True)
+
+    if(Regressions):
+        print("\n{0} regression(s) over {1:.0%}: {2}".format(len(Regressions), args.tolerance, ", ".join(Regressions)))
+        if(args.check):
+            sys.exit(1)
@@ -2,13 +2,12 @@
 
 import socket
 import sys
-import struct
-import os
 
-from py8583 import Iso8583, MemDump, Str2Bcd
+from py8583 import Iso8583, IsoPool, MemDump
+from py8583net import IsoFramer, LH
 
     
-from py8583spec import IsoSpec1987BCD
+from py8583spec import IsoSpec1987BCD, GetSpec
 
 
 
@@ -26,42 +25,37 @@ except socket.error as msg:
 
 s.listen(10)
 
+# messages are recycled across requests and connections
+Pool = IsoPool(GetSpec(IsoSpec1987BCD))
+
 
 while True:
     try:
         print ('Waiting for connections')
         conn, addr = s.accept()
         print ('Connected: ' + addr[0] + ':' + str(addr[1]))
-        data = conn.recv(4096)
-        MemDump("Received:", data)
-        
-        Len = struct.unpack_from("!H", data[:2])[0]
-        
-        if(Len != len(data) - 2):
-            print("Invalid length {0} - {1}".format(Len, len(data) - 2))
-            conn.close()
-            continue
-        
-        IsoPacket = Iso8583(data[2:], IsoSpec1987BCD())
-        
-        IsoPacket.PrintMessage()
         
-        IsoPacket.MTI("0210")
+        Framer = IsoFramer(GetSpec(IsoSpec1987BCD), LH.BIN2, Pool = Pool)
         
-        IsoPacket.Field(39, 1)
-        IsoPacket.FieldData(39, "00")
-        IsoPacket.Field(2, 0)
-        IsoPacket.Field(35, 0)
-        IsoPacket.Field(52, 0)
-        IsoPacket.Field(60, 0)
-         
-        print("\n\n\n")
-        IsoPacket.PrintMessage()
-        data = IsoPacket.BuildIso()
-        data = struct.pack("!H", len(data)) + data
-         
-        MemDump("Sending:", data)
-        conn.send(data)
+        while True:
+            data = conn.recv(4096)
+            if(len(data) == 0):
+                break
+            MemDump("Received:", data)
+            
+            for IsoPacket in Framer.Feed(data):
+                IsoPacket.PrintMessage()
+                
+                # 0210 echoing the request's fields as received, without F2, F35, F52 and F60
+                Response = IsoPacket.MakeResponse({39: "00"}, Drop = (2, 35, 52, 60))
+                 
+                print("\n\n\n")
+                Iso8583(Response, GetSpec(IsoSpec1987BCD)).PrintMessage()
+                data = Framer.Frame(Response)
+                 
+                MemDump("Sending:", data)
+                conn.sendall(data)
+                Pool.Put(IsoPacket)
         
         
     except Exception as ex:
@@ -70,4 +64,4 @@ while True:
     conn.close()
     
 s.close()
-sys.exit()
\ No newline at end of file
+sys.exit()
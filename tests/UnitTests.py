@@ -2,7 +2,17 @@ import os
 import time
 import sys
 import binascii
+import logging
 import unittest
+import asyncio
+import socket
+import tempfile
+import json
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 sys.path.insert(0, os.path.abspath('..'))
 
@@ -94,6 +104,1153 @@ class BCDParse1987(unittest.TestCase):
     
     def test_Bitmap(self):
         pass
+
+    def test_Track2(self):
+        IsoPacket = py8583.Iso8583(IsoSpec = py8583spec.IsoSpec1987BCD())
+        IsoPacket.MTI("0200")
+        IsoPacket.Field(35, 1)
+        IsoPacket.FieldData(35, "4761739001010010=22122011143804400000")
+        
+        data = IsoPacket.BuildIso()
+        self.assertEqual(data[10:], binascii.unhexlify("374761739001010010D22122011143804400000F"))
+        
+        self.IsoPacket.SetIsoContent(data)
+        self.assertEqual(self.IsoPacket.FieldData(35), "4761739001010010=22122011143804400000")
+
+    def test_Lazy(self):
+        IsoPacket = py8583.Iso8583(IsoSpec = py8583spec.IsoSpec1987BCD())
+        IsoPacket.MTI("0200")
+        for field, value in ((3, 1000), (4, 1234), (11, 42), (41, "TERM0001"), (55, "9F0206000000001234")):
+            IsoPacket.Field(field, 1)
+            IsoPacket.FieldData(field, value)
+        data = IsoPacket.BuildIso()
+        
+        LazyPacket = py8583.Iso8583(data, py8583spec.IsoSpec1987BCD(), Lazy = True)
+        self.assertEqual(LazyPacket.FieldData(41), "TERM0001")
+        self.assertEqual(LazyPacket.FieldData(4), 1234)
+        self.assertEqual(LazyPacket.Fields()[55], "9F0206000000001234")
+        self.assertEqual(LazyPacket.BuildIso(), data)
+        
+        # field data errors are only raised when the field is accessed
+        LazyPacket.SetIsoContent(data[:13] + b'\xAA' * 6 + data[19:])
+        self.assertEqual(LazyPacket.FieldData(11), 42)
+        with self.assertRaisesRegex(py8583.ParseError, "Cannot parse F4"):
+            LazyPacket.FieldData(4)
+
+    def test_BuildInto(self):
+        IsoPacket = py8583.Iso8583(IsoSpec = py8583spec.IsoSpec1987BCD())
+        IsoPacket.MTI("0800")
+        IsoPacket.Field(11, 1)
+        IsoPacket.FieldData(11, 123456)
+        IsoPacket.Field(70, 1)
+        IsoPacket.FieldData(70, 301)
+        data = IsoPacket.BuildIso()
+        
+        buf = bytearray(b"\xFF" * 40)
+        end = IsoPacket.BuildIsoInto(buf, 2)
+        self.assertEqual(end, len(data) + 2)
+        self.assertEqual(bytes(buf), b"\xFF\xFF" + data)
+        self.assertEqual(IsoPacket.BuildIso(), data)
+        
+        with self.assertRaises(TypeError):
+            IsoPacket.BuildIsoInto(b"")
+
+    def test_ParseMany(self):
+        IsoSpec = py8583spec.IsoSpec1987BCD()
+        IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+        IsoPacket.MTI("0200")
+        Messages = []
+        for stan in range(1, 4):
+            for field, value in ((4, stan * 100), (11, stan), (41, "TERM0001")):
+                IsoPacket.Field(field, 1)
+                IsoPacket.FieldData(field, value)
+            Messages.append(IsoPacket.BuildIso())
+            
+        Records = list(py8583.Iso8583.ParseMany(Messages, IsoSpec, Fields = {11, 41}))
+        self.assertEqual([Record.FieldData(11) for Record in Records], [1, 2, 3])
+        self.assertEqual(Records[2].MTI(), "0200")
+        self.assertEqual(Records[2].Field(4), 1)
+        self.assertEqual(Records[2].FieldData(4), None)
+        self.assertEqual(dict(Records[0].Fields()), {11: 1, 41: "TERM0001"})
+        
+        with self.assertRaises(TypeError):
+            Records[0].Fields()[11] = 5
+        
+        Parser = IsoSpec.Parser(Strict = True)
+        self.assertEqual(Parser(Messages[1]).Fields(), py8583.Iso8583(Messages[1], IsoSpec).Fields())
+        with self.assertRaisesRegex(py8583.ParseError, "Invalid MTI"):
+            Parser(binascii.unhexlify("0106"))
+
+    @unittest.skipIf(numpy == None, "numpy is not installed")
+    def test_Columns(self):
+        IsoSpec = py8583spec.IsoSpec1987BCD()
+        IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+        IsoPacket.MTI("0200")
+        Messages = []
+        for stan in range(1, 4):
+            for field, value in ((4, stan * 100), (11, stan), (41, "TERM000" + str(stan))):
+                IsoPacket.Field(field, 1)
+                IsoPacket.FieldData(field, value)
+            IsoPacket.Field(2, stan == 2)
+            IsoPacket.FieldData(2, 4761739001010010)
+            Messages.append(IsoPacket.BuildIso())
+        
+        Columns = py8583columns.ParseColumns(Messages, IsoSpec, (2, 4, 11, 41))
+        self.assertEqual(list(Columns.MTI), ["0200"] * 3)
+        self.assertEqual(Columns.Columns[4].tolist(), [100, 200, 300])
+        self.assertEqual(Columns.Columns[11].dtype, numpy.int64)
+        self.assertEqual(Columns.Columns[41].tolist(), [b"TERM0001", b"TERM0002", b"TERM0003"])
+        self.assertEqual(Columns.Columns[2].tolist(), ["", "4761739001010010", ""])
+        self.assertEqual(Columns.Mask[:, 2].tolist(), [False, True, False])
+        self.assertTrue(Columns.Mask[:, 41].all())
+        
+        # F41 (the last field) is cut short
+        with self.assertRaisesRegex(py8583.ParseError, "Cannot parse F41"):
+            py8583columns.ParseColumns([Messages[0], Messages[1][:-3], Messages[2]], IsoSpec, (11, 41))
+
+
+class Bitmap(unittest.TestCase):
+    
+    def test_Fields(self):
+        Bitmap = py8583.IsoBitmap()
+        for field in (64, 2, 11, 3):
+            Bitmap.Set(field)
+        
+        self.assertEqual(list(Bitmap.Fields()), [2, 3, 11, 64])
+        self.assertEqual(Bitmap.Count(), 4)
+        self.assertTrue(Bitmap.Test(11))
+        self.assertEqual(Bitmap[12], 0)
+        
+        Bitmap.Clear(11)
+        self.assertFalse(Bitmap.Test(11))
+        self.assertFalse(Bitmap.Secondary())
+        
+        with self.assertRaises(ValueError):
+            Bitmap.Set(129)
+        
+    def test_Pack(self):
+        Bitmap = py8583.IsoBitmap()
+        Bitmap.Set(3)
+        self.assertEqual(Bitmap.Pack(), binascii.unhexlify("2000000000000000"))
+        
+        Bitmap.Set(128)
+        self.assertEqual(Bitmap.Pack(py8583.DT.ASCII), b"A0000000000000000000000000000001")
+        
+        Parsed = py8583.IsoBitmap()
+        self.assertEqual(Parsed.Unpack(b"0200" + Bitmap.Pack(), 4), 20)
+        self.assertEqual(list(Parsed.Fields()), [3, 128])
+        self.assertTrue(Parsed.Test(1))
+        
+        with self.assertRaisesRegex(py8583.ParseError, "Invalid bitmap"):
+            Parsed.Unpack(b"A000000000", 0, py8583.DT.ASCII)
+        # int() would take these
+        for Bad in (b"0x00000000000000", b"+200000000000000", b"2000_00000000000", b" 200000000000000"):
+            with self.assertRaisesRegex(py8583.ParseError, "Invalid bitmap"):
+                Parsed.Unpack(Bad, 0, py8583.DT.ASCII)
+    
+    def test_Mapping(self):
+        # the bitmap of a message is a mapping of fields 1-64 (or 1-128) to 0/1, as the
+        # dict older versions returned
+        IsoPacket = py8583.Iso8583(b"0200" b"3000000000000000" b"000000" b"000000001500", py8583spec.IsoSpec1987ASCII())
+        Bitmap = IsoPacket.Bitmap()
+        self.assertEqual(len(Bitmap), 64)
+        self.assertEqual(list(Bitmap.keys()), list(range(1, 65)))
+        self.assertEqual([field for field, Value in Bitmap.items() if Value], [3, 4])
+        self.assertEqual(sum(Bitmap.values()), 2)
+        self.assertEqual(Bitmap.get(4), 1)
+        self.assertEqual(Bitmap.get(70), None)
+        self.assertEqual(dict(Bitmap)[2], 0)
+        self.assertEqual(IsoPacket.Field(70), 0)
+        
+        Bitmap[70] = 1
+        self.assertEqual(len(Bitmap), 128)
+        self.assertEqual(Bitmap[70], 1)
+        self.assertEqual(Bitmap, dict(Bitmap))
+
+
+class Framer(unittest.TestCase):
+    
+    def setUp(self):
+        self.IsoSpec = py8583spec.IsoSpec1987BCD()
+        self.IsoPacket = py8583.Iso8583(IsoSpec = self.IsoSpec)
+        self.IsoPacket.MTI("0800")
+        self.IsoPacket.Field(11, 1)
+        self.IsoPacket.FieldData(11, 1)
+        self.IsoPacket.Field(70, 1)
+        self.IsoPacket.FieldData(70, 301)
+    
+    def test_Split(self):
+        for Header in py8583net.LH:
+            for TPDU in (b"", b"\x60\x00\x01\x00\x00"):
+                Framer = py8583net.IsoFramer(self.IsoSpec, Header, len(TPDU))
+                stream = Framer.FrameIso(self.IsoPacket, TPDU) * 3
                 
+                Messages = []
+                for i in range(0, len(stream), 7):
+                    Messages += Framer.Feed(stream[i:i+7])
+                
+                self.assertEqual(len(Messages), 3)
+                self.assertEqual(Messages[2].FieldData(70), 301)
+                self.assertEqual(Framer.Pending(), 0)
+                
+                Frames = Framer.Frames(stream[:-1])
+                self.assertEqual(Frames[0], (TPDU, self.IsoPacket.BuildIso()))
+                self.assertEqual(len(Frames), 2)
+                self.assertEqual(len(Framer.Frames(stream[-1:])), 1)
+    
+    def test_Header(self):
+        Framer = py8583net.IsoFramer(self.IsoSpec, py8583net.LH.ASCII4)
+        data = Framer.Frame(self.IsoPacket.BuildIso())
+        self.assertEqual(data[:4], "{0:04d}".format(len(data) - 4).encode('latin'))
+        
+        with self.assertRaisesRegex(py8583.ParseError, "Invalid frame length"):
+            Framer.Feed(b"00A1")
+
+
+class AsyncHost(unittest.TestCase):
+    
+    def test_Requests(self):
+        IsoSpec = py8583spec.IsoSpec1987BCD()
+        
+        async def Handler(IsoPacket):
+            # answer in reverse order of arrival
+            await asyncio.sleep(0.01 * (10 - IsoPacket.FieldData(11)))
+            IsoPacket.MTI("0210")
+            IsoPacket.Field(39, 1)
+            IsoPacket.FieldData(39, "00")
+            return IsoPacket
+        
+        async def Request(Client, stan):
+            IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+            IsoPacket.MTI("0200")
+            IsoPacket.Field(11, 1)
+            IsoPacket.FieldData(11, stan)
+            IsoPacket.Field(41, 1)
+            IsoPacket.FieldData(41, "TERM0001")
+            return await Client.Request(IsoPacket, 5)
+        
+        async def Run():
+            Server = await py8583net.StartServer(Handler, IsoSpec, '127.0.0.1', 0, TPDU = 5)
+            port = Server.sockets[0].getsockname()[1]
+            
+            Client = py8583net.IsoClient(IsoSpec, TPDU = b"\x60\x00\x01\x00\x02")
+            await Client.Connect('127.0.0.1', port)
+            Responses = await asyncio.gather(*[Request(Client, stan) for stan in range(1, 10)])
+            Pending = Client.Pending()
+            
+            await Client.Close()
+            Server.close()
+            await Server.wait_closed()
+            return Responses, Pending
+        
+        Responses, Pending = asyncio.run(Run())
+        self.assertEqual([Response.FieldData(11) for Response in Responses], list(range(1, 10)))
+        self.assertEqual(Responses[0].MTI(), "0210")
+        self.assertEqual(Pending, 0)
+
+
+@unittest.skipIf(hasattr(os, 'fork') == False, "fork is not available")
+class WorkerPool(unittest.TestCase):
+    
+    def test_Workers(self):
+        IsoSpec = py8583spec.IsoSpec1987BCD()
+        
+        async def Handler(IsoPacket):
+            IsoPacket.MTI("0810")
+            IsoPacket.Field(39, 1)
+            IsoPacket.FieldData(39, "{0:02d}".format(os.getpid() % 100))
+            return IsoPacket
+        
+        async def Run(port):
+            Responses = []
+            for stan in range(1, 9):
+                Client = py8583net.IsoClient(IsoSpec)
+                await Client.Connect('127.0.0.1', port)
+                IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+                IsoPacket.MTI("0800")
+                IsoPacket.Field(11, 1)
+                IsoPacket.FieldData(11, stan)
+                Responses.append(await Client.Request(IsoPacket, 5))
+                await Client.Close()
+            return Responses
+        
+        for ReusePort in set((False, hasattr(socket, 'SO_REUSEPORT'))):
+            Pool = py8583server.IsoWorkerPool(Handler, IsoSpec, '127.0.0.1', 0, Workers = 2, ReusePort = ReusePort)
+            Pool.Start()
+            try:
+                Responses = asyncio.run(Run(Pool.port))
+            finally:
+                Pool.Stop()
+            
+            self.assertEqual([Response.FieldData(11) for Response in Responses], list(range(1, 9)))
+            self.assertEqual(Responses[0].MTI(), "0810")
+
+
+class Correlation(unittest.TestCase):
+    
+    def test_Key(self):
+        IsoSpec = py8583spec.IsoSpec1987BCD()
+        IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+        IsoPacket.MTI("0200")
+        for field, value in ((4, 100), (11, 123), (41, "TERM0001"), (55, "9F02")):
+            IsoPacket.Field(field, 1)
+            IsoPacket.FieldData(field, value)
+        Request = IsoPacket.BuildIso()
+        
+        IsoPacket.MTI("0210")
+        IsoPacket.Field(39, 1)
+        IsoPacket.FieldData(39, "00")
+        Response = IsoPacket.BuildIso()
+        
+        Key = py8583net.IsoKey(IsoSpec, (41, 11))
+        self.assertEqual(Key(Request), ("020", b"\x00\x01\x23", b"TERM0001"))
+        self.assertEqual(Key(Request), Key(Response))
+        self.assertEqual(py8583net.IsoKey(IsoSpec, (11, 37))(Request), ("020", b"\x00\x01\x23", None))
+    
+    def test_Expire(self):
+        import concurrent.futures
+        Now = [100.0]
+        Correlator = py8583net.IsoCorrelator(Timeout = 1.0, Clock = lambda: Now[0])
+        
+        First = Correlator.Add("A", concurrent.futures.Future())
+        Second = Correlator.Add("B", concurrent.futures.Future(), 0.5)
+        with self.assertRaises(ValueError):
+            Correlator.Add("A", concurrent.futures.Future())
+        with self.assertRaises(ValueError):
+            Correlator.Add("C", concurrent.futures.Future(), 10)
+        
+        Now[0] = 100.6
+        self.assertEqual(Correlator.Expire(), ["B"])
+        self.assertIsInstance(Second.exception(), asyncio.TimeoutError)
+        
+        self.assertTrue(Correlator.Match("A", "response"))
+        self.assertFalse(Correlator.Match("A", "response"))
+        self.assertEqual(First.result(), "response")
+        self.assertEqual(len(Correlator), 0)
+        
+        Now[0] = 102.0
+        self.assertEqual(Correlator.Expire(), [])
+
+    def test_LateExpire(self):
+        import concurrent.futures
+        Now = [100.0]
+        Correlator = py8583net.IsoCorrelator(Timeout = 1.0, Clock = lambda: Now[0])
+        First = Correlator.Add("A", concurrent.futures.Future())
+        
+        # Expire() hasn't run for half the timeout
+        Now[0] = 100.5
+        Second = Correlator.Add("B", concurrent.futures.Future())
+        
+        Now[0] = 101.1
+        self.assertEqual(Correlator.Expire(), ["A"])
+        self.assertIsInstance(First.exception(), asyncio.TimeoutError)
+        self.assertFalse(Second.done())
+        
+        # requests which came due meanwhile are expired by Add()
+        Now[0] = 102.0
+        Correlator.Add("C", concurrent.futures.Future())
+        self.assertIsInstance(Second.exception(), asyncio.TimeoutError)
+        self.assertEqual(len(Correlator), 1)
+    
+    def test_RemoveReused(self):
+        import concurrent.futures
+        Now = [100.0]
+        Correlator = py8583net.IsoCorrelator(Timeout = 1.0, Clock = lambda: Now[0])
+        First = Correlator.Add("A", concurrent.futures.Future())
+        Now[0] = 101.1
+        self.assertEqual(Correlator.Expire(), ["A"])
+        
+        # the key is reused before the expired request cleans up after itself
+        Second = Correlator.Add("A", concurrent.futures.Future())
+        self.assertIsNone(Correlator.Remove("A", First))
+        self.assertIn("A", Correlator)
+        self.assertIs(Correlator.Remove("A", Second), Second)
+        self.assertNotIn("A", Correlator)
+
+
+class CompiledSpec(unittest.TestCase):
+    
+    def test_Cache(self):
+        IsoSpec = py8583spec.IsoSpec1987ASCII()
+        
+        Compiled = IsoSpec.Compile()
+        self.assertIs(IsoSpec.Compile(), Compiled)
+        self.assertEqual(Compiled.Fields[11].MaxLength, 6)
+        
+        # modifying the spec invalidates the compiled codec
+        IsoSpec.MaxLength(11, 8)
+        self.assertIsNot(IsoSpec.Compile(), Compiled)
+        self.assertEqual(IsoSpec.Compile().Fields[11].MaxLength, 8)
+        IsoSpec.MaxLength(11, 6)
+        
+    def test_Incomplete(self):
+        IsoSpec = py8583spec.IsoSpec()
+        IsoSpec.DataType('MTI', py8583.DT.ASCII)
+        IsoSpec.DataType(1, py8583.DT.ASCII)
+        
+        IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+        with self.assertRaisesRegex(py8583.SpecError, "Incomplete field specification"):
+            IsoPacket.SetIsoContent(b"02002000000000000000123456")
+
+class Specs(unittest.TestCase):
+    
+    def test_Isolation(self):
+        # spec variants used to modify the same module level tables
+        BCD = py8583spec.IsoSpec1987BCD()
+        BIC = py8583spec.BICISO()
+        ASCII = py8583spec.IsoSpec1987ASCII()
+        
+        self.assertEqual(BCD.ContentType(61), 'b')
+        self.assertEqual(ASCII.ContentType(61), 'ans')
+        self.assertEqual(BIC.ContentType(61), 'ans')
+        self.assertEqual(BIC.MaxLength(41), 16)
+        self.assertEqual(ASCII.MaxLength(41), 8)
+        
+        # modifying an instance only affects that instance
+        ASCII.MaxLength(41, 12)
+        ASCII.Description(41, 'Terminal')
+        self.assertEqual(ASCII.MaxLength(41), 12)
+        self.assertEqual(py8583spec.IsoSpec1987ASCII().MaxLength(41), 8)
+        self.assertEqual(py8583spec.IsoSpec1987ASCII().Description(41), 'Card acceptor terminal identification')
+        self.assertEqual(py8583spec.IsoSpec1987ASCII().DataType(41), py8583.DT.ASCII)
+        
+        # the tables themselves are read-only
+        with self.assertRaises(TypeError):
+            py8583spec.IsoSpec1987ASCII().ContentTypes[41]['MaxLen'] = 16
+    
+    def test_Freeze(self):
+        IsoSpec = py8583spec.IsoSpec1987ASCII()
+        self.assertEqual(IsoSpec, py8583spec.IsoSpec1987ASCII())
+        # modifiable specs are keyed by identity, frozen ones by their definitions
+        Specs = {IsoSpec: 1}
+        IsoSpec.MaxLength(41, 16)
+        self.assertEqual(Specs[IsoSpec], 1)
+        self.assertNotIn(py8583spec.IsoSpec1987ASCII(), Specs)
+        IsoSpec.MaxLength(41, 8)
+        self.assertEqual(hash(IsoSpec.Copy().Freeze()), hash(py8583spec.GetSpec(py8583spec.IsoSpec1987ASCII)))
+        self.assertNotEqual(IsoSpec, py8583spec.BICISO())
+        self.assertIs(IsoSpec.Compile(), py8583spec.IsoSpec1987ASCII().Compile())
+        
+        IsoSpec.MaxLength(11, 8)
+        self.assertNotEqual(IsoSpec, py8583spec.IsoSpec1987ASCII())
+        IsoSpec.MaxLength(11, 6)
+        self.assertEqual(IsoSpec, py8583spec.IsoSpec1987ASCII())
+        
+        IsoSpec.MaxLength(11, 8)
+        IsoSpec.Freeze()
+        self.assertTrue(IsoSpec.Frozen())
+        with self.assertRaisesRegex(py8583.SpecError, "frozen"):
+            IsoSpec.MaxLength(11, 6)
+        self.assertEqual(IsoSpec.MaxLength(11), 8)
+        self.assertEqual({IsoSpec: 1}[IsoSpec], 1)
+
+    def test_Arguments(self):
+        # tables of classes which don't opt in are built per instance
+        class Terminal(py8583spec.IsoSpec1987ASCII):
+            def __init__(self, Size):
+                self.Size = Size
+                py8583spec.IsoSpec1987ASCII.__init__(self)
+            def SetContentTypes(self):
+                py8583spec.IsoSpec1987ASCII.SetContentTypes(self)
+                self.ContentTypes[41]['MaxLen'] = self.Size
+        
+        self.assertEqual(Terminal(8).MaxLength(41), 8)
+        self.assertEqual(Terminal(16).MaxLength(41), 16)
+        self.assertNotEqual(Terminal(8), Terminal(16))
+        self.assertIs(Terminal(16).Compile(), py8583spec.GetSpec(py8583spec.IsoSpec1987ASCII, {41: {'MaxLen': 16}}).Compile())
+
+    def test_Binary(self):
+        # binary fields of ASCII specs are carried in hex, twice MaxLength characters
+        IsoSpec = py8583spec.IsoSpec1987ASCII()
+        IsoSpec.Define(62, 'b', 10, py8583.LT.LLVAR, py8583.DT.ASCII, py8583.DT.ASCII)
+        
+        IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+        IsoPacket.MTI("0800")
+        for field, Value in ((52, "0123456789ABCDEF"), (62, "00112233445566778899")):
+            IsoPacket.Field(field, 1)
+            IsoPacket.FieldData(field, Value)
+            with self.assertRaisesRegex(ValueError, "larger than field maximum"):
+                IsoPacket.FieldData(field, Value + "A")
+        
+        IsoMsg = IsoPacket.BuildIso()
+        self.assertEqual(IsoMsg[20:], b"0123456789ABCDEF" b"20" b"00112233445566778899")
+        self.assertEqual(py8583.Iso8583(IsoMsg, IsoSpec).Fields(), {52: "0123456789ABCDEF", 62: "00112233445566778899"})
+        
+        # the encoders check the same limits
+        Fields = IsoSpec.Compile().Fields
+        with self.assertRaisesRegex(py8583.BuildError, "larger than specification"):
+            Fields[62].Encode("00112233445566778899AA")
+        self.assertEqual(len(Fields[52].Encode("0123456789ABCDEF")), 16)
+        
+        # and the parser
+        with self.assertRaisesRegex(py8583.ParseError, "larger than maximum length"):
+            py8583.Iso8583(IsoMsg[:36] + b"21" + b"0" * 21, IsoSpec)
+        
+        # the same hex values go in binary (BIN) fields, which hold MaxLength bytes
+        IsoSpec = py8583spec.IsoSpec1987BCD()
+        IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+        IsoPacket.MTI("0800")
+        IsoPacket.Field(52, 1)
+        IsoPacket.FieldData(52, "0123456789ABCDEF")
+        with self.assertRaisesRegex(ValueError, "larger than field maximum"):
+            IsoPacket.FieldData(52, "0123456789ABCDEF0")
+        self.assertEqual(IsoPacket.BuildIso()[-8:], b"\x01\x23\x45\x67\x89\xAB\xCD\xEF")
+
+    def test_Registry(self):
+        IsoSpec = py8583spec.GetSpec(py8583spec.IsoSpec1987BCD)
+        self.assertIs(py8583spec.GetSpec('IsoSpec1987BCD'), IsoSpec)
+        self.assertTrue(IsoSpec.Frozen())
+        with self.assertRaises(py8583.SpecError):
+            IsoSpec.MaxLength(41, 16)
+        
+        BIC = py8583spec.GetSpec(py8583spec.IsoSpec1987ASCII, {41: {'MaxLen': 16}, 44: {'MaxLen': 27}})
+        self.assertIs(py8583spec.GetSpec(py8583spec.IsoSpec1987ASCII, {44: {'MaxLen': 27}, 41: {'MaxLen': 16}}), BIC)
+        self.assertEqual(BIC.MaxLength(41), 16)
+        self.assertIs(BIC.Compile(), py8583spec.BICISO().Compile())
+        self.assertEqual(py8583spec.GetSpec(py8583spec.IsoSpec1987ASCII).MaxLength(41), 8)
+        
+        with self.assertRaisesRegex(py8583.SpecError, "Unknown attribute"):
+            py8583spec.GetSpec(py8583spec.IsoSpec1987ASCII, {41: {'Size': 16}})
+        with self.assertRaisesRegex(py8583.SpecError, "Unknown spec"):
+            py8583spec.GetSpec('IsoSpec2003')
+
+
+
+class SpecFile(unittest.TestCase):
+    
+    Definition = b"""{
+        "Name": "MyNetwork",
+        "Base": "IsoSpec1987BCD",
+        "Fields": {
+            "41": {"MaxLen": 16},
+            "62": {"ContentType": "ans", "Data": "ASCII", "Description": "Private data"}
+        }
+    }"""
+    
+    def Write(self, Name, data):
+        path = os.path.join(self.Dir.name, Name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+    
+    def setUp(self):
+        self.Dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        self.Dir.cleanup()
+    
+    def test_Load(self):
+        Cache = os.path.join(self.Dir.name, 'cache')
+        path = self.Write('network.json', self.Definition)
+        
+        IsoSpec = py8583specfile.LoadSpec(path, Cache)
+        self.assertEqual(IsoSpec.Name(), 'MyNetwork')
+        self.assertEqual(IsoSpec.MaxLength(41), 16)
+        self.assertEqual(IsoSpec.ContentType(62), 'ans')
+        self.assertEqual(IsoSpec.DataType(62), py8583.DT.ASCII)
+        self.assertEqual(IsoSpec.ContentType(61), 'b')
+        self.assertTrue(IsoSpec.Frozen())
+        self.assertEqual(len(os.listdir(Cache)), 1)
+        
+        Cached = py8583specfile.LoadSpec(path, Cache)
+        self.assertEqual(Cached, IsoSpec)
+        self.assertEqual(Cached.Name(), 'MyNetwork')
+        self.assertEqual(Cached.Description(62), 'Private data')
+        self.assertIs(Cached.Compile(), IsoSpec.Compile())
+        self.assertEqual(Cached.Compile().Fields[41].MaxLength, 16)
+    
+    def test_BaseChanged(self):
+        Cache = os.path.join(self.Dir.name, 'cache')
+        path = self.Write('network.json', self.Definition)
+        py8583specfile.LoadSpec(path, Cache)
+        
+        # as if cached by a py8583 whose base spec had other fields
+        CachePath = os.path.join(Cache, os.listdir(Cache)[0])
+        with open(CachePath) as f:
+            Cached = json.load(f)
+        Cached['BaseKey'] = '0' * 64
+        Cached['ContentTypes']['41']['MaxLen'] = 8
+        with open(CachePath, 'w') as f:
+            json.dump(Cached, f)
+        
+        self.assertEqual(py8583specfile.LoadSpec(path, Cache).MaxLength(41), 16)
+    
+    def test_Toml(self):
+        try:
+            import tomllib
+        except ImportError:
+            self.skipTest("tomllib not available")
+        
+        path = self.Write('network.toml', b"""
+            MTI = "ASCII"
+            Bitmap = "ASCII"
+            
+            [Fields.3]
+            ContentType = "n"
+            MaxLen = 6
+            LenType = "FIXED"
+            Data = "ASCII"
+            
+            [Fields.35]
+            ContentType = "z"
+            MaxLen = 37
+            LenType = "LLVAR"
+            Data = "ASCII"
+            Length = "ASCII"
+        """)
+        IsoSpec = py8583specfile.LoadSpec(path)
+        
+        IsoPacket = py8583.Iso8583(b"0800" b"2000000000000000" b"001234", IsoSpec)
+        self.assertEqual(IsoPacket.FieldData(3), 1234)
+    
+    def test_Invalid(self):
+        Errors = (
+            (b'{"Fields": {"41": {"Size": 16}}}',                        "Unknown attribute 'Size' for F41"),
+            (b'{"Base": "IsoSpec1987ASCII", "Fields": {"129": {}}}',      "Invalid field '129'"),
+            (b'{"Base": "IsoSpec1987ASCII", "Fields": {"2": {"LenType": "VAR"}}}', "Invalid length type 'VAR' for F2"),
+            (b'{"Base": "IsoSpec1987ASCII", "Fields": {"2": {"MaxLen": 120}}}', "doesn't fit in LLVAR"),
+            (b'{"MTI": "ASCII", "Bitmap": "ASCII", "Fields": {"3": {"ContentType": "n", "MaxLen": 6}}}', "Missing LenType"),
+            (b'{"Fields": {}}',                                          "Missing data type of MTI"),
+            (b'{"Fields": ',                                             "Cannot load spec"),
+        )
+        for data, Error in Errors:
+            with self.assertRaisesRegex(py8583.SpecError, Error):
+                py8583specfile.LoadSpec(self.Write('network.json', data))
+
+
+class Generated(unittest.TestCase):
+    
+    def Message(self, IsoSpec):
+        IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+        IsoPacket.MTI("0200")
+        for field, Value in ((2, 4761739001010010), (3, 1234), (4, 1000), (11, 1), (35, "4761739001010010=22122011143804400000"),
+                             (41, "TERM0001"), (52, "0123456789ABCDEF"), (62, "0102ABCD"), (70, 301), (102, "ACCOUNT")):
+            IsoPacket.Field(field, 1)
+            IsoPacket.FieldData(field, Value)
+        return IsoPacket
+    
+    def test_Generate(self):
+        for IsoSpec in (py8583spec.IsoSpec1987ASCII(), py8583spec.IsoSpec1987BCD()):
+            Codec = py8583gen.Generate(IsoSpec)
+            IsoPacket = self.Message(IsoSpec)
+            
+            buf = bytearray()
+            Codec.BuildFields(buf, IsoPacket.Bitmap(), IsoPacket.Fields())
+            IsoMsg = IsoPacket.BuildIso()
+            self.assertTrue(IsoMsg.endswith(bytes(buf)))
+            
+            FieldData = {}
+            p = Codec.ParseFields(IsoMsg, len(IsoMsg) - len(buf), IsoPacket.Bitmap(), FieldData)
+            self.assertEqual(p, len(IsoMsg))
+            self.assertEqual(FieldData, py8583.Iso8583(IsoMsg, IsoSpec).Fields())
+            
+            with self.assertRaisesRegex(py8583.ParseError, "Cannot parse F"):
+                Codec.ParseFields(IsoMsg[:-len(buf)] + b"\xFF" * len(buf), len(IsoMsg) - len(buf), IsoPacket.Bitmap(), {})
+    
+    def test_Install(self):
+        # a spec of its own, so the generated code isn't used by the other tests
+        IsoSpec = py8583spec.IsoSpec1987BCD()
+        IsoSpec.MaxLength(62, 998)
+        
+        with tempfile.TemporaryDirectory() as Cache:
+            Codec = py8583gen.Install(IsoSpec, Cache)
+            self.assertIs(IsoSpec.Compile(), Codec)
+            self.assertEqual(len([Name for Name in os.listdir(Cache) if Name.endswith('.py')]), 1)
+            
+            IsoMsg = self.Message(IsoSpec).BuildIso()
+            self.assertEqual(IsoMsg, self.Message(py8583spec.IsoSpec1987BCD()).BuildIso())
+            self.assertEqual(py8583.Iso8583(IsoMsg, IsoSpec).FieldData(35), "4761739001010010=22122011143804400000")
+            
+            # equal specs use it too, the next process imports it from the cache
+            Equal = py8583spec.IsoSpec1987BCD()
+            Equal.MaxLength(62, 998)
+            self.assertIs(Equal.Compile(), Codec)
+            self.assertIsNot(py8583gen.Generate(IsoSpec, Cache).ParseFields, py8583codec.CompileSpec(IsoSpec).ParseFields)
+        
+        # the shared specs of GetSpec() are compiled already, they get it too
+        Shared = py8583spec.GetSpec(py8583spec.IsoSpec1987BCD, {62: {'MaxLen': 997}})
+        IsoSpec = py8583spec.IsoSpec1987BCD()
+        IsoSpec.MaxLength(62, 997)
+        Codec = py8583gen.Install(IsoSpec)
+        self.assertIs(Shared.Compile(), Codec)
+    
+    def test_Name(self):
+        # spec names (e.g. from spec files) are only ever quoted in the source
+        IsoSpec = py8583spec.IsoSpec1987ASCII()
+        IsoSpec._Name = "X\nraise SystemExit(3) #"
+        Source = py8583gen.GenerateSource(IsoSpec)
+        self.assertEqual(Source.splitlines()[0], "# Generated by py8583gen for 'X\\nraise SystemExit(3) #', do not edit")
+        py8583gen.Generate(IsoSpec)
+
+
+class Partial(unittest.TestCase):
+    
+    def test_Fields(self):
+        IsoSpec = py8583spec.IsoSpec1987ASCII()
+        IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+        IsoPacket.MTI("0200")
+        for field, Value in ((2, 4761739001010010), (3, 1234), (4, 1000), (22, 51), (35, "4761739001010010=2212"),
+                             (41, "TERM0001"), (48, "PRIVATE"), (102, "ACCOUNT")):
+            IsoPacket.Field(field, 1)
+            IsoPacket.FieldData(field, Value)
+        IsoMsg = IsoPacket.BuildIso()
+        
+        for Lazy in (False, True):
+            Partial = py8583.Iso8583(IsoMsg, IsoSpec, Lazy = Lazy, Fields = {2, 4, 22, 41})
+            self.assertEqual(Partial.Fields(), {2: 4761739001010010, 4: 1000, 22: 51, 41: "TERM0001"})
+            self.assertEqual(Partial.Field(102), 1)
+            self.assertEqual(Partial.FieldData(48), None)
+        
+        # nothing after the last wanted field is looked at
+        Partial = py8583.Iso8583(IsoMsg[:-19], IsoSpec, Fields = {3, 41})
+        self.assertEqual(Partial.FieldData(41), "TERM0001")
+        
+        Partial.Wanted(None)
+        with self.assertRaises(py8583.ParseError):
+            Partial.SetIsoContent(IsoMsg[:-19])
+        
+        Records = list(py8583.Iso8583.ParseMany([IsoMsg], IsoSpec, Fields = {35}))
+        self.assertEqual(dict(Records[0].Fields()), {35: "4761739001010010=2212"})
+        
+        with self.assertRaisesRegex(ValueError, "Invalid field F129"):
+            py8583.Iso8583(IsoMsg, IsoSpec, Fields = {129})
+
+
+class Peek(unittest.TestCase):
+    
+    def test_Peek(self):
+        for IsoSpec in (py8583spec.IsoSpec1987ASCII(), py8583spec.IsoSpec1987BCD()):
+            IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+            IsoPacket.MTI("0800")
+            IsoPacket.Field(11, 1)
+            IsoPacket.FieldData(11, 1)
+            IsoPacket.Field(70, 1)
+            IsoPacket.FieldData(70, 301)
+            IsoMsg = IsoPacket.BuildIso()
+            
+            for buf in (IsoMsg, memoryview(IsoMsg)):
+                self.assertEqual(py8583.PeekMTI(buf, IsoSpec), "0800")
+                Bitmap = py8583.PeekBitmap(buf, IsoSpec)
+                self.assertEqual(list(Bitmap.Fields()), [11, 70])
+                self.assertTrue(Bitmap.Test(70))
+            
+            with self.assertRaisesRegex(py8583.ParseError, "Invalid bitmap"):
+                py8583.PeekBitmap(IsoMsg[:12], IsoSpec)
+            with self.assertRaisesRegex(py8583.ParseError, "Invalid MTI"):
+                py8583.PeekMTI(IsoMsg[:1], IsoSpec)
+
+class Numeric(unittest.TestCase):
+    
+    def test_Bcd(self):
+        for Value in (0, 7, 42, 99, 1234, 123456789012):
+            self.assertEqual(py8583.Bcd2Int(py8583.Int2Bcd(Value)), Value)
+        self.assertEqual(py8583.Int2Bcd(5), b"\x05")
+        self.assertEqual(py8583.Str2Bcd("123"), b"\x01\x23")
+        self.assertEqual(py8583.Bcd2Str(b"\x01\x23"), "0123")
+        
+        for bcd in (b"\x1A", b"\x01\xA3", b"\x00\x12\x3F", b""):
+            with self.assertRaises(ValueError):
+                py8583.Bcd2Int(bcd)
+    
+    def test_Fields(self):
+        for IsoSpec in (py8583spec.IsoSpec1987ASCII(), py8583spec.IsoSpec1987BCD()):
+            IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+            IsoPacket.MTI("0200")
+            for field, Value in ((3, 30000), (4, 1500), (11, 12), (22, 51), (25, 8), (32, 12345)):
+                IsoPacket.Field(field, 1)
+                IsoPacket.FieldData(field, Value)
+            IsoMsg = IsoPacket.BuildIso()
+            
+            Parsed = py8583.Iso8583(IsoMsg, IsoSpec)
+            self.assertEqual(Parsed.FieldData(3), 30000)
+            self.assertEqual(Parsed.FieldData(4), 1500)
+            self.assertEqual(Parsed.FieldData(11), 12)
+            self.assertEqual(Parsed.FieldData(32), 12345)
+            self.assertEqual(Parsed.FieldData(22), 51)
+            self.assertEqual(Parsed.FieldData(25), 8)
+        
+        # only ints are formatted, as before
+        IsoPacket = py8583.Iso8583(IsoSpec = py8583spec.IsoSpec1987BCD())
+        IsoPacket.MTI("0200")
+        IsoPacket.Field(4, 1)
+        IsoPacket.FieldData(4, "1500")
+        with self.assertRaises(ValueError):
+            IsoPacket.BuildIso()
+
+class Pool(unittest.TestCase):
+    
+    def test_Reuse(self):
+        IsoSpec = py8583spec.IsoSpec1987ASCII()
+        IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+        IsoPacket.MTI("0200")
+        for field, Value in ((3, 0), (11, 1), (41, "TERM0001")):
+            IsoPacket.Field(field, 1)
+            IsoPacket.FieldData(field, Value)
+        Request = IsoPacket.BuildIso()
+        
+        with self.assertRaises(AttributeError):
+            IsoPacket.Extra = 1
+        
+        Pool = py8583.IsoPool(IsoSpec, Size = 1)
+        First = Pool.Get(Request)
+        self.assertEqual(First.FieldData(41), "TERM0001")
+        First.MTI("0210")
+        First.BuildIso()
+        Pool.Put(First)
+        Pool.Put(py8583.Iso8583(IsoSpec = IsoSpec))
+        self.assertEqual(len(Pool), 1)
+        
+        # the recycled message starts empty
+        Second = Pool.Get()
+        self.assertIs(Second, First)
+        self.assertEqual(Second.MTI(), None)
+        self.assertEqual(Second.Fields(), {})
+        self.assertEqual(list(Second.Bitmap().Fields()), [])
+        
+        Second.Reset(Request)
+        self.assertEqual(Second.MTI(), "0200")
+        self.assertEqual(Second.BuildIso(), Request)
+
+class Response(unittest.TestCase):
+    
+    def test_MakeResponse(self):
+        for IsoSpec in (py8583spec.IsoSpec1987ASCII(), py8583spec.IsoSpec1987BCD()):
+            IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+            IsoPacket.MTI("0200")
+            for field, Value in ((2, "4761739001010010"), (3, 0), (4, 1500), (11, 7), (35, "4761739001010010=2212"),
+                                 (41, "TERM0001"), (52, "0123456789ABCDEF"), (70, 301)):
+                IsoPacket.Field(field, 1)
+                IsoPacket.FieldData(field, Value)
+            Request = py8583.Iso8583(IsoPacket.BuildIso(), IsoSpec)
+            
+            Response = Request.MakeResponse({39: "00", 38: "AB1234"}, Drop = (2, 35, 52, 70))
+            
+            # same as building it field by field, without the secondary bitmap
+            Expected = py8583.Iso8583(IsoSpec = IsoSpec)
+            Expected.MTI("0210")
+            for field, Value in ((3, 0), (4, 1500), (11, 7), (38, "AB1234"), (39, "00"), (41, "TERM0001")):
+                Expected.Field(field, 1)
+                Expected.FieldData(field, Value)
+            self.assertEqual(Response, Expected.BuildIso())
+            
+            Parsed = py8583.Iso8583(Response, IsoSpec)
+            self.assertEqual(Parsed.MTI(), "0210")
+            self.assertEqual(list(Parsed.Bitmap().Fields()), [3, 4, 11, 38, 39, 41])
+            
+            # fields after the last echoed one, and a secondary bitmap
+            Response = py8583.Iso8583(Response, IsoSpec).MakeResponse({70: 1, 2: "12345678"}, MTI = "0230")
+            self.assertEqual(sorted(py8583.Iso8583(Response, IsoSpec).Fields().items()),
+                             [(2, 12345678), (3, 0), (4, 1500), (11, 7), (38, "AB1234"), (39, "00"),
+                              (41, "TERM0001"), (70, 1)])
+            
+            with self.assertRaisesRegex(ValueError, "Not a request"):
+                Parsed.MakeResponse()
+            with self.assertRaisesRegex(ValueError, "Error building F39"):
+                Request.MakeResponse({39: "000"})
+        
+        with self.assertRaises(py8583.BuildError):
+            py8583.Iso8583().MakeResponse()
+
+class Incremental(unittest.TestCase):
+    
+    def test_Build(self):
+        IsoSpec = py8583spec.IsoSpec1987ASCII()
+        # F4 isn't zero padded the way it would be built
+        IsoMsg = b"0200" b"3020000000800000" b"000000" b"  0000001500" b"000007" b"TERM0001"
+        
+        for Lazy in (False, True):
+            IsoPacket = py8583.Iso8583(IsoMsg, IsoSpec, Lazy = Lazy)
+            # unchanged fields are copied as they are
+            self.assertEqual(IsoPacket.BuildIso(), IsoMsg)
+            
+            IsoPacket.MTI("0210")
+            IsoPacket.FieldData(41, "GW000001")
+            IsoPacket.Field(39, 1)
+            IsoPacket.FieldData(39, "00")
+            IsoPacket.Field(3, 0)
+            Expected = b"0210" b"1020000002800000" b"  0000001500" b"000007" b"00" b"GW000001"
+            self.assertEqual(IsoPacket.BuildIso(), Expected)
+            
+            IsoPacket.FieldData(11, 8)
+            self.assertEqual(IsoPacket.BuildIso(), Expected.replace(b"000007", b"000008"))
+        
+        # after handing out Fields() everything is built again
+        IsoPacket = py8583.Iso8583(IsoMsg, IsoSpec)
+        IsoPacket.Fields()[4] = 1600
+        self.assertEqual(IsoPacket.BuildIso(), IsoMsg.replace(b"  0000001500", b"000000001600"))
+
+class Translate(unittest.TestCase):
+    
+    def test_Translate(self):
+        BCD = py8583spec.IsoSpec1987BCD()
+        ASCII = py8583spec.IsoSpec1987ASCII()
+        
+        IsoPacket = py8583.Iso8583(IsoSpec = BCD)
+        IsoPacket.MTI("0200")
+        for field, Value in ((2, "4761739001010010"), (3, 0), (4, 1500), (11, 7), (22, 51), (32, 123),
+                             (35, "4761739001010010=2212201"), (41, "TERM0001"), (52, "0123456789ABCDEF"),
+                             (55, "9F2608AABBCCDDEEFF0011"), (60, "ABCD")):
+            IsoPacket.Field(field, 1)
+            IsoPacket.FieldData(field, Value)
+        IsoMsg = IsoPacket.BuildIso()
+        
+        # the same as parsing and building again
+        Expected = py8583.Iso8583(IsoSpec = ASCII)
+        Expected.MTI("0200")
+        for field, Value in py8583.Iso8583(IsoMsg, BCD).Fields().items():
+            Expected.Field(field, 1)
+            Expected.FieldData(field, Value)
+        Translated = py8583translate.IsoTranslator(BCD, ASCII).Translate(IsoMsg)
+        self.assertEqual(Translated, Expected.BuildIso())
+        
+        self.assertEqual(py8583translate.IsoTranslator(ASCII, BCD).Translate(Translated), IsoMsg)
+        
+        # numeric digits are kept as they are
+        Translated = py8583translate.IsoTranslator(ASCII, BCD).Translate(b"0200" b"0000000100000000" b"0500123")
+        self.assertEqual(Translated, b"\x02\x00" b"\x00\x00\x00\x01\x00\x00\x00\x00" b"\x05\x00\x01\x23")
+        
+    def test_Rules(self):
+        BCD = py8583spec.IsoSpec1987BCD()
+        ASCII = py8583spec.IsoSpec1987ASCII()
+        Rules = {'MTI': lambda MTI: "0100", 41: lambda Value: "HOST" + Value[4:], 52: lambda Value: None}
+        Translator = py8583translate.IsoTranslator(BCD, ASCII, Rules)
+        
+        IsoPacket = py8583.Iso8583(IsoSpec = BCD)
+        IsoPacket.MTI("0200")
+        for field, Value in ((11, 7), (41, "TERM0001"), (52, "0123456789ABCDEF")):
+            IsoPacket.Field(field, 1)
+            IsoPacket.FieldData(field, Value)
+        
+        Translated = py8583.Iso8583(Translator.Translate(IsoPacket.BuildIso()), ASCII)
+        self.assertEqual(Translated.MTI(), "0100")
+        self.assertEqual(Translated.Fields(), {11: 7, 41: "HOST0001"})
+        
+        # values the target spec can't hold
+        Translator = py8583translate.IsoTranslator(BCD, ASCII, {41: lambda Value: Value * 2})
+        with self.assertRaisesRegex(py8583.BuildError, "Error translating F41"):
+            Translator.Translate(IsoPacket.BuildIso())
+
+class TLV(unittest.TestCase):
+
+    ICC = "9F02060000000015009F0306000000000000" "5F2A020978" "82025C00" "9F1A020300" "7003500141" "9F10" + "81" "80" + "11" * 128
+
+    def test_Decode(self):
+        Tlv = py8583tlv.IsoTLV(self.ICC)
+        self.assertEqual(Tlv.Tags(), ['9F02', '9F03', '5F2A', '82', '9F1A', '70', '9F10'])
+        self.assertEqual(Tlv.Number('9F02'), 1500)
+        self.assertEqual(Tlv['5F2A'], b'\x09\x78')
+        self.assertEqual(Tlv.Hex('82'), "5C00")
+        self.assertEqual(len(Tlv.Value('9F10')), 128)
+        self.assertEqual(Tlv.TLV('70').Text('50'), "A")
+        self.assertEqual(Tlv.Value('9F26'), None)
+        self.assertFalse('9F26' in Tlv)
+        self.assertEqual(Tlv.Pack(), binascii.unhexlify(self.ICC))
+
+        # padding between data objects is skipped
+        self.assertEqual(py8583tlv.IsoTLV("00820200FFFF").Tags(), ['82'])
+
+        for Bad in ("9F", "9F0205", "9F02850000000001", "9F"):
+            with self.assertRaises(py8583.ParseError):
+                py8583tlv.IsoTLV(Bad).Tags()
+
+    def test_Build(self):
+        Tlv = py8583tlv.IsoTLV(self.ICC)
+        Tlv['9F02'] = b'\x00\x00\x00\x00\x20\x00'
+        Tlv['9F26'] = b'\xAA' * 8
+        del Tlv['9F10']
+        self.assertEqual(Tlv.Number('9F02'), 2000)
+        self.assertEqual(Tlv.Tags(), ['9F02', '9F03', '5F2A', '82', '9F1A', '70', '9F26'])
+
+        Packed = py8583tlv.IsoTLV(Tlv.Pack())
+        self.assertEqual([(Tag, Packed[Tag]) for Tag in Packed], [(Tag, Tlv[Tag]) for Tag in Tlv])
+        self.assertEqual(Tlv.Hex().startswith("9F0206000000002000"), True)
+
+        # a removed tag set again keeps its place
+        Tlv['9F10'] = b'\x11' * 200
+        Packed = py8583tlv.IsoTLV(Tlv.Pack())
+        self.assertEqual(Packed.Tags()[-2:], ['9F10', '9F26'])
+        self.assertEqual(Packed.Span('9F10')[1] - Packed.Span('9F10')[0], 200)
+
+        with self.assertRaises(py8583.BuildError):
+            Tlv['XY'] = b''
+
+    def test_Case(self):
+        # BER tags are hex, in either case
+        Tlv = py8583tlv.IsoTLV(self.ICC)
+        self.assertEqual(Tlv['9f02'], Tlv['9F02'])
+        self.assertEqual(Tlv.Span('5f2a'), Tlv.Span('5F2A'))
+        self.assertTrue('9f10' in Tlv)
+        self.assertEqual(Tlv.TLV('70').Text('50'), "A")
+        
+        Tlv.Set('9f02', b'\x00\x00\x00\x00\x20\x00')
+        self.assertEqual(Tlv.Number('9F02'), 2000)
+        del Tlv['9f03']
+        self.assertEqual(Tlv.Tags(), ['9F02', '5F2A', '82', '9F1A', '70', '9F10'])
+        self.assertEqual(py8583tlv.IsoTLV(Tlv.Pack()).Tags(), Tlv.Tags())
+        
+        # text tags are taken as they are
+        Tlv = py8583tlv.IsoTLV(b"ab003ABC", py8583tlv.TextFormat(2, 3))
+        self.assertEqual(Tlv.Text('ab'), "ABC")
+        self.assertFalse('AB' in Tlv)
+
+    def test_Text(self):
+        Format = py8583tlv.TextFormat(2, 3)
+        Tlv = py8583tlv.IsoTLV(b"01003ABC02000" b"10005HELLO", Format)
+        self.assertEqual(Tlv.Tags(), ['01', '02', '10'])
+        self.assertEqual(Tlv.Text('10'), "HELLO")
+        self.assertEqual(Tlv.Text('02'), "")
+
+        Tlv['02'] = b'XY'
+        self.assertEqual(Tlv.Pack(), b"01003ABC02002XY10005HELLO")
+
+        with self.assertRaises(py8583.ParseError):
+            py8583tlv.IsoTLV(b"01009ABC", Format).Tags()
+
+    def test_Field(self):
+        for Lazy in (False, True):
+            for Spec in (py8583spec.IsoSpec1987BCD(), py8583spec.IsoSpec1987ASCII()):
+                IsoPacket = py8583.Iso8583(IsoSpec = Spec)
+                IsoPacket.MTI("0100")
+                # F48 is binary in the BCD spec
+                F48 = "01003ABC" if Spec.ContentType(48) != 'b' else "3031303033414243"
+                for field, Value in ((11, 7), (48, F48), (55, self.ICC)):
+                    IsoPacket.Field(field, 1)
+                    IsoPacket.FieldData(field, Value)
+                IsoMsg = IsoPacket.BuildIso()
+
+                IsoPacket = py8583.Iso8583(IsoMsg, Spec, Lazy = Lazy)
+                Tlv = IsoPacket.TLV(55)
+                self.assertEqual(Tlv.Number('9F02'), 1500)
+                self.assertEqual(IsoPacket.TLV(48, Format = py8583tlv.TextFormat(2, 3)).Text('01'), "ABC")
+                self.assertEqual(IsoPacket.TLV(62), None)
+
+                # back into the field
+                Tlv['9F02'] = b'\x00\x00\x00\x00\x20\x00'
+                IsoPacket.TLV(55, Tlv)
+                Rebuilt = py8583.Iso8583(IsoPacket.BuildIso(), Spec)
+                self.assertEqual(Rebuilt.TLV(55).Number('9F02'), 2000)
+                self.assertEqual(Rebuilt.FieldData(11), 7)
+                self.assertEqual(Rebuilt.TLV(55).Value('9F10'), b'\x11' * 128)
+
+class Stats(unittest.TestCase):
+    
+    def test_SameBytes(self):
+        # instrumentation doesn't change what is built
+        IsoSpec = py8583spec.IsoSpec1987ASCII()
+        IsoMsg = b"0200" b"7000000000000000" b"164761739001010010" b"000000" b"  0000001500"
+        Corrupt = IsoMsg[:24] + b"47617390010100AA" + IsoMsg[40:]
+        
+        for Message, Options, Change in ((IsoMsg, {}, None), (IsoMsg, {'Fields': {4}}, None),
+                                         (Corrupt, {'Lazy': True}, None), (IsoMsg, {}, (3, 1))):
+            Built = []
+            for Sink in (None, py8583stats.HistogramRegistry()):
+                IsoPacket = py8583.Iso8583(Message, IsoSpec, **Options)
+                IsoPacket.Stats(Sink)
+                if(Change != None):
+                    IsoPacket.FieldData(*Change)
+                Built.append(IsoPacket.BuildIso())
+            self.assertEqual(Built[0], Built[1])
+        self.assertEqual(Built[1], IsoMsg.replace(b"000000  ", b"000001  "))
+    
+    def test_Wanted(self):
+        # the same fields are parsed with a sink, none if none is wanted
+        IsoSpec = py8583spec.IsoSpec1987ASCII()
+        IsoMsg = b"0200" b"7000000000000000" b"XX4761739001010010" b"000000" b"  0000001500"
+        for Sink in (None, py8583stats.HistogramRegistry()):
+            IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec, Fields = set())
+            IsoPacket.Stats(Sink)
+            IsoPacket.SetIsoContent(IsoMsg)
+            self.assertEqual(IsoPacket.MTI(), "0200")
+            
+            # F3 is after the corrupt F2
+            IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec, Fields = {3})
+            IsoPacket.Stats(Sink)
+            with self.assertRaises(py8583.ParseError):
+                IsoPacket.SetIsoContent(IsoMsg)
+    
+    def test_Registry(self):
+        Registry = py8583stats.HistogramRegistry()
+        IsoSpec = py8583spec.IsoSpec1987ASCII()
+        
+        IsoPacket = py8583.Iso8583(IsoSpec = IsoSpec)
+        IsoPacket.Stats(Registry)
+        IsoPacket.MTI("0800")
+        IsoPacket.Field(11, 1)
+        IsoPacket.FieldData(11, 123456)
+        IsoPacket.Field(41, 1)
+        IsoPacket.FieldData(41, "TERM0001")
+        IsoMsg = IsoPacket.BuildIso()
+        
+        IsoPacket.SetIsoContent(IsoMsg)
+        
+        Snapshot = Registry.Snapshot()
+        self.assertEqual(Snapshot[('IsoSpec1987ASCII', '0800', 'build', None)]['bytes'], len(IsoMsg))
+        self.assertEqual(Snapshot[('IsoSpec1987ASCII', '0800', 'parse', None)]['bytes'], len(IsoMsg))
+        self.assertEqual(Snapshot[('IsoSpec1987ASCII', '0800', 'field', 41)]['count'], 2)
+        self.assertEqual(Snapshot[('IsoSpec1987ASCII', '0800', 'field', 41)]['bytes'], 16)
+        self.assertEqual(Snapshot[('IsoSpec1987ASCII', '0800', 'bitmap', None)]['bytes'], 32)
+        
+        # invalid numeric data counts as an error of F11
+        with self.assertRaises(py8583.ParseError):
+            IsoPacket.SetIsoContent(IsoMsg.replace(b"123456", b"12A456"))
+        Snapshot = Registry.Snapshot()
+        self.assertEqual(Snapshot[('IsoSpec1987ASCII', '0800', 'field', 11)]['errors'], 1)
+        self.assertEqual(Snapshot[('IsoSpec1987ASCII', '0800', 'parse', None)]['errors'], 1)
+        
+        Text = py8583stats.PrometheusText(Registry)
+        self.assertIn('py8583_phase_seconds_count{spec="IsoSpec1987ASCII",mti="0800",phase="field",field="41"} 2', Text)
+        self.assertIn('py8583_errors_total{spec="IsoSpec1987ASCII",mti="0800",phase="parse"} 1', Text)
+        
+        # label values are escaped
+        Registry.Reset()
+        Registry.Record('Host "A"\\B\nC', '0800', 'parse', None, 1e-5, 10)
+        Text = py8583stats.PrometheusText(Registry)
+        self.assertIn('py8583_phase_bytes_total{spec="Host \\"A\\"\\\\B\\nC",mti="0800",phase="parse"} 10', Text)
+        self.assertEqual(len(Text.splitlines()), 3 + 14 + 3)
+        
+        # instrumentation is off for other messages
+        self.assertEqual(py8583.Iso8583.stats, None)
+        
+    def test_Callback(self):
+        Events = []
+        IsoPacket = py8583.Iso8583(IsoSpec = py8583spec.IsoSpec1987ASCII())
+        IsoPacket.Stats(py8583stats.CallbackSink(lambda *Event: Events.append(Event[:5])))
+        
+        with self.assertRaises(py8583.ParseError):
+            IsoPacket.SetIsoContent(b"080A")
+        self.assertEqual(Events, [('error', 'IsoSpec1987ASCII', None, 'mti', None),
+                                  ('error', 'IsoSpec1987ASCII', None, 'parse', None)])
+
+
+class Logging(unittest.TestCase):
+    
+    def test_MemDump(self):
+        data = b"0800\x00\x01ABC\r\n" + bytes(range(0x7d, 0x82))
+        
+        self.assertEqual(py8583.MemDumpString(data, 8),
+                         "\n30 38 30 30 00 01 41 42  | 0800..AB\n"
+                         "43 0d 0a 7d 7e 7f 80 81  | C..}~...\n")
+        self.assertEqual(py8583.MemDumpString(data[:10], 8),
+                         "\n30 38 30 30 00 01 41 42  | 0800..AB\n"
+                         "43 0d                    | C.\n")
+        
+        Dump = py8583.MemDumpDict("Received", data, 8)
+        self.assertEqual(Dump['length'], 16)
+        self.assertEqual(Dump['lines'][1], {'offset': 8, 'hex': "43 0d 0a 7d 7e 7f 80 81", 'ascii': "C..}~..."})
+        
+    def test_DebugMessage(self):
+        IsoSpec = py8583spec.IsoSpec1987BCD()
+        # F4 has invalid BCD data
+        IsoMsg = binascii.unhexlify("02003000000000000000" "000000" "00000000ABCD")
+        
+        # nothing is formatted (or decoded) below the logger's level
+        IsoPacket = py8583.Iso8583(IsoMsg, IsoSpec, Lazy = True)
+        IsoPacket.DebugMessage(logging.NOTSET + 1)
+        
+        with self.assertRaises(py8583.ParseError):
+            with self.assertLogs('py8583', logging.DEBUG):
+                IsoPacket.DebugMessage(logging.DEBUG)
+
+
 if __name__ == '__main__':
     unittest.main()